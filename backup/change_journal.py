@@ -0,0 +1,316 @@
+"""
+Change journal for rsync_backup.
+
+A long-running watcher records the paths that change under the source tree
+into a compact append-only journal, so the next sync only visits those
+paths instead of walking the whole tree. Linux uses inotify (through
+ctypes, no extra packages); elsewhere the watcher falls back to polling the
+tree, which moves the full scan off the backup's critical path.
+
+Journal format, one record per line:
+    S <session>        first line, written when the watcher starts
+    ["M", "a/b.txt"]   path created or modified (a directory means its subtree)
+    ["D", "a/old"]     path deleted or moved away
+    O                  events were lost (kernel queue overflow, watch limit)
+
+The watcher holds an exclusive flock on the journal while it runs. A sync
+falls back to a full scan when the journal is missing, unlocked (watcher not
+running, so changes may have been missed), from a different session than
+the last sync consumed (watcher restarted), or contains an overflow marker.
+A journal that grows past JOURNAL_MAX is restarted as a new session.
+
+Example of usage:
+    python3 change_journal.py ~/Documents &
+    python3 rsync_backup.py --journal ~/.rsync_backup.journal
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import ctypes
+import ctypes.util
+import select
+import signal
+import struct
+import argparse
+
+from exclude import ExcludeMatcher, walk
+
+JOURNAL = os.path.expanduser("~/.rsync_backup.journal")
+JOURNAL_MAX = 64 * 1024 * 1024
+FLUSH_INTERVAL = 1.0
+POLL_INTERVAL = 30.0
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+)
+EVENT_HEADER = struct.Struct("iIII")
+OVERFLOW = ("O", None)
+
+
+class InotifyWatcher:
+    def __init__(self, root, matcher):
+        self.root = root
+        self.matcher = matcher
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        self.overflowed = False
+        self.add_tree("")
+
+    def add_tree(self, rel_dir):
+        """Watch rel_dir and every non-excluded directory below it"""
+        top = os.path.join(self.root, rel_dir)
+        prefix = rel_dir + "/" if rel_dir else ""
+        for root, rel_root, dirs, files in walk(top, self.matcher):
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(root), ctypes.c_uint32(WATCH_MASK)
+            )
+            if wd < 0:
+                # Typically ENOSPC from fs.inotify.max_user_watches
+                self.overflowed = True
+                continue
+            self.dirs[wd] = (prefix + rel_root).rstrip("/")
+
+    def events(self, timeout):
+        """Yield (op, rel_path) for events arriving within timeout seconds"""
+        if self.overflowed:
+            self.overflowed = False
+            yield OVERFLOW
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return
+        buf = os.read(self.fd, 256 * 1024)
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buf[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                yield OVERFLOW
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            parent = self.dirs.get(wd)
+            if parent is None or mask & IN_DELETE_SELF:
+                continue
+            rel_path = f"{parent}/{name}" if parent else name
+            is_dir = bool(mask & IN_ISDIR)
+            if self.matcher.match(rel_path, is_dir):
+                continue
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                yield "D", rel_path
+            elif not is_dir:
+                yield "M", rel_path
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                # A new subtree: watch it and let the sync walk all of it
+                self.add_tree(rel_path)
+                yield "M", rel_path
+
+
+class PollingWatcher:
+    """Fallback for platforms without inotify: diff periodic stat snapshots"""
+
+    def __init__(self, root, matcher, interval=POLL_INTERVAL):
+        self.root = root
+        self.matcher = matcher
+        self.interval = interval
+        self.snapshot = self.scan()
+        self.next_scan = time.monotonic() + interval
+
+    def scan(self):
+        snapshot = {}
+        for root, rel_root, dirs, files in walk(self.root, self.matcher):
+            for f in files:
+                try:
+                    st = f.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                snapshot[rel_root + f.name] = (st.st_size, st.st_mtime_ns, st.st_ino)
+        return snapshot
+
+    def events(self, timeout):
+        wait = self.next_scan - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return
+        time.sleep(max(wait, 0))
+        self.next_scan = time.monotonic() + self.interval
+        current = self.scan()
+        for rel_path, state in current.items():
+            if self.snapshot.get(rel_path) != state:
+                yield "M", rel_path
+        for rel_path in self.snapshot.keys() - current.keys():
+            yield "D", rel_path
+        self.snapshot = current
+
+
+class JournalWriter:
+    def __init__(self, path, max_size=JOURNAL_MAX):
+        self.max_size = max_size
+        self.f = open(path, "a")
+        try:
+            fcntl.flock(self.f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(f"another watcher is already writing {path}")
+        self.new_session()
+
+    def new_session(self):
+        self.session = f"{time.time_ns()}-{os.getpid()}"
+        self.f.truncate(0)
+        self.f.write(f"S {self.session}\n")
+        self.sync()
+
+    def write(self, pending, overflow=False):
+        if overflow:
+            self.f.write("O\n")
+        for rel_path, op in pending.items():
+            self.f.write(json.dumps([op, rel_path]) + "\n")
+        self.sync()
+        # Starting over costs the next sync one full scan
+        if self.f.tell() > self.max_size:
+            self.new_session()
+
+    def sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+
+def read_journal(path, position):
+    """Return (changes, new_position) for the records after position.
+
+    position is the {"session", "offset"} saved by the previous sync.
+    changes maps each path to its last operation, "M" or "D", or is None
+    when a full scan is needed instead. new_position is where the next sync
+    should resume, or None if no watcher is running.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None, None
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            # We got the lock, so no watcher is running to record changes
+            return None, None
+        except BlockingIOError:
+            pass
+        header = f.readline().decode()
+        if not header.startswith("S "):
+            return None, None
+        session = header[2:].strip()
+        # A restarted watcher may have missed changes: scan everything and
+        # resume from the current end of its journal next time
+        resume = position and position.get("session") == session
+        if resume:
+            f.seek(max(position["offset"], f.tell()))
+        changes = {}
+        offset = f.tell()
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # partially written record; read it next time
+            offset += len(line)
+            if not resume:
+                continue
+            if line.startswith(b"O"):
+                resume = False
+                continue
+            op, rel_path = json.loads(line)
+            changes[rel_path] = op
+        new_position = {"session": session, "offset": offset}
+        return (changes if resume else None), new_position
+
+
+def watch(src, journal, patterns, poll_interval=POLL_INTERVAL):
+    matcher = ExcludeMatcher(patterns)
+    try:
+        watcher = InotifyWatcher(src, matcher)
+        kind = "inotify"
+    except (OSError, AttributeError, TypeError):
+        watcher = PollingWatcher(src, matcher, poll_interval)
+        kind = f"polling every {poll_interval:.0f}s"
+    writer = JournalWriter(journal)
+    print(f"[i] Watching {src} ({kind}), journal {journal} session {writer.session}")
+
+    running = True
+
+    def stop(signum, frame):
+        nonlocal running
+        running = False
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    pending = {}
+    overflow = False
+    last_flush = time.monotonic()
+    while running:
+        for op, rel_path in watcher.events(FLUSH_INTERVAL):
+            if op == "O":
+                overflow = True
+            else:
+                pending.pop(rel_path, None)  # keep the latest op last
+                pending[rel_path] = op
+        if (pending or overflow) and time.monotonic() - last_flush >= FLUSH_INTERVAL:
+            writer.write(pending, overflow)
+            pending.clear()
+            overflow = False
+            last_flush = time.monotonic()
+    if pending or overflow:
+        writer.write(pending, overflow)
+    print("[i] Watcher stopped")
+
+
+def main():
+    # Imported here: rsync_backup imports this module for read_journal
+    from rsync_backup import SRC, EXCLUDE
+
+    parser = argparse.ArgumentParser(
+        description="Record changed paths for rsync_backup"
+    )
+    parser.add_argument("src", nargs="?", default=SRC, help="Directory to watch")
+    parser.add_argument("--journal", default=JOURNAL, help="Journal file")
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=POLL_INTERVAL,
+        help="Seconds between scans when inotify is unavailable",
+    )
+    args = parser.parse_args()
+    try:
+        watch(args.src, args.journal, EXCLUDE, args.poll_interval)
+    except RuntimeError as e:
+        print(f"[Error] {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Hash-on-write checksum manifests for backup outputs.
+
+HashingWriter wraps a binary file object and digests every byte as it is
+written, so backups get their checksums without re-reading the output.
+Manifests use the sha256sum format ("<hex digest>  <path>"), so they can
+also be checked with `sha256sum -c` from the manifest's directory.
+
+Example of usage:
+    python3 checksum.py verify /mnt/backup_drive/home_backup/home.tar.gz.sha256
+    python3 checksum.py verify /mnt/backup_drive/incremental_docs/SHA256SUMS -w 8
+"""
+
+import os
+import sys
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+HASH_BUFSIZE = 1024 * 1024
+SUMS_NAME = "SHA256SUMS"
+
+
+class HashingWriter:
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.digest = hashlib.sha256()
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.bytes_written += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+def write_manifest(path, digests):
+    """Write {relative path: hex digest} as a sha256sum-style manifest"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        for rel_path in sorted(digests):
+            f.write(f"{digests[rel_path]}  {rel_path}\n")
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_manifest(path):
+    digests = {}
+    with open(path) as f:
+        for line in f:
+            digest, rel_path = line.rstrip("\n").split("  ", 1)
+            digests[rel_path] = digest
+    return digests
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            buf = f.read(HASH_BUFSIZE)
+            if not buf:
+                return digest.hexdigest()
+            digest.update(buf)
+
+
+def verify(manifest_path, workers=None):
+    """Check every file in a manifest; returns {relative path: status}.
+
+    Files are hashed concurrently: hashlib releases the GIL on large
+    buffers, so threads scale across cores and overlap I/O.
+    """
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    expected = read_manifest(manifest_path)
+
+    def check(rel_path):
+        try:
+            actual = file_digest(os.path.join(base, rel_path))
+        except FileNotFoundError:
+            return rel_path, "missing"
+        except OSError as e:
+            return rel_path, f"unreadable ({e.strerror or e})"
+        return rel_path, "ok" if actual == expected[rel_path] else "mismatch"
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        return dict(executor.map(check, expected))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backup checksum manifests")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("verify", help="Verify a backup against its manifest")
+    p.add_argument("manifest", help="Manifest file (.sha256 or SHA256SUMS)")
+    p.add_argument(
+        "-w", "--workers", type=int, default=None, help="Files hashed in parallel"
+    )
+    args = parser.parse_args()
+
+    results = verify(args.manifest, args.workers)
+    failed = {p: s for p, s in results.items() if s != "ok"}
+    for rel_path, status in sorted(failed.items()):
+        print(f"[Error] {rel_path}: {status}")
+    if failed:
+        print(f"[Error] {len(failed)} of {len(results)} file(s) failed verification.")
+        sys.exit(1)
+    print(f"[Success] {len(results)} file(s) verified.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,87 @@
-import boto3
+import time
+import random
+import argparse
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-ec2 = boto3.client("ec2")
+VOLUME_FILTERS = [{"Name": "tag:Backup", "Values": ["True"]}]
+MAX_WORKERS = 8
+MAX_ATTEMPTS = 8
+THROTTLE_CODES = {
+    "RequestLimitExceeded",
+    "Throttling",
+    "ThrottlingException",
+    "SnapshotCreationPerVolumeRateExceeded",
+}
 
 
-def create_snapshots():
-    volumes = ec2.describe_volumes(Filters=[{"Name": "tag:Backup", "Values": ["True"]}])
-    for vol in volumes["Volumes"]:
-        vol_id = vol["VolumeId"]
-        date = datetime.datetime.now().strftime("%Y-%m-%d")
-        print(f"Creating snapshot for Volume {vol_id}")
-        ec2.create_snapshot(
+def make_client(region):
+    import boto3
+
+    return boto3.client("ec2", region_name=region)
+
+
+class AdaptiveBackoff:
+    """Shared per-region delay: doubles on throttling, halves on success"""
+
+    def __init__(self, base=0.2, maximum=20.0):
+        self.base = base
+        self.maximum = maximum
+        self.delay = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        delay = self.delay
+        if delay:
+            time.sleep(random.uniform(delay / 2, delay))
+
+    def success(self):
+        with self.lock:
+            self.delay = self.delay / 2 if self.delay > self.base else 0.0
+
+    def throttled(self):
+        with self.lock:
+            self.delay = min(self.maximum, max(self.base, self.delay * 2))
+
+
+def error_code(exc):
+    # botocore's ClientError carries the API error code in .response
+    return getattr(exc, "response", {}).get("Error", {}).get("Code")
+
+
+def call_with_backoff(fn, backoff, **kwargs):
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        backoff.wait()
+        try:
+            result = fn(**kwargs)
+        except Exception as e:
+            if error_code(e) not in THROTTLE_CODES or attempt == MAX_ATTEMPTS:
+                raise
+            backoff.throttled()
+            continue
+        backoff.success()
+        return result
+
+
+def list_volumes(client, backoff):
+    """Yield every tagged volume, following NextToken across pages"""
+    kwargs = {"Filters": VOLUME_FILTERS, "MaxResults": 500}
+    while True:
+        page = call_with_backoff(client.describe_volumes, backoff, **kwargs)
+        yield from page["Volumes"]
+        if not page.get("NextToken"):
+            return
+        kwargs["NextToken"] = page["NextToken"]
+
+
+def snapshot_volume(client, backoff, region, vol_id):
+    date = datetime.datetime.now().strftime("%Y-%m-%d")
+    result = {"region": region, "volume_id": vol_id, "snapshot_id": None, "error": None}
+    try:
+        response = call_with_backoff(
+            client.create_snapshot,
+            backoff,
             VolumeId=vol_id,
             Description=f"Automated backup {date}",
             TagSpecifications=[
@@ -20,6 +91,92 @@ def create_snapshots():
                 }
             ],
         )
+        result["snapshot_id"] = response["SnapshotId"]
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def create_snapshots(regions=None, client_factory=make_client, workers=MAX_WORKERS):
+    """Snapshot every tagged volume in every region concurrently.
+
+    Without regions, only the session's own region is used (as boto3
+    resolves it from AWS_DEFAULT_REGION or the profile). client_factory
+    (region) returns an EC2 client; pass a fake to test without AWS.
+    Returns one result dict per volume with region, volume_id, snapshot_id
+    and error (None on success).
+    """
+    if regions is None:
+        client = client_factory(None)
+        meta = getattr(client, "meta", None)
+        clients = {getattr(meta, "region_name", None) or "default": client}
+    else:
+        clients = {region: client_factory(region) for region in regions}
+    regions = list(clients)
+    backoffs = {region: AdaptiveBackoff() for region in regions}
+    results = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        listings = {
+            executor.submit(list, list_volumes(clients[r], backoffs[r])): r
+            for r in regions
+        }
+        snapshots = []
+        for future in as_completed(listings):
+            region = listings[future]
+            try:
+                volumes = future.result()
+            except Exception as e:
+                print(f"[Error] Listing volumes in {region} failed: {e}")
+                results.append(
+                    {
+                        "region": region,
+                        "volume_id": None,
+                        "snapshot_id": None,
+                        "error": str(e),
+                    }
+                )
+                continue
+            for vol in volumes:
+                print(f"Creating snapshot for Volume {vol['VolumeId']} ({region})")
+                snapshots.append(
+                    executor.submit(
+                        snapshot_volume,
+                        clients[region],
+                        backoffs[region],
+                        region,
+                        vol["VolumeId"],
+                    )
+                )
+        results.extend(future.result() for future in snapshots)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Snapshot tagged EBS volumes")
+    parser.add_argument(
+        "-r",
+        "--regions",
+        nargs="+",
+        help="Regions to scan (default: the session's region)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="Concurrent API calls",
+    )
+    return parser.parse_args()
 
 
-create_snapshots()
+if __name__ == "__main__":
+    args = parse_args()
+    results = create_snapshots(args.regions, workers=args.workers)
+    failed = [r for r in results if r["error"]]
+    for r in failed:
+        print(f"[Error] {r['region']} {r['volume_id']}: {r['error']}")
+    print(
+        f"[Success] {len(results) - len(failed)} snapshot(s) created, "
+        f"{len(failed)} failed."
+    )
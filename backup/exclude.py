@@ -0,0 +1,214 @@
+"""
+Shared exclusion engine for the backup walkers.
+
+Patterns follow .gitignore rules:
+    name        matches a file or directory called name at any depth
+    *.log       globs match within one path component (* and ? never match /)
+    build/      a trailing slash matches directories only
+    docs/tmp    a slash inside the pattern anchors it to the backup root
+    **/cache    ** matches any number of directories
+    !keep.log   a leading ! re-includes what an earlier pattern excluded
+
+Patterns are compiled once into a single regular expression. walk() is an
+os.scandir based replacement for os.walk that prunes excluded directories
+instead of descending into them, and hands out DirEntry objects so callers
+can reuse their cached stat results.
+
+Benchmark (builds a synthetic tree, then compares with the old approach):
+    python3 exclude.py --benchmark --entries 2000000
+"""
+
+import os
+import re
+import time
+import shutil
+import argparse
+import tempfile
+
+
+def translate(pattern):
+    """Translate one gitignore glob into a regex over the relative path"""
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == n:
+            out.append("/.*")
+            i += 3
+        elif c == "*":
+            out.append("[^/]*")
+            i += 1
+        elif c == "?":
+            out.append("[^/]")
+            i += 1
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                out.append(re.escape(c))
+                i += 1
+            else:
+                body = pattern[i + 1 : end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = end + 1
+        else:
+            out.append(re.escape(c))
+            i += 1
+    regex = "".join(out)
+    return regex if anchored else "(?:.*/)?" + regex
+
+
+class ExcludeMatcher:
+    def __init__(self, patterns):
+        self.rules = []
+        for raw in patterns:
+            pattern = raw.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negate = pattern.startswith("!")
+            if negate:
+                pattern = pattern[1:]
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            self.rules.append(
+                (re.compile(translate(pattern) + r"\Z"), negate, dir_only)
+            )
+
+        # Without negations, order does not matter and every rule can be
+        # folded into one alternation per entry type
+        self.ordered = any(negate for _, negate, _ in self.rules)
+        self.file_regex = self._combine(r for r, _, d in self.rules if not d)
+        self.dir_regex = self._combine(r for r, _, _ in self.rules)
+
+    @staticmethod
+    def _combine(regexes):
+        parts = [r.pattern for r in regexes]
+        if not parts:
+            return None
+        return re.compile("|".join(f"(?:{p})" for p in parts))
+
+    def match(self, rel_path, is_dir=False):
+        """True if rel_path (relative to the walk root, / separated) is excluded"""
+        if not self.ordered:
+            regex = self.dir_regex if is_dir else self.file_regex
+            return regex is not None and regex.match(rel_path) is not None
+        for regex, negate, dir_only in reversed(self.rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                return not negate
+        return False
+
+
+def walk(top, matcher=None):
+    """Yield (root, rel_root, dirs, files) like os.walk, with DirEntry lists.
+
+    Excluded directories are pruned before descending and excluded files
+    are dropped. Symlinks to directories are listed in files and never
+    followed. rel_root is "" for top. Callers may prune dirs further in
+    place. Unreadable directories are skipped, as os.walk does.
+    """
+    stack = [(top, "")]
+    while stack:
+        root, rel_root = stack.pop()
+        try:
+            with os.scandir(root) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        dirs, files = [], []
+        for entry in entries:
+            rel_path = rel_root + entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                is_dir = False
+            if matcher is not None and matcher.match(rel_path, is_dir):
+                continue
+            (dirs if is_dir else files).append(entry)
+        yield root, rel_root, dirs, files
+        for entry in reversed(dirs):
+            stack.append((entry.path, rel_root + entry.name + "/"))
+
+
+def build_tree(top, entries):
+    """Create a synthetic source tree with roughly the given number of entries.
+
+    A quarter of the directories are node_modules and some hold *.log
+    files, so both pruning and glob matching have something to skip.
+    """
+    per_dir = 100
+    created = 0
+    project = 0
+    while created < entries:
+        base = os.path.join(top, f"project{project}")
+        for sub, count in (("src", 2), ("node_modules", 1), ("logs", 1)):
+            for d in range(count * 5):
+                path = os.path.join(base, sub, f"d{d}")
+                os.makedirs(path, exist_ok=True)
+                ext = ".log" if sub == "logs" and d % 2 else ".txt"
+                for i in range(per_dir):
+                    open(os.path.join(path, f"f{i}{ext}"), "w").close()
+                created += per_dir + 1
+        project += 1
+    return created
+
+
+def benchmark(entries, patterns):
+    top = tempfile.mkdtemp(prefix="exclude_bench_")
+    try:
+        print(f"[i] Building tree with ~{entries} entries in {top}")
+        build_tree(top, entries)
+
+        start = time.perf_counter()
+        kept = 0
+        for root, dirs, files in os.walk(top):
+            for name in files:
+                full_path = os.path.join(root, name)
+                if not any(p in full_path for p in patterns):
+                    os.stat(full_path)
+                    kept += 1
+        old = time.perf_counter() - start
+        print(f"[i] os.walk + substring match: {old:.2f}s, {kept} files kept")
+
+        start = time.perf_counter()
+        matcher = ExcludeMatcher(patterns)
+        kept = 0
+        for root, rel_root, dirs, files in walk(top, matcher):
+            for entry in files:
+                entry.stat()
+                kept += 1
+        new = time.perf_counter() - start
+        print(f"[i] scandir walk + compiled patterns: {new:.2f}s, {kept} files kept")
+        print(f"[i] Speedup: {old / max(new, 1e-9):.1f}x")
+    finally:
+        shutil.rmtree(top, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exclusion engine benchmark")
+    parser.add_argument("--benchmark", action="store_true", help="Run the benchmark")
+    parser.add_argument(
+        "--entries", type=int, default=1000000, help="Approximate tree size"
+    )
+    parser.add_argument(
+        "--patterns",
+        nargs="+",
+        default=["node_modules", ".cache", "*.log"],
+        help="Exclude patterns to benchmark with",
+    )
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.entries, args.patterns)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
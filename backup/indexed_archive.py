@@ -0,0 +1,144 @@
+"""
+Random-access restore for archives written by ParallelCompressor.
+
+ParallelCompressor compresses every block independently, so decompression
+can start at any block boundary. The sidecar index (<archive>.idx) records
+where each block starts in both the compressed and uncompressed stream, and
+the uncompressed offset of every tar member's header. To restore a member we
+seek to the block containing its header and decompress from there, instead
+of inflating the archive from the beginning.
+
+Example of usage:
+    python3 indexed_archive.py list /mnt/backup_drive/home_backup/home.tar.gz
+    python3 indexed_archive.py restore home.tar.gz --path .bashrc --target /tmp/r
+"""
+
+import os
+import sys
+import gzip
+import json
+import tarfile
+import argparse
+from bisect import bisect_right
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_SUFFIX = ".idx"
+SKIP_BUFSIZE = 1024 * 1024
+
+
+class ArchiveIndex:
+    def __init__(self):
+        self.members = {}
+
+    def add(self, tarinfo, header_offset):
+        """Record a member; header_offset is tar.offset before adding it"""
+        self.members[tarinfo.name] = [header_offset, tarinfo.size, tarinfo.mtime]
+
+    def save(self, archive_path, compressor):
+        """Write the sidecar index once the compressor has been closed"""
+        fmt = "zstd" if archive_path.endswith(".zst") else "gzip"
+        data = {
+            "version": 1,
+            "format": fmt,
+            "blocks": compressor.blocks,
+            "members": self.members,
+        }
+        path = archive_path + INDEX_SUFFIX
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+        return path
+
+
+def load_index(archive_path):
+    with open(archive_path + INDEX_SUFFIX) as f:
+        return json.load(f)
+
+
+def open_at(f, index, offset):
+    """Return a decompressed stream over f positioned at uncompressed offset"""
+    blocks = index["blocks"]
+    i = bisect_right([b[0] for b in blocks], offset) - 1
+    block_start, compressed_start = blocks[i]
+    f.seek(compressed_start)
+    if index["format"] == "zstd":
+        if zstandard is None:
+            raise RuntimeError("reading zstd archives requires 'zstandard'")
+        stream = zstandard.ZstdDecompressor().stream_reader(
+            f, read_across_frames=True, closefd=False
+        )
+    else:
+        stream = gzip.GzipFile(fileobj=f)
+    # Skip from the block boundary to the header: at most one block
+    remaining = offset - block_start
+    while remaining:
+        data = stream.read(min(remaining, SKIP_BUFSIZE))
+        if not data:
+            raise ValueError("archive is shorter than its index")
+        remaining -= len(data)
+    return stream
+
+
+def list_members(archive_path):
+    """Return (name, size, mtime) for every member, reading only the index"""
+    index = load_index(archive_path)
+    return [(name, m[1], m[2]) for name, m in index["members"].items()]
+
+
+def restore(archive_path, path, target):
+    """Extract the member at path, or every member under it, into target"""
+    index = load_index(archive_path)
+    prefix = os.path.normpath(path)
+    wanted = sorted(
+        (m[0], name)
+        for name, m in index["members"].items()
+        if name == prefix or name.startswith(prefix + "/")
+    )
+    # "tar" still blocks paths outside target but, unlike "data", restores
+    # absolute symlinks, which backups of system directories contain
+    extract_args = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+    with open(archive_path, "rb") as f:
+        for offset, name in wanted:
+            stream = open_at(f, index, offset)
+            with tarfile.open(fileobj=stream, mode="r|") as tar:
+                member = tar.next()
+                if member is None or member.name != name:
+                    raise ValueError(f"index does not match archive at {name}")
+                tar.extract(member, target, **extract_args)
+    return [name for _, name in wanted]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Indexed archive access")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("list", help="List members using only the index")
+    p.add_argument("archive", help="Archive path (index is <archive>.idx)")
+
+    p = sub.add_parser("restore", help="Restore one file or directory")
+    p.add_argument("archive", help="Archive path (index is <archive>.idx)")
+    p.add_argument("--path", required=True, help="Member path to restore")
+    p.add_argument("--target", default=".", help="Directory to restore into")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "list":
+        for name, size, mtime in list_members(args.archive):
+            print(f"{size:>12}  {mtime}  {name}")
+    elif args.command == "restore":
+        restored = restore(args.archive, args.path, args.target)
+        if not restored:
+            print(f"[Error] {args.path} not found in {args.archive}")
+            sys.exit(1)
+        else:
+            print(f"[Success] Restored {len(restored)} file(s) to {args.target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Parallel block compressor (pigz-style) usable as a write-only file object.
+
+Data written to ParallelCompressor is cut into fixed-size blocks. Each block
+is compressed independently by a thread pool (zlib and zstandard release the
+GIL) and the results are written to the underlying file in order. Every
+block is a complete gzip member (or zstd frame), and concatenated members
+are themselves a valid .gz (or .zst) file, so standard tools read the output.
+
+At most max_inflight blocks are buffered or being compressed at any time,
+which bounds memory to roughly max_inflight * block_size.
+"""
+
+import os
+import gzip
+import zlib
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BLOCK_SIZE = 1024 * 1024
+
+
+def gzip_member(data, level):
+    """Compress data as one self-contained gzip member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(data) + compressor.flush()
+    # Header: magic, deflate, no flags, no mtime, unknown OS (RFC 1952)
+    header = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+    trailer = struct.pack("<II", zlib.crc32(data), len(data) & 0xFFFFFFFF)
+    return header + body + trailer
+
+
+def open_decompressed(path):
+    """Open a .gz or .zst file written by ParallelCompressor for reading"""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("reading zstd archives requires 'zstandard'")
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(path, "rb"), read_across_frames=True, closefd=True
+        )
+    return gzip.open(path, "rb")
+
+
+class ParallelCompressor:
+    def __init__(
+        self,
+        fileobj,
+        fmt="gzip",
+        level=6,
+        workers=None,
+        block_size=BLOCK_SIZE,
+        max_inflight=None,
+    ):
+        if fmt == "zstd":
+            if zstandard is None:
+                raise RuntimeError("zstd output requires the 'zstandard' package")
+            self._compress = self._zstd_block
+        elif fmt == "gzip":
+            self._compress = self._gzip_block
+        else:
+            raise ValueError(f"Unsupported format: {fmt}")
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count() or 1
+        self.max_inflight = max_inflight or self.workers * 2
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.closed = False
+        # (uncompressed offset, compressed offset) of every block written
+        self.blocks = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.start_time = time.monotonic()
+
+    def _gzip_block(self, data):
+        return gzip_member(data, self.level)
+
+    def _zstd_block(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def _write_oldest(self):
+        uncompressed_size, future = self.pending.popleft()
+        data = future.result()
+        self.blocks.append((self.bytes_in, self.bytes_out))
+        self.fileobj.write(data)
+        self.bytes_in += uncompressed_size
+        self.bytes_out += len(data)
+
+    def _submit(self, data):
+        while len(self.pending) >= self.max_inflight:
+            self._write_oldest()
+        self.pending.append((len(data), self.executor.submit(self._compress, data)))
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed ParallelCompressor")
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[: self.block_size]))
+            del self.buffer[: self.block_size]
+        return len(data)
+
+    def flush_block(self):
+        """End the current block early so the next write starts a new one"""
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+
+    def tell(self):
+        """Uncompressed position, as tarfile expects from a stream"""
+        return self.bytes_in + sum(size for size, _ in self.pending) + len(self.buffer)
+
+    def flush(self):
+        self.flush_block()
+        while self.pending:
+            self._write_oldest()
+        self.fileobj.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown()
+            self.closed = True
+
+    def throughput(self):
+        """Uncompressed MB/s since the compressor was created"""
+        return self.bytes_in / max(time.monotonic() - self.start_time, 1e-9) / 1e6
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
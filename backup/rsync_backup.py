@@ -1,37 +1,536 @@
 import os
+import re
+import json
 import shutil
 import filecmp
+import hashlib
+import argparse
+import errno
+import queue
+import threading
+import time
+from datetime import datetime
+
+from exclude import ExcludeMatcher, walk
+from change_journal import read_journal
+from checksum import SUMS_NAME, file_digest, write_manifest
 
 SRC = os.path.expanduser("~/Documents")
 DEST = "/mnt/backup_drive/incremental_docs"
-EXCLUDE = {"node_modules", ".cache", "*.log"}
+EXCLUDE = ["node_modules", ".cache", "*.log"]
+MANIFEST_NAME = ".rsync_backup_manifest.json"
+COPY_BUFSIZE = 1024 * 1024
+ZERO_COPY_MIN = 8 * 1024 * 1024
+ZERO_COPY_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}
+SMALL_FILE_MAX = 256 * 1024
+BATCH_FILES = 64
+BATCH_BYTES = 4 * 1024 * 1024
+EXCLUDE_MATCHER = ExcludeMatcher(EXCLUDE)
+SNAPSHOT_FORMAT = "%Y-%m-%d_%H-%M-%S"
+# A run in the same second as an existing snapshot gets a -N suffix
+SNAPSHOT_RE = re.compile(r"(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})(?:-(\d+))?\Z")
+PARTIAL_SUFFIX = ".partial"
+LATEST_LINK = "latest"
 
-os.makedirs(DEST, exist_ok=True)
 
+def load_manifest(path):
+    """Load the manifest, or an empty one if missing or unreadable"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-def should_exclude(name):
-    return any(p in name for p in EXCLUDE)
 
+def save_manifest(path, entries, journal=None):
+    """Write the manifest atomically so an interrupted run keeps the old one"""
+    tmp_path = path + ".tmp"
+    data = {"version": 1, "files": entries, "journal": journal}
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
 
-def sync(src, dst):
-    for root, dirs, files in os.walk(src):
-        rel_root = os.path.relpath(root, src)
-        dst_root = os.path.join(dst, rel_root)
 
-        for d in dirs:
-            if not should_exclude(d):
-                os.makedirs(os.path.join(dst_root, d), exist_ok=True)
+def stat_entry(st):
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "ino": st.st_ino}
+
+
+def is_unchanged(entry, st):
+    return (
+        entry is not None
+        and entry["size"] == st.st_size
+        and entry["mtime_ns"] == st.st_mtime_ns
+        and entry["ino"] == st.st_ino
+    )
+
+
+def copy_and_hash(src_file, dst_file):
+    """Copy a file and return its sha256, reading the source only once"""
+    digest = hashlib.sha256()
+    with open(src_file, "rb") as fsrc, open(dst_file, "wb") as fdst:
+        while True:
+            buf = fsrc.read(COPY_BUFSIZE)
+            if not buf:
+                break
+            digest.update(buf)
+            fdst.write(buf)
+    shutil.copystat(src_file, dst_file)
+    return digest.hexdigest()
+
+
+def kernel_copy(fsrc, fdst, size):
+    """Copy inside the kernel with copy_file_range or sendfile.
+
+    Returns False if neither is usable for this pair of files, in which case
+    nothing has been written and the caller should fall back to a buffered
+    copy.
+    """
+    infd, outfd = fsrc.fileno(), fdst.fileno()
+    for name in ("copy_file_range", "sendfile"):
+        if not hasattr(os, name):
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                if name == "copy_file_range":
+                    sent = os.copy_file_range(infd, outfd, size - offset)
+                else:
+                    sent = os.sendfile(outfd, infd, offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+            return True
+        except OSError as e:
+            if offset or e.errno not in ZERO_COPY_ERRNOS:
+                raise
+            fsrc.seek(0)
+            fdst.seek(0)
+    return False
+
+
+def copy_file(src_file, dst_file, size):
+    """Copy a file with its metadata, zero-copy for large files"""
+    if size < ZERO_COPY_MIN:
+        shutil.copy2(src_file, dst_file)
+        return
+    with open(src_file, "rb") as fsrc, open(dst_file, "wb") as fdst:
+        if not kernel_copy(fsrc, fdst, size):
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFSIZE)
+    shutil.copystat(src_file, dst_file)
+
+
+def link_file(prev_file, dst_file):
+    """Hardlink a file from the previous snapshot; False if it cannot be"""
+    try:
+        os.link(prev_file, dst_file)
+        return True
+    except OSError:
+        # Missing from the previous snapshot, too many links (EMLINK) or
+        # another filesystem: the caller copies the file instead
+        return False
+
 
+def process_file(job, verify, checksum):
+    """Compare/copy one file; returns (new manifest entry, copied, bytes read)
+
+    In snapshot mode prev_file is the same file in the previous snapshot,
+    and a verified-identical file is hardlinked to it instead of copied.
+    """
+    src_file, dst_file, st, entry, prev_file = job
+    new_entry = stat_entry(st)
+    bytes_read = 0
+    existing = prev_file or dst_file
+
+    if verify and os.path.exists(existing):
+        # The source counts once, though a changed file is read again below
+        bytes_read = st.st_size + os.path.getsize(existing)
+        if filecmp.cmp(src_file, existing, shallow=False) and (
+            prev_file is None or link_file(prev_file, dst_file)
+        ):
+            if entry and entry.get("sha256"):
+                new_entry["sha256"] = entry["sha256"]
+            return new_entry, False, bytes_read
+
+    if checksum:
+        new_entry["sha256"] = copy_and_hash(src_file, dst_file)
+    else:
+        copy_file(src_file, dst_file, st.st_size)
+    return new_entry, True, bytes_read or st.st_size
+
+
+def scan_tree(src, dst, rel_top=""):
+    """Yield (src_file, dst_file, rel_path, stat) for every file to consider"""
+    top = os.path.join(src, rel_top)
+    prefix = rel_top + "/" if rel_top else ""
+    os.makedirs(os.path.join(dst, rel_top), exist_ok=True)
+    for root, rel_root, dirs, files in walk(top, EXCLUDE_MATCHER):
+        dst_root = os.path.join(dst, prefix + rel_root)
+        for d in dirs:
+            os.makedirs(os.path.join(dst_root, d.name), exist_ok=True)
         for f in files:
-            if should_exclude(f):
+            if f.is_file():
+                yield f.path, os.path.join(
+                    dst_root, f.name
+                ), prefix + rel_root + f.name, f.stat()
+
+
+def scan_changes(src, dst, changes, manifest):
+    """Like scan_tree, but only for the paths recorded in the change journal.
+
+    Deleted paths, and changed paths that no longer exist, are dropped from
+    manifest (in place); a changed directory is walked in full.
+    """
+    for rel_path, op in changes.items():
+        if op == "D":
+            forget_path(manifest, rel_path)
+    modified = {rel_path for rel_path, op in changes.items() if op == "M"}
+    for rel_path in sorted(modified):
+        parts = rel_path.split("/")
+        if any("/".join(parts[:i]) in modified for i in range(1, len(parts))):
+            continue  # covered by the walk of a changed parent directory
+        src_path = os.path.join(src, rel_path)
+        try:
+            st = os.stat(src_path)
+        except OSError:
+            forget_path(manifest, rel_path)
+            continue
+        if os.path.isdir(src_path) and not os.path.islink(src_path):
+            yield from scan_tree(src, dst, rel_path)
+        elif os.path.isfile(src_path):
+            dst_file = os.path.join(dst, rel_path)
+            os.makedirs(os.path.dirname(dst_file), exist_ok=True)
+            yield src_path, dst_file, rel_path, st
+
+
+def forget_path(manifest, rel_path):
+    prefix = rel_path + "/"
+    for key in [k for k in manifest if k == rel_path or k.startswith(prefix)]:
+        del manifest[key]
+
+
+def sync(
+    src,
+    dst,
+    verify=False,
+    checksum=False,
+    workers=1,
+    queue_size=256,
+    journal=None,
+    link_dest=None,
+):
+    """Mirror src into dst, skipping files whose stat matches the manifest.
+
+    With verify=True the manifest is ignored and every existing file is
+    compared byte for byte, as a periodic full check. With checksum=True a
+    sha256 of each copied file is recorded in the manifest.
+
+    With workers > 1 the directory walk feeds a bounded queue drained by a
+    pool of copy threads; small files are queued in batches so the per-item
+    overhead is paid once per batch.
+
+    With journal set to a change_journal.py journal, only the paths it
+    recorded since the last sync are visited. A full scan is done instead
+    whenever the journal cannot be trusted (see change_journal.py).
+
+    With link_dest set to the previous snapshot directory, dst is expected
+    to be empty: files unchanged since that snapshot (per its manifest) are
+    hardlinked from it and only the rest are copied. The journal is not
+    used in this mode, since every file has to be linked into dst anyway.
+    """
+    manifest_path = os.path.join(dst, MANIFEST_NAME)
+    data = load_manifest(os.path.join(link_dest or dst, MANIFEST_NAME))
+    manifest = data.get("files", {})
+    changes = position = None
+    if journal and not link_dest:
+        changes, position = read_journal(journal, data.get("journal"))
+    if changes is not None and not verify:
+        mode = "journal"
+        new_manifest = dict(manifest)
+        candidates = scan_changes(src, dst, changes, new_manifest)
+    else:
+        mode = "full"
+        new_manifest = {}
+        candidates = scan_tree(src, dst)
+    stats = {
+        "mode": mode,
+        "scanned": 0,
+        "skipped": 0,
+        "linked": 0,
+        "copied": 0,
+        "errors": 0,
+        "bytes_read": 0,
+        "bytes_copied": 0,
+        "logical_bytes": 0,
+    }
+    lock = threading.Lock()
+    start_time = time.monotonic()
+
+    def run_batch(batch):
+        for rel_path, job in batch:
+            try:
+                new_entry, copied, bytes_read = process_file(job, verify, checksum)
+            except OSError as e:
+                print(f"[Error] Failed to copy {job[0]}: {e}")
+                with lock:
+                    stats["errors"] += 1
+                continue
+            with lock:
+                new_manifest[rel_path] = new_entry
+                stats["bytes_read"] += bytes_read
+                if copied:
+                    stats["copied"] += 1
+                    stats["bytes_copied"] += job[2].st_size
+                elif job[4]:
+                    stats["linked"] += 1
+                else:
+                    stats["skipped"] += 1
+
+    def worker():
+        while True:
+            batch = jobs.get()
+            if batch is None:
+                break
+            run_batch(batch)
+
+    if workers > 1:
+        jobs = queue.Queue(maxsize=queue_size)
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for t in threads:
+            t.start()
+        submit = jobs.put
+    else:
+        threads = []
+        submit = run_batch
+
+    batch, batch_bytes = [], 0
+    try:
+        for src_file, dst_file, rel_path, st in candidates:
+            entry = manifest.get(rel_path)
+            prev_file = os.path.join(link_dest, rel_path) if link_dest else None
+            stats["scanned"] += 1
+            stats["logical_bytes"] += st.st_size
+
+            if not verify and is_unchanged(entry, st):
+                if prev_file:
+                    unchanged = link_file(prev_file, dst_file)
+                else:
+                    unchanged = os.path.exists(dst_file)
+                if unchanged:
+                    with lock:
+                        stats["linked" if prev_file else "skipped"] += 1
+                        new_manifest[rel_path] = entry
+                    continue
+
+            job = (rel_path, (src_file, dst_file, st, entry, prev_file))
+            if st.st_size >= SMALL_FILE_MAX:
+                submit([job])
                 continue
-            src_file = os.path.join(root, f)
-            dst_file = os.path.join(dst_root, f)
-            if not os.path.exists(dst_file) or not filecmp.cmp(
-                src_file, dst_file, shallow=False
-            ):
-                shutil.copy2(src_file, dst_file)
+            batch.append(job)
+            batch_bytes += st.st_size
+            if len(batch) >= BATCH_FILES or batch_bytes >= BATCH_BYTES:
+                submit(batch)
+                batch, batch_bytes = [], 0
+        if batch:
+            submit(batch)
+    finally:
+        for _ in threads:
+            jobs.put(None)
+        for t in threads:
+            t.join()
+
+    if checksum:
+        # Hashes are taken while copying; skipped or linked files recorded
+        # before checksum mode was used have none yet, so hash the copy
+        for rel_path, entry in list(new_manifest.items()):
+            if entry.get("sha256"):
+                continue
+            try:
+                digest = file_digest(os.path.join(dst, rel_path))
+            except OSError as e:
+                print(f"[Error] Failed to hash {rel_path}: {e}")
+                stats["errors"] += 1
+                del new_manifest[rel_path]  # copied again by the next run
+                continue
+            new_manifest[rel_path] = dict(entry, sha256=digest)
+
+    # Failed files must be retried, and only a full scan would find them again
+    save_manifest(manifest_path, new_manifest, None if stats["errors"] else position)
+    if checksum:
+        # SHA256SUMS lets checksum.py verify the mirror without the manifest
+        write_manifest(
+            os.path.join(dst, SUMS_NAME),
+            {k: v["sha256"] for k, v in new_manifest.items()},
+        )
+    stats["elapsed"] = time.monotonic() - start_time
+    return stats
+
+
+def list_snapshots(dest):
+    """Names of the completed snapshots in dest, oldest first"""
+    try:
+        names = os.listdir(dest)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        (name for name in names if SNAPSHOT_RE.match(name)), key=snapshot_key
+    )
+
+
+def snapshot_key(name):
+    """Sort key putting name-N after name and name-9 before name-10"""
+    stamp, counter = SNAPSHOT_RE.match(name).groups()
+    return stamp, int(counter or 0)
+
+
+def prune_snapshots(dest, keep):
+    """Delete all but the newest keep snapshots; returns the removed names.
+
+    Deleting a snapshot only frees the files no other snapshot links to.
+    """
+    removed = list_snapshots(dest)[:-keep] if keep > 0 else []
+    for name in removed:
+        shutil.rmtree(os.path.join(dest, name))
+    return removed
+
+
+def snapshot(src, dest, keep=None, **kwargs):
+    """Back up src into a new dated directory DEST/<timestamp>/, or
+    DEST/<timestamp>-N when that name is taken by a run in the same second.
+
+    Files unchanged since the previous snapshot are hardlinked from it, so
+    each snapshot is a complete tree but costs only the changed files. The
+    snapshot is built under a .partial name and renamed when done, so an
+    interrupted run never leaves something that looks complete; leftovers
+    are removed by the next run. DEST/latest points at the newest snapshot.
+    A run with copy errors is left under its .partial name too, so it is
+    never linked from, pointed at by latest or counted by prune. With keep
+    set, older snapshots beyond that count are pruned after a complete run.
+    """
+    for name in os.listdir(dest):
+        if name.endswith(PARTIAL_SUFFIX):
+            shutil.rmtree(os.path.join(dest, name))
+    previous = list_snapshots(dest)
+    link_dest = os.path.join(dest, previous[-1]) if previous else None
+    stamp = name = datetime.now().strftime(SNAPSHOT_FORMAT)
+    counter = 0
+    while True:
+        partial = os.path.join(dest, name + PARTIAL_SUFFIX)
+        if not os.path.lexists(os.path.join(dest, name)):
+            try:
+                os.mkdir(partial)
+                break
+            except FileExistsError:
+                pass
+        counter += 1
+        name = f"{stamp}-{counter}"
+
+    stats = sync(src, partial, link_dest=link_dest, **kwargs)
+    stats["mode"] = "snapshot"
+    if stats["errors"]:
+        stats["snapshot"] = name + PARTIAL_SUFFIX
+        stats["pruned"] = []
+        return stats
+    os.rename(partial, os.path.join(dest, name))
+    tmp_link = os.path.join(dest, LATEST_LINK + ".tmp")
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(name, tmp_link)
+    os.replace(tmp_link, os.path.join(dest, LATEST_LINK))
+
+    stats["snapshot"] = name
+    stats["pruned"] = prune_snapshots(dest, keep) if keep else []
+    return stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Incremental mirror backup")
+    parser.add_argument("--src", default=SRC, help="Source directory")
+    parser.add_argument("--dest", default=DEST, help="Destination directory")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Ignore the manifest and compare every file's contents",
+    )
+    parser.add_argument(
+        "--checksum",
+        action="store_true",
+        help="Hash files while copying and write a SHA256SUMS manifest",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of copy threads; above 1 the walk and copies are pipelined",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=256,
+        help="Maximum number of pending copy batches in pipelined mode",
+    )
+    parser.add_argument(
+        "--journal",
+        help="Change journal written by change_journal.py; only journaled "
+        "paths are visited while it is valid",
+    )
+    parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="Create a dated snapshot in DEST, hardlinking unchanged files "
+        "from the previous one, instead of updating a single mirror",
+    )
+    parser.add_argument(
+        "--keep",
+        type=int,
+        default=None,
+        help="With --snapshot, number of snapshots to keep",
+    )
+    args = parser.parse_args()
+    if args.journal and args.snapshot:
+        parser.error("--journal cannot be combined with --snapshot")
+    if args.keep is not None and not args.snapshot:
+        parser.error("--keep requires --snapshot")
+    if args.keep is not None and args.keep < 1:
+        parser.error("--keep must be at least 1")
+    return args
 
 
-sync(SRC, DEST)
-print("[Success] Incremental backup completed.")
+if __name__ == "__main__":
+    args = parse_args()
+    os.makedirs(args.dest, exist_ok=True)
+    options = {
+        "verify": args.verify,
+        "checksum": args.checksum,
+        "workers": args.workers,
+        "queue_size": args.queue_size,
+    }
+    if args.snapshot:
+        stats = snapshot(args.src, args.dest, keep=args.keep, **options)
+    else:
+        stats = sync(args.src, args.dest, journal=args.journal, **options)
+    elapsed = max(stats["elapsed"], 1e-9)
+    if stats["errors"]:
+        print(f"[Error] {stats['errors']} file(s) failed to copy.")
+        if args.snapshot:
+            print(f"[Error] Snapshot left incomplete: {stats['snapshot']}")
+    elif args.snapshot:
+        print(f"[Success] Snapshot created: {stats['snapshot']}")
+    else:
+        print("[Success] Incremental backup completed.")
+    print(
+        f"[i] Mode: {stats['mode']} | Scanned: {stats['scanned']} | "
+        f"Skipped: {stats['skipped']} | Linked: {stats['linked']} | "
+        f"Copied: {stats['copied']} | Bytes read: {stats['bytes_read']}"
+    )
+    if args.snapshot:
+        print(
+            f"[i] Written: {stats['bytes_copied']} bytes of "
+            f"{stats['logical_bytes']} logical"
+        )
+        for name in stats["pruned"]:
+            print(f"[i] Pruned snapshot {name}")
+    print(
+        f"[i] {stats['elapsed']:.2f}s | {stats['scanned'] / elapsed:.1f} files/s | "
+        f"{stats['bytes_copied'] / elapsed / 1e6:.1f} MB/s copied"
+    )
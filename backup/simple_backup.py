@@ -1,34 +1,227 @@
+import io
 import os
+import json
 import tarfile
+import argparse
 from datetime import datetime
 
+from parallel_compress import ParallelCompressor, BLOCK_SIZE, open_decompressed
+from indexed_archive import ArchiveIndex
+from exclude import ExcludeMatcher, walk
+from checksum import HashingWriter, write_manifest
+
 SRC_DIR = os.path.expanduser("~")
 DEST_DIR = "/mnt/backup_drive/home_backup"
-EXCLUDES = {"Downloads", ".cache"}
+EXCLUDES = ["Downloads", ".cache"]
 TIMESTAMP = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 BACKUP_NAME = f"home_backup_{TIMESTAMP}.tar.gz"
 LOG_FILE = "/var/log/simple_backup.log"
+STATE_NAME = "snapshot_level{}.json"
+DELETED_MEMBER = ".simple_backup_deleted.json"
+MAX_LEVEL = 9
+
+
+def load_state(level):
+    path = os.path.join(DEST_DIR, STATE_NAME.format(level))
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_state(level, state):
+    path = os.path.join(DEST_DIR, STATE_NAME.format(level))
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+    # A new level-N run supersedes every higher level built on the old one
+    for higher in range(level + 1, MAX_LEVEL + 1):
+        try:
+            os.remove(os.path.join(DEST_DIR, STATE_NAME.format(higher)))
+        except FileNotFoundError:
+            pass
+
+
+def reference_state(level):
+    """State of the most recent backup at a lower level, like dump(8)"""
+    for lower in range(level - 1, -1, -1):
+        state = load_state(lower)
+        if state is not None:
+            return state
+    raise RuntimeError(f"No lower-level snapshot found for level {level} backup")
 
-os.makedirs(DEST_DIR, exist_ok=True)
 
+def backup(
+    fmt="gzip",
+    level=6,
+    workers=None,
+    block_size=BLOCK_SIZE,
+    max_inflight=None,
+    incremental=None,
+    index=False,
+):
+    """Write a full archive, or with incremental=N a level-N archive.
 
-def is_excluded(path):
-    return any(exclude in path for exclude in EXCLUDES)
+    A level-0 archive is a full backup that also records a snapshot state.
+    A level-N archive holds only files that are new or changed since the
+    latest lower-level backup, plus a list of the paths deleted since then.
 
+    With index=True a sidecar <archive>.idx is written so single members can
+    be listed and restored with indexed_archive.py without a full inflate.
+    """
+    archive_name = BACKUP_NAME
+    if incremental is not None:
+        archive_name = archive_name.replace(".tar.gz", f"_L{incremental}.tar.gz")
+    if fmt == "zstd":
+        archive_name = archive_name[: -len(".gz")] + ".zst"
+    archive_path = os.path.join(DEST_DIR, archive_name)
+    previous = reference_state(incremental)["files"] if incremental else {}
+    current = {}
+    archive_index = ArchiveIndex() if index else None
+    matcher = ExcludeMatcher(EXCLUDES)
 
-def backup():
-    archive_path = os.path.join(DEST_DIR, BACKUP_NAME)
-    with tarfile.open(archive_path, "w:gz") as tar:
-        for root, dirs, files in os.walk(SRC_DIR):
-            for name in files:
-                full_path = os.path.join(root, name)
-                if not is_excluded(full_path):
-                    tar.add(full_path, arcname=os.path.relpath(full_path, SRC_DIR))
+    with open(archive_path, "wb") as out, ParallelCompressor(
+        HashingWriter(out),
+        fmt=fmt,
+        level=level,
+        workers=workers,
+        block_size=block_size,
+        max_inflight=max_inflight,
+    ) as compressor:
+        # Stream mode: tar headers and file data are produced here while the
+        # compressor's worker threads deflate earlier blocks
+        with tarfile.open(fileobj=compressor, mode="w|") as tar:
+            for root, rel_root, dirs, files in walk(SRC_DIR, matcher):
+                for entry in files:
+                    full_path = entry.path
+                    rel_path = rel_root + entry.name
+                    if incremental is not None:
+                        st = entry.stat(follow_symlinks=False)
+                        state = [st.st_size, st.st_mtime_ns, st.st_ino]
+                        current[rel_path] = state
+                        if previous.get(rel_path) == state:
+                            continue
+                    # gettarinfo() returns None for sockets and FIFOs, which
+                    # tar.add() would skip without adding a member
+                    info = tar.gettarinfo(full_path, arcname=rel_path)
+                    if info is None:
+                        continue
+                    header_offset = tar.offset
+                    if info.isreg():
+                        with open(full_path, "rb") as f:
+                            tar.addfile(info, f)
+                    else:
+                        tar.addfile(info)
+                    if archive_index is not None:
+                        archive_index.add(info, header_offset)
+
+            if incremental:
+                deleted = sorted(set(previous) - set(current))
+                data = json.dumps(deleted).encode()
+                info = tarfile.TarInfo(DELETED_MEMBER)
+                info.size = len(data)
+                info.mtime = int(datetime.now().timestamp())
+                tar.addfile(info, io.BytesIO(data))
+
+    write_manifest(
+        archive_path + ".sha256", {archive_name: compressor.fileobj.hexdigest()}
+    )
+    if archive_index is not None:
+        archive_index.save(archive_path, compressor)
+    if incremental is not None:
+        save_state(incremental, {"archive": archive_name, "files": current})
     return archive_path
 
 
-try:
-    result = backup()
-    print(f"[Success] Backup created: {result}")
-except Exception as e:
-    print(f"[Error] Backup failed: {e}")
+def restore(archives, target):
+    """Replay a full archive followed by its incremental chain into target"""
+    os.makedirs(target, exist_ok=True)
+    # "tar" still blocks paths outside target but, unlike "data", restores
+    # absolute symlinks, which backups of system directories contain
+    extract_args = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+    for archive in archives:
+        deleted = []
+        with open_decompressed(archive) as f, tarfile.open(fileobj=f, mode="r|") as tar:
+            for member in tar:
+                if member.name == DELETED_MEMBER:
+                    deleted = json.load(tar.extractfile(member))
+                else:
+                    tar.extract(member, target, **extract_args)
+        for rel_path in deleted:
+            try:
+                os.remove(os.path.join(target, rel_path))
+            except FileNotFoundError:
+                pass
+        print(f"[i] Applied {archive} ({len(deleted)} deletion(s))")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compressed home directory backup")
+    parser.add_argument(
+        "--zstd",
+        action="store_true",
+        help="Write zstd frames instead of gzip (needs the zstandard package)",
+    )
+    parser.add_argument("--level", type=int, default=6, help="Compression level")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Compression threads (default: CPU count)",
+    )
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=BLOCK_SIZE // 1024,
+        help="Compression block size in KiB",
+    )
+    parser.add_argument(
+        "--max-inflight",
+        type=int,
+        default=None,
+        help="Maximum blocks buffered or compressing at once (default: 2 x workers)",
+    )
+    parser.add_argument(
+        "--incremental",
+        type=int,
+        choices=range(MAX_LEVEL + 1),
+        metavar="LEVEL",
+        help="Incremental backup level: 0 is full, N holds changes since the "
+        "latest lower level",
+    )
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="Write a sidecar index for single-file restore (indexed_archive.py)",
+    )
+    parser.add_argument(
+        "--restore",
+        metavar="TARGET",
+        help="Restore the given archives, full first, into TARGET",
+    )
+    parser.add_argument("archives", nargs="*", help="Archives to restore, in order")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.restore:
+        restore(args.archives, args.restore)
+        print(f"[Success] Restored {len(args.archives)} archive(s) to {args.restore}")
+    else:
+        os.makedirs(DEST_DIR, exist_ok=True)
+        try:
+            result = backup(
+                fmt="zstd" if args.zstd else "gzip",
+                level=args.level,
+                workers=args.workers,
+                block_size=args.block_size * 1024,
+                max_inflight=args.max_inflight,
+                incremental=args.incremental,
+                index=args.index,
+            )
+            print(f"[Success] Backup created: {result}")
+        except Exception as e:
+            print(f"[Error] Backup failed: {e}")
@@ -25,14 +25,144 @@ import sys
 import json
 from datetime import datetime, timezone
 
+from metrics_exporter import MetricsExporter, parse_listen
+from metrics_log import MetricsLogWriter
+from timeseries import TimeSeriesStore
+from top_processes import ProcessCollector
+
+
+def cpu_busy(times):
+    """(busy, total) jiffies of a psutil cpu_times entry, counted as psutil does"""
+    total = sum(times)
+    # Linux already counts guest time in user and nice
+    total -= getattr(times, "guest", 0) + getattr(times, "guest_nice", 0)
+    idle = times.idle + getattr(times, "iowait", 0)
+    return total - idle, total
+
+
+def percent(busy, total):
+    return round(100.0 * busy / total, 1) if total > 0 else 0.0
+
+
+class DeltaSampler:
+    """Rates from cumulative counters, computed between consecutive samples.
+
+    Each sample() reads the CPU times, disk and network counters once and
+    compares them with the previous snapshot, so CPU%, per-core%, bytes/s
+    and IOPS come without any blocking interval. The first sample covers
+    the time since the last prime() (or since the sampler was created), so
+    prime it a full interval before the first sample that is reported: a
+    few microseconds of counters give CPU% of 0 or 100 and huge rates.
+    """
+
+    def __init__(self):
+        self.has_disk_io = psutil.disk_io_counters() is not None
+        self.previous = self.snapshot()
+
+    def prime(self):
+        """Take the baseline for the next sample()"""
+        self.previous = self.snapshot()
+
+    def snapshot(self):
+        return (
+            time.monotonic(),
+            psutil.cpu_times(percpu=True),
+            psutil.disk_io_counters() if self.has_disk_io else None,
+            psutil.net_io_counters(),
+        )
+
+    def sample(self):
+        current = self.snapshot()
+        then, cpu_then, disk_then, net_then = self.previous
+        now, cpu_now, disk_now, net_now = current
+        self.previous = current
+        elapsed = max(now - then, 1e-9)
+
+        def rate(new, old):
+            # Counters can go back when a disk or interface disappears
+            return max(new - old, 0) / elapsed
+
+        cores = [
+            [n - o for n, o in zip(cpu_busy(new), cpu_busy(old))]
+            for new, old in zip(cpu_now, cpu_then)
+        ]
+        rates = {
+            "cpu_total": percent(sum(c[0] for c in cores), sum(c[1] for c in cores)),
+            "cpu_per_core": [percent(busy, total) for busy, total in cores],
+            "net_sent_per_sec": rate(net_now.bytes_sent, net_then.bytes_sent),
+            "net_recv_per_sec": rate(net_now.bytes_recv, net_then.bytes_recv),
+        }
+        if disk_now is not None:
+            rates.update(
+                disk_read_per_sec=rate(disk_now.read_bytes, disk_then.read_bytes),
+                disk_write_per_sec=rate(disk_now.write_bytes, disk_then.write_bytes),
+                disk_read_iops=rate(disk_now.read_count, disk_then.read_count),
+                disk_write_iops=rate(disk_now.write_count, disk_then.write_count),
+            )
+        return rates, disk_now, net_now
+
+
+def detect_sensors():
+    """Collectors for the optional sensors present on this host.
+
+    Each is tried once; a sensor that is missing or fails here is left out
+    for the life of the monitor instead of failing on every cycle.
+    """
+    sensors = {}
+
+    def temperatures():
+        return {
+            sensor.label or f"sensor_{i}": sensor.current
+            for i, sensor in enumerate(
+                psutil.sensors_temperatures().get("coretemp", [])
+            )
+        }
+
+    def battery():
+        status = psutil.sensors_battery()
+        return {"percent": status.percent, "power_plugged": status.power_plugged}
+
+    for name, collector, supported in (
+        ("temperatures", temperatures, hasattr(psutil, "sensors_temperatures")),
+        ("battery", battery, hasattr(psutil, "sensors_battery")),
+    ):
+        if not supported:
+            continue
+        try:
+            if collector():
+                sensors[name] = collector
+        except Exception:
+            pass
+    return sensors
+
 
 class SystemMonitor:
-    def __init__(self, log_path, interval, thresholds):
+    def __init__(
+        self,
+        log_path,
+        interval,
+        thresholds,
+        history=None,
+        binary_log=None,
+        processes=None,
+        exporter=None,
+    ):
         self.log_path = log_path
         self.interval = interval
         self.thresholds = thresholds
+        self.history = history  # TimeSeriesStore of past samples, if any
+        # MetricsLogWriter for the samples; the JSON log then only gets alerts
+        self.binary_log = binary_log
+        # ProcessCollector naming the top processes in alerts, if any
+        self.processes = processes
+        self.top_processes = None
+        # MetricsExporter serving the latest sample over HTTP, if any
+        self.exporter = exporter
         self.running = True
         self.setup_logging()
+        self.cpu_count = psutil.cpu_count() or 1
+        self.sampler = DeltaSampler()
+        self.sensors = detect_sensors()
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
 
@@ -61,11 +191,10 @@ class SystemMonitor:
         self.running = False
 
     def collect_metrics(self):
-        """Gather system performance metrics"""
+        """Gather system performance metrics without blocking"""
         try:
-            # CPU metrics
-            cpu_percent = psutil.cpu_percent(interval=0.5)
-            cpu_per_core = psutil.cpu_percent(interval=0.5, percpu=True)
+            # CPU, disk I/O and network rates since the previous sample
+            rates, disk_io, net_io = self.sampler.sample()
 
             # Memory metrics
             mem = psutil.virtual_memory()
@@ -73,41 +202,38 @@ class SystemMonitor:
 
             # Disk metrics
             disk_usage = psutil.disk_usage("/")
-            disk_io = psutil.disk_io_counters()
-
-            # Network metrics
-            net_io = psutil.net_io_counters()
-
-            # Temperatures (if available)
-            try:
-                temps = {
-                    sensor.label or f"sensor_{i}": sensor.current
-                    for i, sensor in enumerate(
-                        psutil.sensors_temperatures().get("coretemp", [])
-                    )
-                }
-            except Exception:
-                temps = {}
-
-            # Battery status (if available)
-            try:
-                battery = psutil.sensors_battery()
-                battery_status = (
-                    {"percent": battery.percent, "power_plugged": battery.power_plugged}
-                    if battery
-                    else {}
+
+            # Optional sensors found at startup
+            readings = {}
+            for name, collector in self.sensors.items():
+                try:
+                    readings[name] = collector()
+                except Exception as e:
+                    self.logger.error(f"Reading {name} failed: {str(e)}")
+                    readings[name] = {}
+
+            disk = {
+                "total": disk_usage.total,
+                "used": disk_usage.used,
+                "free": disk_usage.free,
+                "percent": disk_usage.percent,
+            }
+            if disk_io is not None:
+                disk.update(
+                    read_bytes=disk_io.read_bytes,
+                    write_bytes=disk_io.write_bytes,
+                    read_bytes_per_sec=rates["disk_read_per_sec"],
+                    write_bytes_per_sec=rates["disk_write_per_sec"],
+                    read_iops=rates["disk_read_iops"],
+                    write_iops=rates["disk_write_iops"],
                 )
-            except Exception:
-                battery_status = {}
 
             return {
                 "timestamp": datetime.now(timezone.utc).isoformat(),
                 "cpu": {
-                    "total": cpu_percent,
-                    "per_core": cpu_per_core,
-                    "load_avg": [
-                        x / psutil.cpu_count() * 100 for x in psutil.getloadavg()
-                    ],
+                    "total": rates["cpu_total"],
+                    "per_core": rates["cpu_per_core"],
+                    "load_avg": [x / self.cpu_count * 100 for x in psutil.getloadavg()],
                 },
                 "memory": {
                     "total": mem.total,
@@ -117,20 +243,15 @@ class SystemMonitor:
                     "swap_used": swap.used,
                     "swap_percent": swap.percent,
                 },
-                "disk": {
-                    "total": disk_usage.total,
-                    "used": disk_usage.used,
-                    "free": disk_usage.free,
-                    "percent": disk_usage.percent,
-                    "read_bytes": disk_io.read_bytes,
-                    "write_bytes": disk_io.write_bytes,
-                },
+                "disk": disk,
                 "network": {
                     "bytes_sent": net_io.bytes_sent,
                     "bytes_recv": net_io.bytes_recv,
+                    "bytes_sent_per_sec": rates["net_sent_per_sec"],
+                    "bytes_recv_per_sec": rates["net_recv_per_sec"],
                 },
-                "temperatures": temps,
-                "battery": battery_status,
+                "temperatures": readings.get("temperatures", {}),
+                "battery": readings.get("battery", {}),
             }
         except Exception as e:
             self.logger.error(f"Metrics collection failed: {str(e)}")
@@ -145,11 +266,16 @@ class SystemMonitor:
 
         # CPU threshold check
         if metrics["cpu"]["total"] > self.thresholds["cpu"]:
-            alerts.append(f"High CPU usage: {metrics['cpu']['total']}%")
+            alerts.append(
+                f"High CPU usage: {metrics['cpu']['total']}%" + self.top_hint("cpu")
+            )
 
         # Memory threshold check
         if metrics["memory"]["percent"] > self.thresholds["memory"]:
-            alerts.append(f"High memory usage: {metrics['memory']['percent']}%")
+            alerts.append(
+                f"High memory usage: {metrics['memory']['percent']}%"
+                + self.top_hint("memory")
+            )
 
         # Disk threshold check
         if metrics["disk"]["percent"] > self.thresholds["disk"]:
@@ -162,29 +288,108 @@ class SystemMonitor:
 
         return alerts
 
+    def top_hint(self, key):
+        """Alert suffix naming the leading process of a top-N list"""
+        if not self.top_processes or not self.top_processes[key]:
+            return ""
+        p = self.top_processes[key][0]
+        if key == "cpu":
+            usage = f"{p['cpu_percent']}% CPU"
+        else:
+            usage = f"{p['rss'] / 2**20:.0f} MiB"
+        return f" (top: {p['name']} pid {p['pid']}, {usage})"
+
+    def record_history(self, sampled_at, metrics):
+        """Add a sample to the in-memory history"""
+        known = len(self.history.metrics())
+        dropped = len(self.history.dropped)
+        self.history.append(sampled_at, metrics)
+        if len(self.history.dropped) > dropped:
+            self.logger.warning(
+                json.dumps(
+                    {
+                        "history": "memory budget reached, not recording",
+                        "metrics": sorted(self.history.dropped),
+                    }
+                )
+            )
+        if len(self.history.metrics()) > known:
+            self.logger.info(
+                json.dumps(
+                    {
+                        "history": "tracking new metrics",
+                        "metrics": len(self.history.metrics()),
+                        "bytes": self.history.memory_bytes(),
+                    }
+                )
+            )
+
     def run(self):
         """Main monitoring loop"""
         self.logger.info("Starting system monitor")
+        # Rates are deltas between cycles: take their baseline one interval
+        # before the first report rather than a few microseconds
+        self.sampler.prime()
+        self.collect_processes()
+        next_run = time.monotonic() + self.interval
+        self.sleep_until(next_run)
 
         while self.running:
+            sampled_at = time.time()
             metrics = self.collect_metrics()
+            self.collect_processes()
             if metrics:
                 alerts = self.check_thresholds(metrics)
+                if self.history is not None:
+                    self.record_history(sampled_at, metrics)
 
                 # Prepare log entry
                 log_entry = {"metrics": metrics, "alerts": alerts}
-
+                if alerts and self.top_processes:
+                    log_entry["top_processes"] = self.top_processes
+                if self.exporter is not None:
+                    # A rendering bug must not stop collection and logging
+                    try:
+                        self.exporter.update(metrics, alerts)
+                    except Exception as e:
+                        self.logger.error(f"Metrics export failed: {str(e)}")
+
+                if self.binary_log is not None:
+                    try:
+                        self.binary_log.write(sampled_at, metrics)
+                    except OSError as e:
+                        self.logger.error(f"Binary log write failed: {str(e)}")
+                    if alerts:
+                        self.logger.warning(json.dumps(log_entry))
                 # Log with appropriate severity
-                if alerts:
+                elif alerts:
                     self.logger.warning(json.dumps(log_entry))
                 else:
                     self.logger.info(json.dumps(log_entry))
 
-            # Sleep with interval slicing for faster shutdown
-            for _ in range(self.interval * 10):
-                if not self.running:
-                    break
-                time.sleep(0.1)
+            # Cycles keep to the interval however long collection took
+            next_run += self.interval
+            now = time.monotonic()
+            if next_run < now:
+                next_run = now  # fell behind: do not try to catch up
+            self.sleep_until(next_run)
+
+    def collect_processes(self):
+        """Update top_processes; every cycle, so CPU% and I/O cover one interval"""
+        if self.processes is None:
+            return
+        try:
+            self.top_processes = self.processes.collect()
+        except OSError as e:
+            self.logger.error(f"Process collection failed: {str(e)}")
+            self.top_processes = None
+
+    def sleep_until(self, deadline):
+        """Sleep until a monotonic deadline in slices, for faster shutdown"""
+        now = time.monotonic()
+        while self.running and now < deadline:
+            time.sleep(min(0.1, deadline - now))
+            now = time.monotonic()
 
 
 def parse_args():
@@ -201,7 +406,11 @@ def parse_args():
         help="Path to log file",
     )
     parser.add_argument(
-        "-i", "--interval", type=int, default=60, help="Monitoring interval in seconds"
+        "-i",
+        "--interval",
+        type=float,
+        default=60,
+        help="Monitoring interval in seconds (fractions allowed)",
     )
     parser.add_argument(
         "--cpu-threshold",
@@ -228,6 +437,36 @@ def parse_args():
         help="Temperature alert threshold (Celsius)",
     )
 
+    parser.add_argument(
+        "--binary-log",
+        help="Write samples to this compact binary log (read it with "
+        "metrics_log.py); the JSON log then only records alerts",
+    )
+    parser.add_argument(
+        "--listen",
+        metavar="[HOST:]PORT",
+        help="Serve the latest metrics for Prometheus at http://HOST:PORT/metrics",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=5,
+        help="Processes listed by CPU, memory and I/O in alert entries (0 disables)",
+    )
+    parser.add_argument(
+        "--history-days",
+        type=float,
+        default=7,
+        help="Days of full-resolution samples kept in memory, "
+        "plus 30 days of per-minute and a year of per-hour rollups (0 disables)",
+    )
+    parser.add_argument(
+        "--history-max-mb",
+        type=float,
+        default=256,
+        help="Memory limit for the history; metrics beyond it are not kept",
+    )
+
     return parser.parse_args()
 
 
@@ -241,10 +480,43 @@ def main():
         "temperature": args.temp_threshold,
     }
 
+    history = None
+    if args.history_days > 0:
+        history = TimeSeriesStore(
+            args.interval,
+            raw_days=args.history_days,
+            max_bytes=int(args.history_max_mb * 1024 * 1024),
+        )
+
+    exporter = None
+    if args.listen:
+        try:
+            exporter = MetricsExporter(parse_listen(args.listen))
+        except (OSError, ValueError) as e:
+            print(f"[Error] Cannot listen on {args.listen}: {e}")
+            sys.exit(1)
+
     monitor = SystemMonitor(
-        log_path=args.log_path, interval=args.interval, thresholds=thresholds
+        log_path=args.log_path,
+        interval=args.interval,
+        thresholds=thresholds,
+        history=history,
+        binary_log=MetricsLogWriter(args.binary_log) if args.binary_log else None,
+        processes=ProcessCollector(args.top) if args.top > 0 else None,
+        exporter=exporter,
     )
-    monitor.run()
+    if monitor.exporter is not None:
+        monitor.exporter.start()
+    try:
+        monitor.run()
+    finally:
+        if monitor.exporter is not None:
+            monitor.exporter.shutdown()
+            monitor.exporter.server_close()
+        if monitor.binary_log is not None:
+            monitor.binary_log.close()
+        if monitor.processes is not None:
+            monitor.processes.close()
 
 
 if __name__ == "__main__":
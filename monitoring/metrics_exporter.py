@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Prometheus/OpenMetrics HTTP endpoint for SystemMonitor.
+
+The exposition text is rendered once per collection cycle by update(), in
+both the Prometheus text format (0.0.4) and OpenMetrics 1.0, each also
+gzip-compressed. A scrape only picks the cached body matching its Accept
+and Accept-Encoding headers, so scrapes never collect or render anything
+and many can be served at once, one thread per connection with
+keep-alive.
+
+Example of usage:
+    # Serve metrics on port 9101 while monitoring
+    python3 cpu_memory_monitor.py --listen 9101
+
+    # Load test: 64 parallel keep-alive clients for 10 seconds against a
+    # sample exporter started on localhost (or --url for a running one)
+    python3 metrics_exporter.py -c 64 -d 10
+"""
+
+import gzip
+import time
+import argparse
+import threading
+import http.client
+import multiprocessing
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def families(metrics, alerts):
+    """(name, type, help, [(labels, value)]) for a SystemMonitor sample.
+
+    Counter names are given without the _total suffix. A value may be None
+    when the sensor could not tell (such as power_plugged on some laptops).
+    """
+    cpu, mem, disk, net = (
+        metrics["cpu"],
+        metrics["memory"],
+        metrics["disk"],
+        metrics["network"],
+    )
+    result = [
+        ("system_cpu_usage_percent", "gauge", "CPU usage", [({}, cpu["total"])]),
+        (
+            "system_cpu_core_usage_percent",
+            "gauge",
+            "CPU usage per core",
+            [({"core": i}, v) for i, v in enumerate(cpu["per_core"])],
+        ),
+        (
+            "system_load_percent",
+            "gauge",
+            "Load average as a percentage of the CPU count",
+            [({"window": w}, v) for w, v in zip(("1m", "5m", "15m"), cpu["load_avg"])],
+        ),
+        ("system_memory_total_bytes", "gauge", "Physical memory", [({}, mem["total"])]),
+        (
+            "system_memory_available_bytes",
+            "gauge",
+            "Memory available without swapping",
+            [({}, mem["available"])],
+        ),
+        ("system_memory_used_bytes", "gauge", "Memory in use", [({}, mem["used"])]),
+        (
+            "system_memory_usage_percent",
+            "gauge",
+            "Memory usage",
+            [({}, mem["percent"])],
+        ),
+        ("system_swap_used_bytes", "gauge", "Swap in use", [({}, mem["swap_used"])]),
+        (
+            "system_swap_usage_percent",
+            "gauge",
+            "Swap usage",
+            [({}, mem["swap_percent"])],
+        ),
+        (
+            "system_disk_total_bytes",
+            "gauge",
+            "Size of the root filesystem",
+            [({"mountpoint": "/"}, disk["total"])],
+        ),
+        (
+            "system_disk_free_bytes",
+            "gauge",
+            "Free space on the root filesystem",
+            [({"mountpoint": "/"}, disk["free"])],
+        ),
+        (
+            "system_disk_usage_percent",
+            "gauge",
+            "Usage of the root filesystem",
+            [({"mountpoint": "/"}, disk["percent"])],
+        ),
+        (
+            "system_network_sent_bytes",
+            "counter",
+            "Bytes sent on all interfaces",
+            [({}, net["bytes_sent"])],
+        ),
+        (
+            "system_network_received_bytes",
+            "counter",
+            "Bytes received on all interfaces",
+            [({}, net["bytes_recv"])],
+        ),
+    ]
+    if "read_bytes" in disk:
+        result += [
+            (
+                "system_disk_read_bytes",
+                "counter",
+                "Bytes read from all disks",
+                [({}, disk["read_bytes"])],
+            ),
+            (
+                "system_disk_written_bytes",
+                "counter",
+                "Bytes written to all disks",
+                [({}, disk["write_bytes"])],
+            ),
+            (
+                "system_disk_iops",
+                "gauge",
+                "Disk operations per second over the last interval",
+                [
+                    ({"direction": "read"}, disk["read_iops"]),
+                    ({"direction": "write"}, disk["write_iops"]),
+                ],
+            ),
+        ]
+    if metrics["temperatures"]:
+        result.append(
+            (
+                "system_temperature_celsius",
+                "gauge",
+                "Sensor temperatures",
+                [({"sensor": k}, v) for k, v in metrics["temperatures"].items()],
+            )
+        )
+    if metrics["battery"]:
+        result += [
+            (
+                "system_battery_percent",
+                "gauge",
+                "Battery charge",
+                [({}, metrics["battery"]["percent"])],
+            ),
+            (
+                "system_battery_power_plugged",
+                "gauge",
+                "1 when on external power",
+                [({}, metrics["battery"]["power_plugged"])],
+            ),
+        ]
+    result += [
+        (
+            "system_monitor_alerts",
+            "gauge",
+            "Threshold alerts raised by the last collection",
+            [({}, len(alerts))],
+        ),
+        (
+            "system_monitor_last_collection_timestamp_seconds",
+            "gauge",
+            "Unix time of the last collection",
+            [({}, time.time())],
+        ),
+    ]
+    return result
+
+
+def render(metrics, alerts, openmetrics=False):
+    """Exposition text for a sample, as bytes"""
+    lines = []
+    for name, kind, help_text, samples in families(metrics, alerts):
+        family = name
+        sample_name = name
+        if kind == "counter":
+            sample_name = name + "_total"
+            if not openmetrics:
+                family = sample_name
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {kind}")
+        for labels, value in samples:
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                value = int(value)
+            if labels:
+                label_text = ",".join(f'{k}="{escape(v)}"' for k, v in labels.items())
+                lines.append(f"{sample_name}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{sample_name} {value}")
+    if openmetrics:
+        lines.append("# EOF")
+    return ("\n".join(lines) + "\n").encode()
+
+
+class ExporterHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as Prometheus uses
+    # Headers and body go out in two writes; without TCP_NODELAY the body
+    # waits for the client's delayed ACK (about 40 ms on Linux)
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        bodies = self.server.bodies
+        if bodies is None:
+            self.send_error(503, "No metrics collected yet")
+            return
+        openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+        compressed = "gzip" in self.headers.get("Accept-Encoding", "")
+        body = bodies[openmetrics, compressed]
+        self.send_response(200)
+        self.send_header(
+            "Content-Type", OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE
+        )
+        if compressed:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # one line per scrape would flood the output
+
+
+class MetricsExporter(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # scrapers reconnecting at once are not refused
+
+    def __init__(self, address):
+        # {(openmetrics, gzip): body}, replaced as a whole by update()
+        self.bodies = None
+        super().__init__(address, ExporterHandler)
+
+    def update(self, metrics, alerts):
+        """Render a new sample; scrapes see either the old or the new one"""
+        bodies = {}
+        for openmetrics in (False, True):
+            text = render(metrics, alerts, openmetrics)
+            bodies[openmetrics, False] = text
+            bodies[openmetrics, True] = gzip.compress(text, compresslevel=6)
+        self.bodies = bodies
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def parse_listen(value):
+    """Server address from "[host:]port"; the host defaults to all interfaces"""
+    host, _, port = value.rpartition(":")
+    return host.strip("[]") or "0.0.0.0", int(port)
+
+
+def sample_metrics(cores=16):
+    """A representative sample for load testing"""
+    return {
+        "cpu": {"total": 12.5, "per_core": [12.5] * cores, "load_avg": [5.0] * 3},
+        "memory": {
+            "total": 64 * 2**30,
+            "available": 40 * 2**30,
+            "used": 24 * 2**30,
+            "percent": 37.5,
+            "swap_used": 0,
+            "swap_percent": 0.0,
+        },
+        "disk": {
+            "total": 2**40,
+            "used": 2**39,
+            "free": 2**39,
+            "percent": 50.0,
+            "read_bytes": 123456789012,
+            "write_bytes": 98765432109,
+            "read_bytes_per_sec": 1e6,
+            "write_bytes_per_sec": 2e6,
+            "read_iops": 120.0,
+            "write_iops": 340.0,
+        },
+        "network": {"bytes_sent": 5 * 2**40, "bytes_recv": 7 * 2**40},
+        "temperatures": {f"Core {i}": 55.0 for i in range(cores)},
+        "battery": {},
+    }
+
+
+def serve_sample(address, ready):
+    exporter = MetricsExporter(address)
+    exporter.update(sample_metrics(), [])
+    ready.put(exporter.server_address[1])
+    exporter.serve_forever()
+
+
+def load_test(url, clients, duration, compressed):
+    """Scrape url from parallel keep-alive clients; prints latency percentiles"""
+    parts = urlsplit(url)
+    headers = {"Accept-Encoding": "gzip"} if compressed else {}
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+    deadline = time.monotonic() + duration
+    barrier = threading.Barrier(clients)
+
+    def client(index):
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+        try:
+            conn.connect()
+        except OSError:
+            pass  # counted as an error by the first request
+        barrier.wait()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request("GET", parts.path or "/metrics", headers=headers)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+            if ok:
+                latencies[index].append(time.perf_counter() - start)
+            else:
+                errors[index] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    done = sorted(x for per_client in latencies for x in per_client)
+    if not done:
+        print(f"[Error] No successful scrapes ({sum(errors)} errors)")
+        return
+
+    def pct(p):
+        return done[min(len(done) - 1, int(p / 100 * len(done)))] * 1e3
+
+    print(
+        f"[i] {clients} clients, {duration:g}s: {len(done)} scrapes "
+        f"({len(done) / duration:.0f}/s), {sum(errors)} errors"
+    )
+    print(
+        f"[i] Latency ms: p50 {pct(50):.2f} | p90 {pct(90):.2f} | "
+        f"p99 {pct(99):.2f} | max {done[-1] * 1e3:.2f}"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Metrics exporter load test")
+    parser.add_argument(
+        "--url", help="Exporter to test (default: start a sample one on localhost)"
+    )
+    parser.add_argument(
+        "-c", "--clients", type=int, default=64, help="Parallel clients"
+    )
+    parser.add_argument(
+        "-d", "--duration", type=float, default=10, help="Seconds to run"
+    )
+    parser.add_argument("--gzip", action="store_true", help="Ask for gzip bodies")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = None
+    url = args.url
+    if url is None:
+        # In its own process, so the clients do not compete with it for the GIL
+        ready = multiprocessing.Queue()
+        server = multiprocessing.Process(
+            target=serve_sample, args=(("127.0.0.1", 0), ready), daemon=True
+        )
+        server.start()
+        url = f"http://127.0.0.1:{ready.get(timeout=10)}/metrics"
+    try:
+        load_test(url, args.clients, args.duration, args.gzip)
+    finally:
+        if server is not None:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
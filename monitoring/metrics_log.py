@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Compact binary log of SystemMonitor samples, and a reader for it.
+
+A file is a sequence of segments, each a header followed by fixed-size
+little-endian records:
+
+    magic     8 bytes  b"SMBLOG\\x00\\x02" (format version 2)
+    count     uint64   records in the segment, 0 while it is the last one
+    length    uint32   size of the JSON schema that follows
+    schema    JSON     {"gauges": [...], "counters": [...], "base": [...]}
+    records   float64 timestamp, float32 per gauge, uint32 per counter
+
+Gauges are the flattened metric names (see timeseries.flatten), such as
+"cpu.total". Counters are the cumulative I/O byte counts; the header keeps
+their absolute values at the start of the segment and each record only
+the increase since the previous record. A gauge missing from a sample is
+stored as NaN and left out when read back. A new gauge or counter, or a
+counter that went backwards or grew by 4 GiB or more in one interval,
+starts a new segment in the same file, as does every SEGMENT_RECORDS
+records, so that a reader sums at most that many increases to get a
+counter's value at a given record. Only reaching max_bytes starts a
+new file; files rotate like RotatingFileHandler (path, path.1, ...
+path.N), and each one can be read on its own. Version 1 files, a single
+segment without the count, are still read.
+
+Records have a fixed size, so a file can be memory-mapped and a time
+range found by binary search on the timestamps of each segment. The 25
+metrics of a single-core host take 108 bytes per sample, against about
+750 bytes for the same sample as a JSON log line.
+
+Example of usage:
+    # Last hour of CPU and memory as CSV
+    python3 metrics_log.py /var/log/system_monitor.bin \\
+        --since 2026-10-16T09:00 --metrics cpu.total,memory.percent -f csv
+
+    # Everything in the log, one JSON object per line
+    python3 metrics_log.py /var/log/system_monitor.bin -f json
+"""
+
+import os
+import sys
+import csv
+import json
+import math
+import mmap
+import struct
+import argparse
+from datetime import datetime, timezone
+
+from timeseries import flatten
+
+MAGIC = b"SMBLOG\x00\x02"
+MAGIC_V1 = b"SMBLOG\x00\x01"
+COUNTERS = (
+    "disk.read_bytes",
+    "disk.write_bytes",
+    "network.bytes_sent",
+    "network.bytes_recv",
+)
+MAX_DELTA = 0xFFFFFFFF
+# Records per segment: bounds the counter increases added up to reach a
+# record, for a header of about 1 KB per 440 KB of records
+SEGMENT_RECORDS = 4096
+
+
+class Schema:
+    def __init__(self, gauges, counters, base):
+        self.gauges = list(gauges)
+        self.counters = list(counters)
+        self.base = list(base)
+        self.record = struct.Struct(f"<d{len(self.gauges)}f{len(self.counters)}I")
+
+    def header(self):
+        body = json.dumps(
+            {"gauges": self.gauges, "counters": self.counters, "base": self.base}
+        ).encode()
+        return MAGIC + struct.pack("<QI", 0, len(body)) + body
+
+    @classmethod
+    def parse(cls, data, offset=0):
+        """(schema, offset of its records, record count or None) for the
+        segment header at offset; raises ValueError.
+
+        The count is None for a segment that runs to the end of the file.
+        """
+        magic = data[offset : offset + 8]
+        if magic == MAGIC:
+            count, length = struct.unpack_from("<QI", data, offset + 8)
+            start = offset + 20
+        elif magic == MAGIC_V1:
+            count = 0
+            (length,) = struct.unpack_from("<I", data, offset + 8)
+            start = offset + 12
+        else:
+            raise ValueError("not a binary metrics log")
+        body = json.loads(bytes(data[start : start + length]))
+        schema = cls(body["gauges"], body["counters"], body["base"])
+        return schema, start + length, count or None
+
+
+class MetricsLogWriter:
+    """Append samples to a binary log, rotating like RotatingFileHandler"""
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = None
+        self.schema = None
+        self.segment = None  # offset of the current segment's header
+        self.records = None  # offset of its first record
+        self.previous = None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def rotate(self):
+        self.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            if os.path.exists(self.path):
+                os.replace(self.path, f"{self.path}.1")
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    def start_file(self):
+        # Always a fresh file: deltas cannot continue a file written by
+        # another process
+        self.rotate()
+        self.file = open(self.path, "wb")
+        self.schema = None
+
+    def start_segment(self, gauges, counters):
+        end = self.file.tell()
+        if self.schema is not None:
+            # Record the length of the segment being closed, so readers
+            # can find the header after it
+            count = (end - self.records) // self.schema.record.size
+            self.file.seek(self.segment + 8)
+            self.file.write(struct.pack("<Q", count))
+            self.file.seek(end)
+        self.schema = Schema(gauges, counters, counters.values())
+        header = self.schema.header()
+        self.file.write(header)
+        self.segment = end
+        self.records = end + len(header)
+        self.previous = list(counters.values())
+
+    def write(self, timestamp, metrics):
+        """Append one sample (a nested metrics dict) taken at timestamp"""
+        gauges, counters = {}, {}
+        for name, value in flatten(metrics):
+            if name in COUNTERS:
+                counters[name] = int(value)
+            else:
+                gauges[name] = value
+
+        if self.file is None or (
+            self.schema is not None
+            and self.file.tell() + self.schema.record.size > self.max_bytes
+        ):
+            self.start_file()
+        schema = self.schema
+        deltas = None
+        if (
+            schema is not None
+            and gauges.keys() <= set(schema.gauges)
+            and list(counters) == schema.counters
+            and self.file.tell() - self.records < SEGMENT_RECORDS * schema.record.size
+        ):
+            deltas = [new - old for new, old in zip(counters.values(), self.previous)]
+            if any(d < 0 or d > MAX_DELTA for d in deltas):
+                deltas = None
+        if deltas is None:
+            self.start_segment(list(gauges), counters)
+            deltas = [0] * len(counters)
+        self.previous = list(counters.values())
+        values = [gauges.get(name, math.nan) for name in self.schema.gauges]
+        self.file.write(self.schema.record.pack(timestamp, *values, *deltas))
+        self.file.flush()
+
+
+def log_files(path):
+    """The files of a rotated log, oldest first"""
+    files = []
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        files.append(f"{path}.{i}")
+        i += 1
+    files.reverse()
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def segments(data):
+    """Yield (schema, offset of the first record, record count) per segment"""
+    offset = 0
+    while offset < len(data):
+        schema, start, count = Schema.parse(data, offset)
+        size = schema.record.size
+        # A crash can leave half a record at the end
+        available = (len(data) - start) // size
+        if count is None:
+            yield schema, start, available
+            return
+        yield schema, start, min(count, available)
+        offset = start + count * size
+
+
+def read_file(path, since=None, until=None):
+    """Yield (timestamp, {metric: value}) for records with since <= t < until.
+
+    The file is memory-mapped and the range found by binary search in each
+    segment. Only the records inside it are decoded into samples; the
+    records before it in the same segment, at most SEGMENT_RECORDS, are
+    still unpacked to add up the counter increases.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for schema, offset, count in segments(data):
+                yield from read_segment(data, schema, offset, count, since, until)
+
+
+def read_segment(data, schema, offset, count, since, until):
+    size = schema.record.size
+
+    def find(t):
+        low, high = 0, count
+        while low < high:
+            mid = (low + high) // 2
+            if struct.unpack_from("<d", data, offset + mid * size)[0] < t:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    first = 0 if since is None else find(since)
+    last = count if until is None else find(until)
+    if first >= last:
+        return
+
+    # Counters are stored as increases: add up those before first
+    totals = list(schema.base)
+    counter_start = 1 + len(schema.gauges)
+    view = memoryview(data)[offset : offset + last * size]
+    try:
+        if schema.counters:
+            for record in schema.record.iter_unpack(view[: first * size]):
+                for k, delta in enumerate(record[counter_start:]):
+                    totals[k] += delta
+        for record in schema.record.iter_unpack(view[first * size :]):
+            for k, delta in enumerate(record[counter_start:]):
+                totals[k] += delta
+            # NaN marks a gauge missing from the sample (NaN != NaN)
+            values = {
+                name: value
+                for name, value in zip(schema.gauges, record[1:counter_start])
+                if value == value
+            }
+            values.update(zip(schema.counters, totals))
+            yield record[0], values
+    finally:
+        view.release()
+
+
+def read_log(path, since=None, until=None):
+    """read_file() over every file of a rotated log, oldest first"""
+    for name in log_files(path):
+        yield from read_file(name, since, until)
+
+
+def log_metrics(path):
+    """Every metric name found in the log, in first-seen order"""
+    names = {}
+    for name in log_files(path):
+        with open(name, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                continue
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for schema, _, _ in segments(data):
+                    names.update(dict.fromkeys(schema.gauges + schema.counters))
+    return list(names)
+
+
+def parse_time(value):
+    """Epoch seconds, or an ISO 8601 time (UTC unless it has an offset)"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def number(value):
+    """float32 values rounded to the digits they actually hold"""
+    return value if isinstance(value, int) else float(f"{value:.7g}")
+
+
+def iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Read a binary SystemMonitor metrics log"
+    )
+    parser.add_argument("path", help="Log path; rotated files path.1... are included")
+    parser.add_argument("--since", type=parse_time, help="Start time (epoch or ISO)")
+    parser.add_argument("--until", type=parse_time, help="End time (epoch or ISO)")
+    parser.add_argument("--metrics", help="Comma-separated metric names (default: all)")
+    parser.add_argument(
+        "-f", "--format", choices=["json", "csv"], default="json", help="Output format"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not log_files(args.path):
+        print(f"[Error] No log at {args.path}")
+        sys.exit(1)
+    try:
+        names = args.metrics.split(",") if args.metrics else log_metrics(args.path)
+        records = read_log(args.path, args.since, args.until)
+        if args.format == "csv":
+            writer = csv.writer(sys.stdout)
+            writer.writerow(["timestamp"] + names)
+            for timestamp, values in records:
+                writer.writerow(
+                    [iso(timestamp)]
+                    + [number(values[n]) if n in values else "" for n in names]
+                )
+        else:
+            wanted = set(names)
+            for timestamp, values in records:
+                row = {"timestamp": iso(timestamp)}
+                row.update((n, number(v)) for n, v in values.items() if n in wanted)
+                sys.stdout.write(json.dumps(row) + "\n")
+    except BrokenPipeError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"[Error] {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,45 @@ Example of usage:
     # Scan custom range with higher timeout
     python3 port_scanner.py scanme.nmap.org -s 20 -e 100 -t 1.0
 
-    # Increase thread count for faster scan
-    python3 port_scanner.py 192.168.1.1 -th 200
+    # Scan all ports with 5000 probes in flight
+    python3 port_scanner.py 192.168.1.1 -s 1 -e 65535 -c 5000
+
+    # Use the old thread-per-port engine with more threads
+    python3 port_scanner.py 192.168.1.1 --engine threads -th 200
+
+    # Keep results in a database and report what changed since the last run
+    python3 port_scanner.py 192.168.1.0/24 --db scans.db --diff
+
+    # Hourly rescan: known ports first, then as much of the sweep as fits
+    # in 5 minutes, carrying on from where the previous run stopped
+    python3 port_scanner.py 10.20.0.0/16 -p 1-1024 --db scans.db --diff --budget 300
+
+    # Compare both engines on localhost
+    python3 port_scanner.py 127.0.0.1 -s 1 -e 65535 --benchmark
+
+    # Sweep a /16 and a host list for a few ports at 20000 probes/s,
+    # streaming every open port as a JSON line
+    python3 port_scanner.py 10.20.0.0/16 -iL hosts.txt -p 22,80,443,8000-8100 \\
+        --rate 20000 --jsonl open.jsonl
 """
 
+import sys
 import socket
 import threading
 import argparse
+import asyncio
+import errno
+import json
 import time
+import sqlite3
+import ipaddress
+from itertools import chain, islice
+from collections import namedtuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 # Default services (limited mapping for demo)
 COMMON_PORTS = {
@@ -30,31 +61,553 @@ COMMON_PORTS = {
     3389: "RDP",
     8080: "HTTP-Alt",
 }
+FD_RESERVE = 64
+IN_PROGRESS = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN, 10035}  # WSA
+
+# state is "open", "closed" (refused), "filtered" (timed out) or "error"
+ProbeResult = namedtuple("ProbeResult", "host port state rtt")
+
+
+def is_self_connect(sock):
+    """A connect to a free local port can succeed by connecting to itself"""
+    try:
+        return sock.getsockname() == sock.getpeername()
+    except OSError:
+        return False
 
 
-def scan_port(host, port, timeout):
+def scan_port(host, port, timeout, results):
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.settimeout(timeout)
             result = s.connect_ex((host, port))
-            if result == 0:
-                service = COMMON_PORTS.get(port, "Unknown")
-                print(f"[+] Port {port}/tcp is OPEN ({service})")
+            if result == 0 and not is_self_connect(s):
+                results.append(port)
     except socket.error:
         pass  # Ignore unreachable hosts or ports
 
 
-def resolve_target(target):
+def scan_threaded(host, ports, timeout, threads):
+    """Thread-per-port engine: batches of threads, each joined as a whole"""
+    results = []
+    thread_list = []
+
+    for port in ports:
+        thread = threading.Thread(target=scan_port, args=(host, port, timeout, results))
+        thread_list.append(thread)
+        thread.start()
+
+        if len(thread_list) >= threads:
+            for t in thread_list:
+                t.join()
+            thread_list = []
+
+    # Final batch
+    for t in thread_list:
+        t.join()
+    return sorted(results)
+
+
+def connect_state(sock, err):
+    if err == 0:
+        return "closed" if is_self_connect(sock) else "open"
+    if err == errno.ECONNREFUSED:
+        return "closed"
+    if err == errno.ETIMEDOUT:
+        return "filtered"
+    return "error"
+
+
+def start_probe(loop, host, port, timeout, done):
+    """Start a non-blocking connect; done(ProbeResult) is called once.
+
+    Connects that finish at once (typical for refused or local ports)
+    complete synchronously. The rest wait for writability on the event
+    loop with a timer for the timeout, with no task or future per probe.
+    A socket that cannot be created (e.g. EMFILE, ENOBUFS) is reported as
+    "error", so the caller's slot is still released.
+    """
+    start = time.perf_counter()
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    except OSError:
+        done(ProbeResult(host, port, "error", time.perf_counter() - start))
+        return
+    sock.setblocking(False)
+
+    def finish(state):
+        sock.close()
+        done(ProbeResult(host, port, state, time.perf_counter() - start))
+
     try:
-        return socket.gethostbyname(target)
-    except socket.gaierror:
-        print(f"[Error] Cannot resolve host: {target}")
-        exit(1)
+        err = sock.connect_ex((host, port))
+    except OSError as e:  # e.g. EMFILE, unroutable address
+        err = e.errno
+    if err not in IN_PROGRESS:
+        finish(connect_state(sock, err))
+        return
+
+    fd = sock.fileno()
+
+    def writable():
+        loop.remove_writer(fd)
+        timer.cancel()
+        finish(connect_state(sock, sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)))
+
+    def expired():
+        loop.remove_writer(fd)
+        finish("filtered")
+
+    loop.add_writer(fd, writable)
+    timer = loop.call_later(timeout, expired)
+
+
+class HostTiming:
+    """Per-host connect timeout from measured RTTs, computed like TCP's RTO.
+
+    Starts at the maximum timeout; every connect that gets an answer (open
+    or refused) updates a smoothed RTT and its variance (RFC 6298), and
+    the timeout becomes srtt + 4 * rttvar, kept within [minimum, maximum].
+    """
+
+    __slots__ = ("srtt", "rttvar")
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+
+    def update(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    def timeout(self, minimum, maximum):
+        if self.srtt is None:
+            return maximum
+        return min(maximum, max(minimum, self.srtt + 4 * self.rttvar))
+
+
+def interleave(hosts, ports, start=0):
+    """Yield (host, port) so that every host gets a port before the next one.
+
+    Consecutive probes then go to different hosts, and no single target
+    sees more than its share of the window at once. With start, the sweep
+    begins at that position of the full order and wraps around to it.
+    """
+    skip_ports, skip_hosts = divmod(start, len(hosts)) if start else (0, 0)
+    for port in ports[skip_ports:]:
+        for host in islice(hosts, skip_hosts, None):
+            yield host, port
+        skip_hosts = 0
+    if start:
+        for port in ports[:skip_ports]:
+            for host in hosts:
+                yield host, port
+        for host in islice(hosts, start % len(hosts)):
+            yield host, ports[skip_ports]
+
+
+async def scan_async(
+    hosts,
+    ports,
+    timeout,
+    concurrency,
+    min_timeout=None,
+    rate=None,
+    on_result=None,
+    order=None,
+    budget=None,
+):
+    """Probe every port on every host with at most concurrency connects in flight.
+
+    The window is a semaphore released by each probe as it completes, so
+    a new probe starts as soon as any slot frees up and one slow port
+    never holds back the rest. Probes are interleaved across hosts.
+
+    With min_timeout set, each host's timeout adapts to its measured RTT
+    between min_timeout and timeout (see HostTiming). rate caps the probes
+    started per second. Each ProbeResult is passed to on_result as it
+    completes; without on_result they are collected and returned, sorted
+    by host and port.
+
+    order replaces the interleaved sweep with any iterable of (host, port);
+    it is only advanced when a probe is about to start. With budget, no
+    probe starts once that many seconds have passed.
+
+    If on_result raises, no further probe starts; the ones in flight are
+    waited for and the first exception is raised again.
+    """
+    loop = asyncio.get_running_loop()
+    window = asyncio.Semaphore(concurrency)
+    results = []
+    timings = {}
+    on_result = on_result or results.append
+
+    failures = []
+
+    def done(result):
+        # Runs as an event loop callback, which would only log an exception:
+        # keep the first one for the caller and always free the slot
+        try:
+            if min_timeout is not None and result.state in ("open", "closed"):
+                timings[result.host].update(result.rtt)
+            on_result(result)
+        except Exception as e:
+            if not failures:
+                failures.append(e)
+        finally:
+            window.release()
+
+    started = loop.time()
+    probes = iter(order if order is not None else interleave(hosts, ports))
+    count = 0
+    while True:
+        await window.acquire()
+        if failures:
+            window.release()
+            break
+        if rate:
+            # Sleep only when more than a millisecond ahead of schedule
+            ahead = started + count / rate - loop.time()
+            if ahead > 0.001:
+                await asyncio.sleep(ahead)
+        if budget is not None and loop.time() - started >= budget:
+            window.release()
+            break
+        try:
+            host, port = next(probes)
+        except StopIteration:
+            window.release()
+            break
+        count += 1
+        probe_timeout = timeout
+        if min_timeout is not None:
+            timing = timings.get(host)
+            if timing is None:
+                timing = timings[host] = HostTiming()
+            probe_timeout = timing.timeout(min_timeout, timeout)
+        start_probe(loop, host, port, probe_timeout, done)
+    # Wait for the stragglers by taking back every slot
+    for _ in range(concurrency):
+        await window.acquire()
+    if failures:
+        raise failures[0]
+    return sorted(results, key=lambda r: (socket.inet_aton(r.host), r.port))
+
+
+def max_concurrency(requested):
+    """Raise the open-file limit as far as allowed and fit requested to it"""
+    if resource is None:
+        return requested
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = requested + FD_RESERVE
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        new_soft = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+            soft = new_soft
+        except (ValueError, OSError):
+            pass
+    if soft == resource.RLIM_INFINITY:
+        return requested
+    return max(1, min(requested, soft - FD_RESERVE))
+
+
+def scan(hosts, ports, timeout, concurrency, **options):
+    """Run the asyncio engine; see scan_async for the options"""
+    if sys.platform == "win32":
+        # The default proactor loop has no add_writer()
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    return asyncio.run(
+        scan_async(hosts, ports, timeout, max_concurrency(concurrency), **options)
+    )
+
+
+def benchmark(host, ports, timeout, concurrency, threads):
+    ports = list(ports)
+    start = time.perf_counter()
+    open_async = [
+        r.port for r in scan([host], ports, timeout, concurrency) if r.state == "open"
+    ]
+    async_time = time.perf_counter() - start
+    print(
+        f"[i] asyncio, window {concurrency}: {async_time:.2f}s, {len(open_async)} open"
+    )
+
+    start = time.perf_counter()
+    open_threaded = scan_threaded(host, ports, timeout, threads)
+    threaded_time = time.perf_counter() - start
+    print(
+        f"[i] threads, batches of {threads}: {threaded_time:.2f}s, {len(open_threaded)} open"
+    )
+    print(f"[i] Speedup: {threaded_time / max(async_time, 1e-9):.1f}x")
+    if open_async != open_threaded:
+        print("[Error] The engines found different open ports")
+
+
+class HostRanges:
+    """IPv4 addresses from CIDRs, addresses and hostnames, expanded lazily.
+
+    Stored as (first, count) runs of integers, so a /16 costs one entry
+    rather than 65536 strings. Iterating yields dotted-quad strings in the
+    order the targets were given; overlapping targets are not merged.
+    """
+
+    def __init__(self):
+        self.runs = []
+
+    def add(self, target):
+        """Add one target; raises ValueError if it does not resolve"""
+        if "/" in target:
+            net = ipaddress.IPv4Network(target, strict=False)
+            if net.num_addresses > 2:
+                # Leave out the network and broadcast addresses
+                self.runs.append((int(net.network_address) + 1, net.num_addresses - 2))
+            else:
+                self.runs.append((int(net.network_address), net.num_addresses))
+            return
+        try:
+            address = socket.gethostbyname(target)
+        except socket.gaierror:
+            raise ValueError(f"Cannot resolve host: {target}") from None
+        self.runs.append((int(ipaddress.IPv4Address(address)), 1))
+
+    def __len__(self):
+        return sum(count for _, count in self.runs)
+
+    def __contains__(self, host):
+        value = int(ipaddress.IPv4Address(host))
+        return any(first <= value < first + count for first, count in self.runs)
+
+    def __iter__(self):
+        for first, count in self.runs:
+            for value in range(first, first + count):
+                yield str(ipaddress.IPv4Address(value))
+
+
+class ResultStore:
+    """Port states from earlier scans, in a SQLite file.
+
+    Only ports that are or once were open get a row, keyed by host (as an
+    integer) and port, so a sweep of mostly closed addresses stays small.
+    Each row records when the port was last seen open and when its state
+    last changed. Sweeps run under a time budget save how far they got,
+    keyed by their targets and ports, so the next run carries on there.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS ports (
+            host INTEGER NOT NULL,
+            port INTEGER NOT NULL,
+            open INTEGER NOT NULL,
+            last_seen INTEGER NOT NULL,
+            changed INTEGER NOT NULL,
+            PRIMARY KEY (host, port)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS scans (
+            id INTEGER PRIMARY KEY,
+            started INTEGER NOT NULL,
+            duration REAL NOT NULL,
+            probes INTEGER NOT NULL,
+            open INTEGER NOT NULL,
+            opened INTEGER NOT NULL,
+            closed INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS sweeps (
+            key TEXT PRIMARY KEY,
+            position INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(self.SCHEMA)
+        self.known = {}
+        self.seen = []
+        self.changes = []
+        self.probes = 0
+
+    def close(self):
+        self.db.close()
+
+    def load(self, hosts, ports):
+        """Read the stored rows that fall within these targets and ports.
+
+        hosts is a HostRanges; each of its runs is one range lookup on the
+        (host, port) key, so rows of other targets are never read.
+        """
+        ports = set(ports)
+        for first, count in hosts.runs:
+            for host, port, is_open, changed in self.db.execute(
+                "SELECT host, port, open, changed FROM ports "
+                "WHERE host BETWEEN ? AND ?",
+                (first, first + count - 1),
+            ):
+                if port in ports:
+                    host = str(ipaddress.IPv4Address(host))
+                    self.known[host, port] = (bool(is_open), changed)
+
+    def last_scan(self):
+        row = self.db.execute("SELECT max(started) FROM scans").fetchone()
+        return row[0]
+
+    def priority(self):
+        """Stored (host, port) pairs: open ones first, then the rest, each
+        most recently changed first"""
+        rows = sorted(
+            self.known.items(), key=lambda item: (not item[1][0], -item[1][1])
+        )
+        return [pair for pair, _ in rows]
+
+    def observe(self, result):
+        """Note one probe result; returns "opened", "closed" or None"""
+        self.probes += 1
+        key = (result.host, result.port)
+        was_open = self.known.get(key, (False, 0))[0]
+        if result.state == "open":
+            self.seen.append(key)
+            if not was_open:
+                self.changes.append((key, True))
+                return "opened"
+        elif was_open and result.state in ("closed", "filtered"):
+            self.changes.append((key, False))
+            return "closed"
+        return None
+
+    def commit(self, started, duration):
+        """Save everything observed since load() in one transaction"""
+        now = int(time.time())
+        opened = [key for key, is_open in self.changes if is_open]
+        closed = [key for key, is_open in self.changes if not is_open]
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO ports VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT (host, port) DO UPDATE "
+                "SET open = 1, last_seen = excluded.last_seen, changed = excluded.changed",
+                ((int(ipaddress.IPv4Address(h)), p, now, now) for h, p in opened),
+            )
+            self.db.executemany(
+                "UPDATE ports SET last_seen = ? WHERE host = ? AND port = ?",
+                (
+                    (now, int(ipaddress.IPv4Address(h)), p)
+                    for h, p in self.seen
+                    if self.known.get((h, p), (False,))[0]
+                ),
+            )
+            self.db.executemany(
+                "UPDATE ports SET open = 0, changed = ? WHERE host = ? AND port = ?",
+                ((now, int(ipaddress.IPv4Address(h)), p) for h, p in closed),
+            )
+            self.db.execute(
+                "INSERT INTO scans (started, duration, probes, open, opened, closed) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    int(started),
+                    duration,
+                    self.probes,
+                    len(self.seen),
+                    len(opened),
+                    len(closed),
+                ),
+            )
+        return opened, closed
+
+    def sweep_position(self, key):
+        row = self.db.execute(
+            "SELECT position FROM sweeps WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def save_sweep_position(self, key, position):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO sweeps VALUES (?, ?)", (key, position)
+            )
+
+
+def prioritized(store, hosts, ports, start):
+    """Probe order for a budgeted rescan, and a function giving the position
+    the interleaved sweep reached.
+
+    Stored ports come first (see ResultStore.priority); then the sweep
+    carries on from start, skipping the ports already probed.
+    """
+    first = store.priority()
+    done = set(first)
+    swept = 0
+
+    def sweep():
+        nonlocal swept
+        for pair in interleave(hosts, ports, start):
+            swept += 1
+            if pair not in done:
+                yield pair
+
+    def position():
+        return (start + swept) % (len(hosts) * len(ports))
+
+    return chain(first, sweep()), position
+
+
+def parse_ports(spec):
+    """Parse "22,80,8000-8100" into a sorted list of unique ports"""
+    ports = set()
+    for part in spec.split(","):
+        low, _, high = part.strip().partition("-")
+        low = int(low)
+        high = int(high) if high else low
+        if not 1 <= low <= high <= 65535:
+            raise ValueError(f"invalid port range: {part}")
+        ports.update(range(low, high + 1))
+    return sorted(ports)
+
+
+def read_targets(path):
+    """Targets from a file or stdin ("-"), whitespace separated; # comments"""
+    f = sys.stdin if path == "-" else open(path)
+    try:
+        for line in f:
+            yield from line.partition("#")[0].split()
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def jsonl_writer(f, states):
+    """on_result callback writing each result in states as one JSON line"""
+
+    def write(result):
+        if result.state in states:
+            f.write(
+                json.dumps(
+                    {
+                        "host": result.host,
+                        "port": result.port,
+                        "state": result.state,
+                        "rtt": round(result.rtt, 6),
+                    }
+                )
+                + "\n"
+            )
+            f.flush()
+
+    return write
 
 
 def main():
     parser = argparse.ArgumentParser(description="Fast TCP Port Scanner")
-    parser.add_argument("target", help="Target IP or hostname")
+    parser.add_argument(
+        "targets", nargs="*", help="Target IPs, hostnames or CIDR ranges"
+    )
+    parser.add_argument(
+        "-iL", "--input-list", help="Read more targets from a file ('-' for stdin)"
+    )
+    parser.add_argument(
+        "-p", "--ports", help="Port list such as 22,80,8000-8100 (overrides -s/-e)"
+    )
     parser.add_argument(
         "-s", "--start", type=int, default=1, help="Start port (default: 1)"
     )
@@ -68,38 +621,204 @@ def main():
         default=0.5,
         help="Timeout in seconds (default: 0.5)",
     )
+    parser.add_argument(
+        "--min-timeout",
+        type=float,
+        default=0.1,
+        help="Lowest per-host timeout once RTTs are measured; "
+        "set to --timeout for a fixed timeout (default: 0.1)",
+    )
+    parser.add_argument(
+        "--rate", type=float, help="Maximum probes started per second (async engine)"
+    )
+    parser.add_argument(
+        "--jsonl",
+        metavar="PATH",
+        help="Stream results as JSON lines to PATH ('-' for stdout)",
+    )
+    parser.add_argument(
+        "--all-states",
+        action="store_true",
+        help="With --jsonl, also write closed, filtered and error results",
+    )
+    parser.add_argument(
+        "--db", metavar="PATH", help="Keep port states across scans in this file"
+    )
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="With --db, report ports opened or closed since they were last probed",
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        metavar="SECONDS",
+        help="With --db, probe known ports first, then sweep the rest for at "
+        "most this long, resuming the sweep where the last run stopped",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["async", "threads"],
+        default="async",
+        help="Scanning engine (default: async)",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=1000,
+        help="Probes in flight with the async engine (default: 1000)",
+    )
     parser.add_argument(
         "-th",
         "--threads",
         type=int,
         default=100,
-        help="Number of threads (default: 100)",
+        help="Number of threads with the threads engine (default: 100)",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Scan with both engines and compare their times",
     )
 
     args = parser.parse_args()
-    host = resolve_target(args.target)
+    hosts = HostRanges()
+    targets = list(args.targets)
+    try:
+        if args.input_list:
+            targets.extend(read_targets(args.input_list))
+        for target in targets:
+            hosts.add(target)
+        if args.ports:
+            ports = parse_ports(args.ports)
+        else:
+            ports = range(args.start, args.end + 1)
+    except (OSError, ValueError) as e:
+        print(f"[Error] {e}")
+        sys.exit(1)
+    if not len(hosts):
+        parser.error("no targets given")
+    single = next(iter(hosts)) if len(hosts) == 1 else None
 
-    print(f"\nScanning {host} from port {args.start} to {args.end}...")
-    print(f"Timeout: {args.timeout}s | Threads: {args.threads}\n")
+    if args.benchmark or args.engine == "threads":
+        if single is None:
+            parser.error("the threads engine and --benchmark scan a single host")
+        if args.jsonl or args.db:
+            parser.error("--jsonl and --db need the async engine")
+    if (args.diff or args.budget is not None) and not args.db:
+        parser.error("--diff and --budget need --db")
+    if args.benchmark:
+        benchmark(single, ports, args.timeout, args.concurrency, args.threads)
+        return
+
+    port_text = args.ports or f"{args.start}-{args.end}"
+    what = single or f"{len(hosts)} hosts"
+    # Keep stdout clean for the JSON lines
+    log = sys.stderr if args.jsonl == "-" else sys.stdout
+    print(f"\nScanning {what}, ports {port_text}...", file=log)
+    if args.engine == "async":
+        print(
+            f"Timeout: {args.min_timeout}-{args.timeout}s | "
+            f"Concurrency: {args.concurrency}"
+            + (f" | Rate: {args.rate:g}/s" if args.rate else "")
+            + "\n",
+            file=log,
+        )
+    else:
+        print(f"Timeout: {args.timeout}s | Threads: {args.threads}\n", file=log)
 
     start_time = time.time()
-    thread_list = []
+    if args.engine == "threads":
+        found = [
+            (single, port)
+            for port in scan_threaded(single, ports, args.timeout, args.threads)
+        ]
+    else:
+        found = []
 
-    for port in range(args.start, args.end + 1):
-        thread = threading.Thread(target=scan_port, args=(host, port, args.timeout))
-        thread_list.append(thread)
-        thread.start()
+        def collect(result):
+            if result.state == "open":
+                found.append((result.host, result.port))
 
-        if len(thread_list) >= args.threads:
-            for t in thread_list:
-                t.join()
-            thread_list = []
+        out = store = order = None
+        options = {}
+        if args.db:
+            store = ResultStore(args.db)
+            store.load(hosts, ports)
+            last_scan = store.last_scan()
+            if args.budget is not None:
+                sweep_key = f"{' '.join(targets)} -p {port_text}"
+                order, position = prioritized(
+                    store, hosts, ports, store.sweep_position(sweep_key)
+                )
+                options.update(order=order, budget=args.budget)
 
-    # Final batch
-    for t in thread_list:
-        t.join()
+            def collect(result, collect=collect):
+                collect(result)
+                store.observe(result)
+
+        on_result = collect
+        if args.jsonl:
+            out = sys.stdout if args.jsonl == "-" else open(args.jsonl, "w")
+            states = {"open", "closed", "filtered", "error"}
+            write = jsonl_writer(out, states if args.all_states else {"open"})
+
+            def on_result(result):
+                collect(result)
+                write(result)
+
+        try:
+            scan(
+                hosts,
+                ports,
+                args.timeout,
+                args.concurrency,
+                min_timeout=min(args.min_timeout, args.timeout),
+                rate=args.rate,
+                on_result=on_result,
+                **options,
+            )
+        finally:
+            if out is not None and out is not sys.stdout:
+                out.close()
+        found.sort(key=lambda hp: (socket.inet_aton(hp[0]), hp[1]))
+        if store is not None:
+            opened, closed = store.commit(start_time, time.time() - start_time)
+            if order is not None:
+                store.save_sweep_position(sweep_key, position())
+                print(
+                    f"[i] Probed {store.probes} of {len(hosts) * len(ports)} ports "
+                    f"within the {args.budget:g}s budget",
+                    file=log,
+                )
+            store.close()
+
+    if args.jsonl != "-":
+        for host, port in found:
+            service = COMMON_PORTS.get(port, "Unknown")
+            prefix = "" if single else f"{host} "
+            print(f"[+] {prefix}Port {port}/tcp is OPEN ({service})")
+
+    if args.diff:
+        if last_scan is None:
+            print("\n[i] No earlier scan to compare with", file=log)
+        else:
+            since = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last_scan))
+            print(f"\nChanges since the scan of {since}:", file=log)
+            for sign, label, pairs in (
+                ("+", "opened", opened),
+                ("-", "closed", closed),
+            ):
+                for host, port in sorted(
+                    pairs, key=lambda hp: (socket.inet_aton(hp[0]), hp[1])
+                ):
+                    service = COMMON_PORTS.get(port, "Unknown")
+                    print(f"[{sign}] {host}:{port}/tcp {label} ({service})", file=log)
+            if not opened and not closed:
+                print("[i] No changes", file=log)
 
-    print(f"\nScan complete in {time.time() - start_time:.2f} seconds.")
+    print(f"\nScan complete in {time.time() - start_time:.2f} seconds.", file=log)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,305 @@
+"""
+Fixed-memory time-series history for SystemMonitor.
+
+Every numeric metric of a sample (flattened to names such as "cpu.total"
+or "cpu.per_core.3") is kept in three tiers of preallocated arrays used as
+ring buffers, so memory never grows and old data is overwritten in place:
+
+    raw     every sample, for raw_days
+    1m      one bucket per minute with min, max and avg, for minute_days
+    1h      one bucket per hour with min, max and avg, for hour_days
+
+Values are float32 (about 7 significant digits) and timestamps float64;
+rollup buckets also keep their sample count. Queries slice the arrays and
+return arrays, so no Python object is kept per sample.
+
+Memory budget per metric, with the default retention (7 days raw, 30 days
+of minutes, a year of hours) and a 1 second interval:
+
+    raw   604,800 samples x 4 B          2.42 MB
+    1m     43,200 buckets x 3 x 4 B      0.52 MB
+    1h      8,760 buckets x 3 x 4 B      0.11 MB
+                                         3.05 MB per metric
+
+plus 5.5 MB of timestamps and counts shared by all metrics. A typical
+4-core host logs about 25 metrics, so roughly 81 MB; the raw tier shrinks
+in proportion to longer intervals (a 60 s interval needs 1/60 of it).
+Metrics that would take the store past max_bytes are not recorded; see
+TimeSeriesStore.dropped.
+
+Example of usage:
+    store = TimeSeriesStore(interval=1)
+    store.append(time.time(), metrics)
+    times, values = store.series("cpu.total", start=time.time() - 300)
+    store.aggregate("memory.percent", start=time.time() - 86400)
+"""
+
+import math
+from array import array
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def flatten(metrics, prefix=""):
+    """Yield (name, value) for every number in a nested metrics dict"""
+    for key, value in metrics.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten(value, name + ".")
+        elif isinstance(value, (list, tuple)):
+            yield from flatten(dict(enumerate(value)), name + ".")
+        elif isinstance(value, (int, float)):  # bools become 0 and 1
+            yield name, float(value)
+
+
+class Tier:
+    """One ring of time slots with a column of values per metric.
+
+    Slot i in logical order (0 is the oldest) lives at physical index
+    (first + i) % capacity in every array of the tier.
+    """
+
+    def __init__(self, name, capacity, width):
+        self.name = name
+        self.capacity = capacity
+        self.width = width  # bucket length in seconds, None for raw
+        self.times = array("d", bytes(8 * capacity))
+        self.counts = array("I", [0]) * capacity if width else None
+        self.columns = {}
+        self.first = 0
+        self.size = 0
+
+    def fields(self):
+        return ("avg", "min", "max") if self.width else ("value",)
+
+    def column_bytes(self):
+        return 4 * self.capacity * len(self.fields())
+
+    def add_column(self, metric):
+        nan = array("f", [math.nan]) * self.capacity
+        self.columns[metric] = {field: array("f", nan) for field in self.fields()}
+
+    def next_slot(self):
+        """Physical index for a new entry, dropping the oldest when full"""
+        if self.size < self.capacity:
+            slot = (self.first + self.size) % self.capacity
+            self.size += 1
+        else:
+            slot = self.first
+            self.first = (self.first + 1) % self.capacity
+        return slot
+
+    def time_at(self, i):
+        return self.times[(self.first + i) % self.capacity]
+
+    def bounds(self, start, end):
+        """Logical [i, j) of the entries with start <= time < end"""
+
+        def bisect(t):
+            low, high = 0, self.size
+            while low < high:
+                mid = (low + high) // 2
+                if self.time_at(mid) < t:
+                    low = mid + 1
+                else:
+                    high = mid
+            return low
+
+        i = 0 if start is None else bisect(start)
+        j = self.size if end is None else bisect(end)
+        return i, max(i, j)
+
+    def slice(self, data, i, j):
+        """Copy of logical entries [i, j) of one array, oldest first"""
+        p = (self.first + i) % self.capacity
+        n = j - i
+        if p + n <= self.capacity:
+            return data[p : p + n]
+        return data[p:] + data[: n - (self.capacity - p)]
+
+
+class TimeSeriesStore:
+    def __init__(
+        self,
+        interval,
+        raw_days=7,
+        minute_days=30,
+        hour_days=365,
+        max_bytes=DEFAULT_MAX_BYTES,
+    ):
+        self.tiers = [
+            Tier("raw", max(1, math.ceil(raw_days * DAY / interval)), None),
+            Tier("1m", minute_days * DAY // MINUTE, MINUTE),
+            Tier("1h", hour_days * DAY // HOUR, HOUR),
+        ]
+        self.max_bytes = max_bytes
+        self.last = {}  # metric -> last value, repeated for missing readings
+        self.since = {}  # metric -> time of its first sample
+        self.dropped = set()
+        # (tier name, metric) -> (bucket start, samples) of its first bucket
+        self.partial = {}
+        # Open rollup buckets: tier -> [start, count, {metric: [min, max, sum, n]}]
+        self.open = {tier: None for tier in self.tiers if tier.width}
+
+    def memory_bytes(self):
+        """Bytes held by every array of the store"""
+        total = 0
+        for tier in self.tiers:
+            arrays = [tier.times] + ([tier.counts] if tier.counts else [])
+            for columns in tier.columns.values():
+                arrays.extend(columns.values())
+            total += sum(a.buffer_info()[1] * a.itemsize for a in arrays)
+        return total
+
+    def metric_bytes(self):
+        """Bytes each additional metric takes"""
+        return sum(tier.column_bytes() for tier in self.tiers)
+
+    def metrics(self):
+        return list(self.last)
+
+    def register(self, metric, timestamp):
+        if self.memory_bytes() + self.metric_bytes() > self.max_bytes:
+            self.dropped.add(metric)
+            return False
+        for tier in self.tiers:
+            tier.add_column(metric)
+        self.since[metric] = timestamp
+        return True
+
+    def append(self, timestamp, metrics):
+        """Record one sample; metrics is a nested dict or a {name: value} map.
+
+        Timestamps must not go backwards. A known metric missing from the
+        sample repeats its last value.
+        """
+        values = dict(flatten(metrics))
+        for metric in values.keys() - self.last.keys() - self.dropped:
+            self.register(metric, timestamp)
+        for metric in self.dropped:
+            values.pop(metric, None)
+        for metric, value in self.last.items():
+            values.setdefault(metric, value)
+        self.last = values
+
+        raw = self.tiers[0]
+        slot = raw.next_slot()
+        raw.times[slot] = timestamp
+        for metric, value in values.items():
+            raw.columns[metric]["value"][slot] = value
+
+        for tier, bucket in self.open.items():
+            start = timestamp - timestamp % tier.width
+            if bucket is not None and bucket[0] != start:
+                self.close_bucket(tier, bucket)
+                bucket = None
+            if bucket is None:
+                bucket = self.open[tier] = [start, 0, {}]
+            bucket[1] += 1
+            stats = bucket[2]
+            for metric, value in values.items():
+                s = stats.get(metric)
+                if s is None:
+                    stats[metric] = [value, value, value, 1]
+                else:
+                    if value < s[0]:
+                        s[0] = value
+                    if value > s[1]:
+                        s[1] = value
+                    s[2] += value
+                    s[3] += 1
+
+    def close_bucket(self, tier, bucket):
+        start, count, stats = bucket
+        slot = tier.next_slot()
+        tier.times[slot] = start
+        tier.counts[slot] = count
+        for metric, columns in tier.columns.items():
+            low, high, total, n = stats.get(metric, (math.nan, math.nan, math.nan, 1))
+            columns["min"][slot] = low
+            columns["max"][slot] = high
+            columns["avg"][slot] = total / n
+            if metric in stats and n != count:
+                # First seen mid-bucket: only n of the samples are its own
+                self.partial[tier.name, metric] = (start, n)
+
+    def tier(self, name):
+        for tier in self.tiers:
+            if tier.name == name:
+                return tier
+        raise ValueError(f"unknown tier '{name}'")
+
+    def locate(self, metric, start, end, tier):
+        """Logical [i, j) of a tier's entries for metric in [start, end)"""
+        if start is None or start < self.since[metric]:
+            start = self.since[metric]
+        if tier.width:
+            # Include the bucket holding start, which begins before it
+            start -= start % tier.width
+        return tier.bounds(start, end)
+
+    def series(self, metric, start=None, end=None, tier="raw", field=None):
+        """(times, values) arrays for one metric with start <= time < end.
+
+        For the 1m and 1h tiers, field picks "avg" (default), "min" or
+        "max", and times are bucket starts. Only closed buckets are
+        included. Raises KeyError for an unknown metric.
+        """
+        t = self.tier(tier)
+        columns = t.columns[metric]
+        i, j = self.locate(metric, start, end, t)
+        data = columns[field or t.fields()[0]]
+        return t.slice(t.times, i, j), t.slice(data, i, j)
+
+    def pick_tier(self, start):
+        """The finest tier that still holds data from start.
+
+        With start None that is the finest tier that has not dropped any
+        entry yet, since only it covers all the data.
+        """
+        for t in self.tiers:
+            if t.size and (
+                t.size < t.capacity or start is not None and t.time_at(0) <= start
+            ):
+                return t
+        # Older than every tier holds: the coarsest one with any data
+        for t in reversed(self.tiers):
+            if t.size:
+                return t
+        return self.tiers[0]
+
+    def aggregate(self, metric, start=None, end=None):
+        """min, max, avg and sample count of a metric over a time range.
+
+        Uses the finest tier that still covers start; with a rollup tier
+        the range is widened to whole buckets. Returns None when there is
+        no data in the range. Raises KeyError for an unknown metric.
+        """
+        t = self.pick_tier(start)
+        columns = t.columns[metric]
+        i, j = self.locate(metric, start, end, t)
+        if i == j:
+            return None
+        if t.width is None:
+            values = t.slice(columns["value"], i, j)
+            return {
+                "min": min(values),
+                "max": max(values),
+                "avg": math.fsum(values) / len(values),
+                "count": len(values),
+            }
+        counts = t.slice(t.counts, i, j)
+        partial = self.partial.get((t.name, metric))
+        if partial and partial[0] == t.time_at(i):
+            counts[0] = partial[1]
+        avgs = t.slice(columns["avg"], i, j)
+        total = sum(counts)
+        return {
+            "min": min(t.slice(columns["min"], i, j)),
+            "max": max(t.slice(columns["max"], i, j)),
+            "avg": math.fsum(a * c for a, c in zip(avgs, counts)) / total,
+            "count": total,
+        }
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Top-N processes by CPU, resident memory and disk I/O.
+
+On Linux each process's /proc/<pid>/stat and /proc/<pid>/io are opened
+once and kept open between cycles; every cycle rereads them with a single
+pread() each and parses only the fields it needs (CPU ticks, start time
+and RSS from stat, read_bytes and write_bytes from io). CPU% and I/O
+bytes/s are deltas against the previous cycle. A descriptor stays bound
+to the process it was opened for, so a reused PID reads as an error and
+is reopened. Command lines are read only for the processes reported.
+Other platforms use psutil, whose Process objects are cached the same way.
+
+Budget: at most 150 ms per collection with 10,000 processes, which is
+0.25% of one core at SystemMonitor's default 60 s interval. Measure it on
+a host with --bench, which starts idle processes and times collection at
+several process counts.
+
+Example of usage:
+    python3 top_processes.py -n 10
+    python3 top_processes.py --bench 0 2000 5000 10000
+"""
+
+import os
+import time
+import heapq
+import argparse
+import subprocess
+
+FD_RESERVE = 256
+BUDGET_SECONDS = 0.150  # per collection at 10,000 processes
+MAX_CMDLINE = 256
+
+
+class ProcHandle:
+    """Open /proc files of one process, with its previous counters"""
+
+    __slots__ = ("stat_fd", "io_fd", "start", "ticks", "io", "cmdline")
+
+    def __init__(self):
+        self.stat_fd = None  # None when the files are opened per cycle
+        self.io_fd = None
+        self.start = None
+        self.ticks = None
+        self.io = None
+        self.cmdline = None
+
+    def close(self):
+        for fd in (self.stat_fd, self.io_fd):
+            if fd is not None:
+                os.close(fd)
+        self.stat_fd = self.io_fd = None
+
+
+def parse_stat(data):
+    """(name, start time, CPU ticks, RSS pages) from /proc/<pid>/stat.
+
+    The name stays bytes; only the reported processes need it decoded.
+    """
+    # The name is in parentheses and may itself contain spaces or ")"
+    head, _, rest = data.rpartition(b")")
+    fields = rest.split(None, 22)
+    name = head.partition(b"(")[2]
+    return name, int(fields[19]), int(fields[11]) + int(fields[12]), int(fields[21])
+
+
+def parse_io(data):
+    """read_bytes + write_bytes from /proc/<pid>/io"""
+    fields = data.split()
+    return int(fields[9]) + int(fields[11])
+
+
+def read_path(path, size):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, size)
+    finally:
+        os.close(fd)
+
+
+class ProcSource:
+    """Linux: read /proc through descriptors cached per process"""
+
+    def __init__(self):
+        self.handles = {}
+        self.cached = 0  # handles holding open descriptors
+        self.ticks_per_second = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        try:
+            import resource
+
+            soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        except ImportError:
+            soft = 1024
+        # Two descriptors per process; past this, files are opened per cycle
+        self.max_cached = max(0, (soft - FD_RESERVE) // 2)
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+        self.cached = 0
+
+    def drop(self, handle):
+        if handle.stat_fd is not None:
+            handle.close()
+            self.cached -= 1
+
+    def read(self, pid, handle):
+        """(stat bytes, I/O bytes or None) of one process; raises OSError"""
+        if handle.stat_fd is None and self.cached < self.max_cached:
+            handle.stat_fd = os.open(f"/proc/{pid}/stat", os.O_RDONLY)
+            self.cached += 1
+            try:
+                handle.io_fd = os.open(f"/proc/{pid}/io", os.O_RDONLY)
+            except OSError:
+                pass  # another user's process, without root
+        if handle.stat_fd is None:
+            stat = read_path(f"/proc/{pid}/stat", 1024)
+            try:
+                return stat, parse_io(read_path(f"/proc/{pid}/io", 512))
+            except OSError:
+                return stat, None
+        stat = os.pread(handle.stat_fd, 1024, 0)
+        if handle.io_fd is None:
+            return stat, None
+        return stat, parse_io(os.pread(handle.io_fd, 512, 0))
+
+    def sample(self):
+        """Yield (pid, handle, name, CPU seconds, RSS bytes, I/O bytes or None)"""
+        seen = set()
+        for entry in os.scandir("/proc"):
+            if not entry.name.isdigit():
+                continue
+            pid = int(entry.name)
+            handle = self.handles.get(pid)
+            if handle is None:
+                handle = self.handles[pid] = ProcHandle()
+            try:
+                stat, io = self.read(pid, handle)
+            except OSError:
+                # A cached descriptor fails once its process exits, even if
+                # the PID has been reused: reopen by path
+                self.drop(handle)
+                try:
+                    stat, io = self.read(pid, handle)
+                except OSError:
+                    continue  # exited
+            seen.add(pid)
+            name, start, ticks, rss = parse_stat(stat)
+            if handle.start != start:
+                handle.start = start
+                handle.ticks = handle.io = handle.cmdline = None
+            yield (
+                pid,
+                handle,
+                name,
+                ticks / self.ticks_per_second,
+                rss * self.page_size,
+                io,
+            )
+        for pid in self.handles.keys() - seen:
+            self.drop(self.handles.pop(pid))
+
+    def cmdline(self, pid, handle):
+        if handle.cmdline is None:
+            try:
+                data = read_path(f"/proc/{pid}/cmdline", 4096)
+            except OSError:
+                data = b""
+            handle.cmdline = (
+                data.replace(b"\0", b" ").decode(errors="replace").strip()[:MAX_CMDLINE]
+            )
+        return handle.cmdline
+
+
+class PsutilSource:
+    """Other platforms: psutil Process objects, cached by process_iter()"""
+
+    def __init__(self):
+        import psutil
+
+        self.psutil = psutil
+        self.handles = {}
+
+    def close(self):
+        self.handles.clear()
+
+    def sample(self):
+        seen = set()
+        for proc in self.psutil.process_iter(
+            ["name", "cpu_times", "memory_info", "io_counters", "create_time"]
+        ):
+            info = proc.info
+            if info["cpu_times"] is None or info["memory_info"] is None:
+                continue
+            pid = proc.pid
+            handle = self.handles.get(pid)
+            if handle is None or handle.start != info["create_time"]:
+                handle = self.handles[pid] = ProcHandle()
+                handle.start = info["create_time"]
+                try:
+                    handle.cmdline = " ".join(proc.cmdline())[:MAX_CMDLINE]
+                except self.psutil.Error:
+                    handle.cmdline = ""
+            seen.add(pid)
+            io = info["io_counters"]
+            yield (
+                pid,
+                handle,
+                (info["name"] or "").encode(),
+                info["cpu_times"].user + info["cpu_times"].system,
+                info["memory_info"].rss,
+                io.read_bytes + io.write_bytes if io else None,
+            )
+        for pid in self.handles.keys() - seen:
+            del self.handles[pid]
+
+    def cmdline(self, pid, handle):
+        return handle.cmdline
+
+
+class ProcessCollector:
+    """Top-N processes by CPU%, RSS and I/O bytes/s since the last collect()"""
+
+    def __init__(self, top_n=5):
+        self.top_n = top_n
+        self.source = ProcSource() if os.path.isdir("/proc/self") else PsutilSource()
+        self.last_time = None
+        self.last_duration = 0.0
+        self.process_count = 0
+
+    def close(self):
+        self.source.close()
+
+    def collect(self):
+        """{"cpu": [...], "memory": [...], "io": [...]}, each the top-N as
+        dicts with pid, name, cmdline, cpu_percent, rss and io_per_sec.
+
+        The first call has no previous cycle, so CPU% and I/O are 0.
+        """
+        started = time.perf_counter()
+        now = time.monotonic()
+        elapsed = now - self.last_time if self.last_time else None
+        self.last_time = now
+
+        rows = []
+        for pid, handle, name, cpu, rss, io in self.source.sample():
+            cpu_percent = io_rate = 0.0
+            if elapsed and handle.ticks is not None:
+                cpu_percent = 100.0 * (cpu - handle.ticks) / elapsed
+            if elapsed and io is not None and handle.io is not None:
+                io_rate = (io - handle.io) / elapsed
+            handle.ticks = cpu
+            handle.io = io
+            rows.append((cpu_percent, rss, io_rate, pid, name, handle))
+        self.process_count = len(rows)
+
+        def report(row):
+            cpu_percent, rss, io_rate, pid, name, handle = row
+            return {
+                "pid": pid,
+                "name": name.decode(errors="replace"),
+                "cmdline": self.source.cmdline(pid, handle),
+                "cpu_percent": round(cpu_percent, 1),
+                "rss": rss,
+                "io_per_sec": round(io_rate),
+            }
+
+        top = {
+            key: [report(row) for row in heapq.nlargest(self.top_n, rows, key=k)]
+            for key, k in (
+                ("cpu", lambda r: r[0]),
+                ("memory", lambda r: r[1]),
+                ("io", lambda r: r[2]),
+            )
+        }
+        self.last_duration = time.perf_counter() - started
+        return top
+
+
+def benchmark(counts, rounds):
+    """Time collect() with extra idle processes running"""
+    children = []
+    collector = ProcessCollector()
+    print(f"[i] Budget: {BUDGET_SECONDS * 1e3:.0f} ms at 10,000 processes")
+    try:
+        for count in sorted(counts):
+            while len(children) < count:
+                children.append(
+                    subprocess.Popen(
+                        ["sleep", "3600"], stdin=subprocess.DEVNULL, close_fds=True
+                    )
+                )
+            collector.collect()  # open the new processes' files
+            durations = []
+            for _ in range(rounds):
+                collector.collect()
+                durations.append(collector.last_duration)
+            durations.sort()
+            print(
+                f"[i] {collector.process_count:6d} processes: "
+                f"median {durations[len(durations) // 2] * 1e3:7.2f} ms, "
+                f"max {durations[-1] * 1e3:7.2f} ms, "
+                f"{getattr(collector.source, 'cached', 0)} with open descriptors"
+            )
+    finally:
+        for child in children:
+            child.kill()
+        for child in children:
+            child.wait()
+        collector.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Show the busiest processes")
+    parser.add_argument("-n", "--top", type=int, default=5, help="Processes per list")
+    parser.add_argument(
+        "-i", "--interval", type=float, default=1.0, help="Seconds between samples"
+    )
+    parser.add_argument(
+        "--bench",
+        type=int,
+        nargs="+",
+        metavar="COUNT",
+        help="Time collection with this many extra idle processes (several allowed)",
+    )
+    parser.add_argument(
+        "--rounds", type=int, default=5, help="Collections timed per count"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.bench:
+        benchmark(args.bench, args.rounds)
+        return
+    collector = ProcessCollector(args.top)
+    collector.collect()
+    time.sleep(args.interval)
+    top = collector.collect()
+    print(
+        f"[i] {collector.process_count} processes, "
+        f"collected in {collector.last_duration * 1e3:.1f} ms"
+    )
+    for key, title in (("cpu", "CPU"), ("memory", "Memory"), ("io", "Disk I/O")):
+        print(f"\nTop by {title}:")
+        for p in top[key]:
+            print(
+                f"  {p['pid']:>7} {p['cpu_percent']:6.1f}% "
+                f"{p['rss'] / 2**20:9.1f} MiB {p['io_per_sec'] / 2**10:9.1f} KiB/s  "
+                f"{p['cmdline'] or p['name']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The scripts import their siblings by bare module name, as they do when run
+# from their own directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for subdir in ("backup", "user-management", "monitoring"):
+    sys.path.insert(0, os.path.join(ROOT, subdir))
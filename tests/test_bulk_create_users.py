@@ -0,0 +1,199 @@
+import os
+
+import pytest
+
+import bulk_create_users
+from bulk_create_users import LockError, bulk_create_linux
+
+PASSWD = """root:x:0:0:root:/root:/bin/bash
+alice:x:1000:1000::/home/alice:/bin/bash
+bob:x:1001:1001::/home/bob:/bin/bash
+"""
+GROUP = """root:x:0:
+sudo:x:27:alice
+alice:x:1000:
+bob:x:1001:
+dev:x:2000:bob
+"""
+SHADOW = """root:*:19000:0:99999:7:::
+alice:*:19000:0:99999:7:::
+bob:*:19000:0:99999:7:::
+"""
+GSHADOW = """root:*::
+sudo:*::alice
+alice:!::
+bob:!::
+dev:!::bob
+"""
+LOGIN_DEFS = """UID_MIN 1000
+UID_MAX 60000
+GID_MIN 1000
+GID_MAX 60000
+PASS_MAX_DAYS 90
+HOME_MODE 0750
+"""
+
+
+@pytest.fixture
+def root(tmp_path):
+    etc = tmp_path / "etc"
+    etc.mkdir()
+    for name, text in (
+        ("passwd", PASSWD),
+        ("group", GROUP),
+        ("shadow", SHADOW),
+        ("gshadow", GSHADOW),
+        ("login.defs", LOGIN_DEFS),
+    ):
+        (etc / name).write_text(text)
+    (etc / "skel").mkdir()
+    (etc / "skel" / ".profile").write_text("# profile\n")
+    return tmp_path
+
+
+def write_csv(root, text):
+    path = root / "users.csv"
+    path.write_text(text)
+    return str(path)
+
+
+def read(root, name):
+    return (root / "etc" / name).read_text().splitlines()
+
+
+def lock_files(root):
+    """The per-file <file>.lock files; .pwd.lock is only locked with lockf()"""
+    return sorted(
+        p.name for p in (root / "etc").glob("*.lock") if p.name != ".pwd.lock"
+    )
+
+
+def test_keys_are_only_installed_when_given(root):
+    result = bulk_create_linux(write_csv(root, "carol\n"), str(root))
+    assert not result["failed"]
+    assert not (root / "home" / "carol" / ".ssh").exists()
+
+    keys = root / "keys.pub"
+    keys.write_text("ssh-ed25519 AAAA test\n")
+    result = bulk_create_linux(
+        write_csv(root, "dave\n"), str(root), authorized_keys=str(keys)
+    )
+    assert not result["failed"]
+    installed = root / "home" / "dave" / ".ssh" / "authorized_keys"
+    assert installed.read_text() == "ssh-ed25519 AAAA test\n"
+
+
+def test_missing_key_file_fails_before_any_change(root):
+    with pytest.raises(FileNotFoundError):
+        bulk_create_linux(
+            write_csv(root, "carol\n"),
+            str(root),
+            authorized_keys=str(root / "missing.pub"),
+        )
+    assert read(root, "passwd") == PASSWD.splitlines()
+
+
+def test_new_accounts_are_rendered_into_every_file(root, monkeypatch):
+    monkeypatch.setattr(bulk_create_users.time, "time", lambda: 19500 * 86400)
+    result = bulk_create_linux(
+        write_csv(root, "carol,dev sudo,/bin/zsh\ndave\n"), str(root)
+    )
+
+    assert [u["name"] for u in result["created"]] == ["carol", "dave"]
+    assert not result["failed"]
+    assert read(root, "passwd")[3:] == [
+        "carol:x:1002:1002::/home/carol:/bin/zsh",
+        "dave:x:1003:1003::/home/dave:/bin/bash",
+    ]
+    assert read(root, "shadow")[3:] == [
+        "carol:!:19500::90::::",
+        "dave:!:19500::90::::",
+    ]
+    group = read(root, "group")
+    assert "sudo:x:27:alice,carol" in group
+    assert "dev:x:2000:bob,carol" in group
+    assert group[5:] == ["carol:x:1002:", "dave:x:1003:"]
+    assert "dev:!::bob,carol" in read(root, "gshadow")
+    # The old files are kept as <file>-, as shadow-utils does
+    assert (root / "etc" / "passwd-").read_text() == PASSWD
+    home = root / "home" / "carol"
+    assert (home / ".profile").read_text() == "# profile\n"
+    assert os.stat(home).st_mode & 0o777 == 0o750
+
+
+def test_duplicate_names_and_ids_are_refused(root):
+    with open(root / "etc" / "passwd", "a") as f:
+        f.write("svc:x:1002:1002::/srv:/usr/sbin/nologin\n")
+    result = bulk_create_linux(
+        write_csv(root, "alice\ndev\ncarol,nosuchgroup\nerin\nerin\nbad:name\n"),
+        str(root),
+    )
+
+    assert [u["name"] for u in result["created"]] == ["erin"]
+    reasons = dict(result["failed"])
+    assert reasons["alice"] == "line 1: user 'alice' already exists"
+    assert reasons["dev"] == "line 2: group 'dev' already exists"
+    assert reasons["carol"] == "line 3: unknown group(s): nosuchgroup"
+    assert reasons["erin"] == "line 5: user 'erin' already exists"
+    assert "invalid username" in reasons["bad:name"]
+    # 1002 is taken by svc, so erin gets the next free UID and GID
+    assert read(root, "passwd")[-1] == "erin:x:1003:1003::/home/erin:/bin/bash"
+
+
+def test_failed_commit_leaves_the_files_untouched(root, monkeypatch):
+    write_atomic = bulk_create_users.write_atomic
+
+    def failing_write(path, lines):
+        if path.endswith("gshadow"):
+            raise OSError("disk full")
+        return write_atomic(path, lines)
+
+    monkeypatch.setattr(bulk_create_users, "write_atomic", failing_write)
+    with pytest.raises(OSError, match="disk full"):
+        bulk_create_linux(write_csv(root, "carol\ndave\n"), str(root))
+
+    assert read(root, "passwd") == PASSWD.splitlines()
+    assert read(root, "group") == GROUP.splitlines()
+    assert read(root, "shadow") == SHADOW.splitlines()
+    left = [p.name for p in (root / "etc").iterdir()]
+    assert not [n for n in left if n.endswith(("+", "-"))]
+    assert lock_files(root) == []
+    assert not (root / "home").exists()
+
+
+def test_lock_files_are_held_during_commit_and_released(root, monkeypatch):
+    held = []
+    commit = bulk_create_users.AccountBatch.commit
+
+    def recording_commit(self):
+        held.extend(lock_files(root))
+        commit(self)
+
+    monkeypatch.setattr(bulk_create_users.AccountBatch, "commit", recording_commit)
+    bulk_create_linux(write_csv(root, "carol\n"), str(root))
+
+    assert held == ["group.lock", "gshadow.lock", "passwd.lock", "shadow.lock"]
+    assert lock_files(root) == []
+
+
+def test_lock_held_by_live_process_is_respected(root):
+    lock = root / "etc" / "shadow.lock"
+    lock.write_text(str(os.getppid()))
+
+    with pytest.raises(LockError, match="shadow.lock"):
+        bulk_create_linux(write_csv(root, "carol\n"), str(root))
+
+    assert lock.read_text() == str(os.getppid())
+    assert lock_files(root) == ["shadow.lock"]
+    assert read(root, "passwd") == PASSWD.splitlines()
+
+
+def test_stale_lock_is_taken_over(root):
+    lock = root / "etc" / "passwd.lock"
+    # PIDs never reach the kernel's limit, so this owner cannot be alive
+    lock.write_text("4194304")
+
+    result = bulk_create_linux(write_csv(root, "carol\n"), str(root))
+
+    assert [u["name"] for u in result["created"]] == ["carol"]
+    assert not lock.exists()
@@ -0,0 +1,109 @@
+import io
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+import chunk_store
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2024, 1, 1, 2, 0, 0)
+
+
+def chunk_sizes(data, use_numpy, monkeypatch):
+    if not use_numpy:
+        monkeypatch.setattr(chunk_store, "numpy", None)
+    sizes = [len(c) for c in chunk_store.iter_chunks(io.BytesIO(data))]
+    monkeypatch.undo()
+    return sizes
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        os.urandom(9 * 2**20),
+        bytes(2**20),
+        b"ab" * 2**19 + os.urandom(2**20),
+        os.urandom(chunk_store.MIN_CHUNK + 40),
+    ],
+)
+def test_vectorised_cuts_match_serial_hash(data, monkeypatch):
+    pytest.importorskip("numpy")
+    assert chunk_sizes(data, True, monkeypatch) == chunk_sizes(
+        data, False, monkeypatch
+    )
+
+
+def test_restore_missing_path_fails(tmp_path, monkeypatch, capsys):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.txt").write_text("a\n")
+    store = str(tmp_path / "store")
+    chunk_store.ChunkStore(store).backup(str(src), name="snap")
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "chunk_store.py",
+            "--store",
+            store,
+            "restore",
+            "snap",
+            str(tmp_path / "r"),
+            "--path",
+            "missing.txt",
+        ],
+    )
+    with pytest.raises(SystemExit) as exc:
+        chunk_store.main()
+    assert exc.value.code == 1
+    assert "[Error]" in capsys.readouterr().out
+
+
+def test_symlinks_are_kept_and_special_files_listed(tmp_path):
+    src = tmp_path / "src"
+    (src / "dir").mkdir(parents=True)
+    (src / "dir" / "a.txt").write_text("a\n")
+    (src / "file-link").symlink_to("dir/a.txt")
+    (src / "dir-link").symlink_to("dir")
+    (src / "dangling").symlink_to("/nonexistent")
+    os.mkfifo(src / "fifo")
+    store = chunk_store.ChunkStore(str(tmp_path / "store"))
+
+    stats = store.backup(str(src), name="snap")
+    assert stats["files"] == 1
+    assert stats["symlinks"] == 3
+    assert stats["skipped"] == ["fifo"]
+    # A later run with the same links still restores them
+    stats = store.backup(str(src), name="snap2")
+    assert stats["reused"] == 1
+
+    target = tmp_path / "r"
+    assert store.restore("snap2", str(target)) == 4
+    assert os.readlink(target / "file-link") == "dir/a.txt"
+    assert os.readlink(target / "dir-link") == "dir"
+    assert os.readlink(target / "dangling") == "/nonexistent"
+    assert (target / "file-link").read_text() == "a\n"
+    assert not os.path.lexists(target / "fifo")
+    assert store.gc() == (0, 0)
+
+
+def test_snapshots_in_the_same_second_get_distinct_names(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.txt").write_text("a\n")
+    store = chunk_store.ChunkStore(str(tmp_path / "store"))
+    monkeypatch.setattr(chunk_store, "datetime", FrozenDatetime)
+
+    names = [store.backup(str(src))["name"] for _ in range(11)]
+    assert names[0] == "2024-01-01_02-00-00"
+    assert names[1:] == [f"2024-01-01_02-00-00-{i}" for i in range(1, 11)]
+    assert store.snapshot_names() == names
+    assert store.load_snapshot(names[-1])["name"] == names[-1]
+    # An explicit name still replaces the snapshot of that name
+    store.backup(str(src), name=names[0])
+    assert store.snapshot_names() == names
@@ -0,0 +1,121 @@
+import threading
+
+import pytest
+
+import ec2_backup
+
+
+class ClientError(Exception):
+    """Shaped like botocore's ClientError"""
+
+    def __init__(self, code):
+        super().__init__(f"An error occurred ({code})")
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeClient:
+    def __init__(self, pages, throttle=0, fail=()):
+        self.pages = pages
+        self.throttle = throttle
+        self.fail = set(fail)
+        self.lock = threading.Lock()
+        self.describe_calls = []
+        self.snapshotted = []
+
+    def describe_volumes(self, **kwargs):
+        self.describe_calls.append(kwargs)
+        with self.lock:
+            if self.throttle:
+                self.throttle -= 1
+                raise ClientError("RequestLimitExceeded")
+        index = int(kwargs.get("NextToken", 0))
+        page = {"Volumes": [{"VolumeId": v} for v in self.pages[index]]}
+        if index + 1 < len(self.pages):
+            page["NextToken"] = str(index + 1)
+        return page
+
+    def create_snapshot(self, VolumeId, **kwargs):
+        if VolumeId in self.fail:
+            raise ClientError("IncorrectState")
+        with self.lock:
+            self.snapshotted.append(VolumeId)
+        return {"SnapshotId": f"snap-{VolumeId}"}
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(ec2_backup.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def by_volume(results):
+    return {r["volume_id"]: r for r in results}
+
+
+def test_volumes_are_listed_across_pages():
+    client = FakeClient([["vol-1", "vol-2"], ["vol-3"], ["vol-4"]])
+    results = ec2_backup.create_snapshots(["eu-west-1"], lambda region: client)
+
+    assert sorted(by_volume(results)) == ["vol-1", "vol-2", "vol-3", "vol-4"]
+    assert [c.get("NextToken") for c in client.describe_calls] == [None, "1", "2"]
+    assert all(c["Filters"] == ec2_backup.VOLUME_FILTERS for c in client.describe_calls)
+
+
+def test_throttling_is_retried_with_backoff(no_sleep):
+    client = FakeClient([["vol-1"]], throttle=3)
+    results = ec2_backup.create_snapshots(["eu-west-1"], lambda region: client)
+
+    assert by_volume(results)["vol-1"]["snapshot_id"] == "snap-vol-1"
+    assert len(client.describe_calls) == 4
+    # The region's delay doubles on each retry: 0.2, 0.4, 0.8 ...
+    assert len(no_sleep) == 4
+    assert 0.1 <= no_sleep[0] <= 0.2
+    assert 0.4 <= no_sleep[2] <= 0.8
+    # ... and halves after the listing succeeds, before the snapshot call
+    assert 0.2 <= no_sleep[3] <= 0.4
+
+
+def test_throttling_gives_up_after_max_attempts():
+    client = FakeClient([["vol-1"]], throttle=ec2_backup.MAX_ATTEMPTS)
+    results = ec2_backup.create_snapshots(["eu-west-1"], lambda region: client)
+
+    assert len(client.describe_calls) == ec2_backup.MAX_ATTEMPTS
+    assert results == [
+        {
+            "region": "eu-west-1",
+            "volume_id": None,
+            "snapshot_id": None,
+            "error": "An error occurred (RequestLimitExceeded)",
+        }
+    ]
+
+
+def test_each_volume_reports_its_own_result():
+    clients = {
+        "eu-west-1": FakeClient([["vol-1", "vol-2"]], fail=["vol-2"]),
+        "us-east-1": FakeClient([["vol-3"]]),
+    }
+    results = by_volume(ec2_backup.create_snapshots(list(clients), clients.get))
+
+    assert results["vol-1"]["snapshot_id"] == "snap-vol-1"
+    assert results["vol-1"]["error"] is None
+    assert results["vol-2"]["snapshot_id"] is None
+    assert results["vol-2"]["error"] == "An error occurred (IncorrectState)"
+    assert results["vol-3"]["region"] == "us-east-1"
+    assert results["vol-3"]["snapshot_id"] == "snap-vol-3"
+
+
+def test_backoff_halves_on_success():
+    backoff = ec2_backup.AdaptiveBackoff(base=0.2, maximum=1.0)
+    for _ in range(5):
+        backoff.throttled()
+    assert backoff.delay == 1.0
+    backoff.success()
+    assert backoff.delay == 0.5
+    backoff.success()
+    assert backoff.delay == 0.25
+    backoff.success()
+    # Below the base delay it drops straight to zero
+    backoff.success()
+    assert backoff.delay == 0.0
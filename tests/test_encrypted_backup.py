@@ -0,0 +1,78 @@
+import errno
+import os
+import threading
+
+import encrypted_backup
+from checksum import HashingWriter
+
+
+def fake_gpg(tmp_path, monkeypatch, script):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    gpg = bin_dir / "gpg"
+    gpg.write_text("#!/bin/sh\n" + script + "\n")
+    gpg.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+
+def make_source(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    # Incompressible and well past the pipe buffers
+    (src / "data.bin").write_bytes(os.urandom(8 * 2**20))
+    return str(src)
+
+
+def run_with_timeout(fn, timeout=30):
+    result = {}
+
+    def run():
+        try:
+            result["value"] = fn()
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "backup hung"
+    return result
+
+
+class FullDiskWriter(HashingWriter):
+    def write(self, data):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+
+def test_output_write_error_is_raised(tmp_path, monkeypatch):
+    fake_gpg(tmp_path, monkeypatch, "exec cat")
+    monkeypatch.setattr(encrypted_backup, "HashingWriter", FullDiskWriter)
+    output = str(tmp_path / "out.gpg")
+    result = run_with_timeout(
+        lambda: encrypted_backup.backup(make_source(tmp_path), output, "nobody")
+    )
+    assert isinstance(result.get("error"), OSError)
+    assert result["error"].errno == errno.ENOSPC
+    assert not os.path.exists(output)
+    assert not os.path.exists(output + ".sha256")
+
+
+def test_gpg_exiting_early_with_success_is_an_error(tmp_path, monkeypatch):
+    fake_gpg(tmp_path, monkeypatch, "head -c 1 >/dev/null; exit 0")
+    output = str(tmp_path / "out.gpg")
+    result = run_with_timeout(
+        lambda: encrypted_backup.backup(make_source(tmp_path), output, "nobody")
+    )
+    assert isinstance(result.get("error"), RuntimeError)
+    assert not os.path.exists(output)
+    assert not os.path.exists(output + ".sha256")
+
+
+def test_backup_writes_manifest(tmp_path, monkeypatch):
+    fake_gpg(tmp_path, monkeypatch, "exec cat")
+    output = str(tmp_path / "out.gpg")
+    result = run_with_timeout(
+        lambda: encrypted_backup.backup(make_source(tmp_path), output, "nobody")
+    )
+    assert "error" not in result, result
+    assert os.path.exists(output + ".sha256")
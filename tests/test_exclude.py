@@ -0,0 +1,114 @@
+import pytest
+
+from exclude import ExcludeMatcher, translate, walk
+
+# (patterns, relative path, is a directory, excluded)
+CASES = [
+    # A bare name matches at any depth, as a file or a directory
+    (["node_modules"], "node_modules", True, True),
+    (["node_modules"], "web/app/node_modules", True, True),
+    (["node_modules"], "node_modules_old", True, False),
+    (["core"], "src/core", False, True),
+    # Globs stay within one path component
+    (["*.log"], "app.log", False, True),
+    (["*.log"], "var/log/app.log", False, True),
+    (["*.log"], "app.log.1", False, False),
+    (["a*z"], "a/z", False, False),
+    (["file?.txt"], "file1.txt", False, True),
+    (["file?.txt"], "file10.txt", False, False),
+    (["file?.txt"], "file/.txt", False, False),
+    (["[abc].txt"], "b.txt", False, True),
+    (["[!abc].txt"], "b.txt", False, False),
+    (["[!abc].txt"], "d.txt", False, True),
+    (["[a-c]x"], "bx", False, True),
+    (["[unclosed"], "[unclosed", False, True),
+    # Regex metacharacters are literal
+    (["a+b.c"], "a+b.c", False, True),
+    (["a+b.c"], "aab.c", False, False),
+    (["a+b.c"], "a+bxc", False, False),
+    # A trailing slash matches directories only
+    (["build/"], "build", True, True),
+    (["build/"], "build", False, False),
+    (["build/"], "src/build", True, True),
+    # A slash inside, or a leading one, anchors to the root
+    (["docs/tmp"], "docs/tmp", True, True),
+    (["docs/tmp"], "src/docs/tmp", True, False),
+    (["/todo.txt"], "todo.txt", False, True),
+    (["/todo.txt"], "src/todo.txt", False, False),
+    (["docs/*.md"], "docs/a.md", False, True),
+    (["docs/*.md"], "docs/sub/a.md", False, False),
+    # ** matches any number of directories, including none
+    (["**/cache"], "cache", True, True),
+    (["**/cache"], "a/b/cache", True, True),
+    (["a/**/b"], "a/b", True, True),
+    (["a/**/b"], "a/x/y/b", True, True),
+    (["a/**/b"], "x/a/b", True, False),
+    (["logs/**"], "logs/x/y.txt", False, True),
+    (["logs/**"], "logs", True, False),
+    # Later ! patterns re-include; the last matching rule wins
+    (["*.log", "!keep.log"], "keep.log", False, False),
+    (["*.log", "!keep.log"], "sub/keep.log", False, False),
+    (["*.log", "!keep.log"], "drop.log", False, True),
+    (["!keep.log", "*.log"], "keep.log", False, True),
+    (["tmp/", "!tmp"], "tmp", True, False),
+    (["tmp", "!tmp/"], "tmp", False, True),
+    # Blank lines and comments are ignored
+    (["", "# *.log", "  "], "a.log", False, False),
+]
+
+
+@pytest.mark.parametrize("patterns, path, is_dir, excluded", CASES)
+def test_match(patterns, path, is_dir, excluded):
+    assert ExcludeMatcher(patterns).match(path, is_dir) is excluded
+
+
+@pytest.mark.parametrize(
+    "patterns, path, is_dir, excluded",
+    [case for case in CASES if not any(p.startswith("!") for p in case[0])],
+)
+def test_combined_regex_agrees_with_rule_order(patterns, path, is_dir, excluded):
+    matcher = ExcludeMatcher(patterns)
+    assert not matcher.ordered
+    matcher.ordered = True
+    assert matcher.match(path, is_dir) is excluded
+
+
+@pytest.mark.parametrize(
+    "pattern, regex",
+    [
+        ("*.log", r"(?:.*/)?[^/]*\.log"),
+        ("/a?", r"a[^/]"),
+        ("**/x", r"(?:.*/)?x"),
+        ("a/**", r"a/.*"),
+        ("[!a]", r"(?:.*/)?[^a]"),
+    ],
+)
+def test_translate(pattern, regex):
+    assert translate(pattern) == regex
+
+
+def test_walk_prunes_excluded_directories(tmp_path):
+    for rel in [
+        "keep/a.txt",
+        "keep/a.log",
+        "keep/node_modules/pkg/index.js",
+        "build/out.o",
+        "src/build.txt",
+        "important.log",
+    ]:
+        path = tmp_path / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("x")
+    matcher = ExcludeMatcher(["node_modules", "*.log", "build/", "!important.log"])
+
+    seen = []
+    for _, rel_root, dirs, files in walk(str(tmp_path), matcher):
+        seen.extend(rel_root + d.name + "/" for d in dirs)
+        seen.extend(rel_root + f.name for f in files)
+    assert sorted(seen) == [
+        "important.log",
+        "keep/",
+        "keep/a.txt",
+        "src/",
+        "src/build.txt",
+    ]
@@ -0,0 +1,70 @@
+import mmap
+
+import metrics_log
+from metrics_log import MetricsLogWriter, log_files, read_log
+
+
+def sample(t):
+    """cpu and a disk counter that resets at 10; memory from 15, missing at 20"""
+    read_bytes = 1000 * t if t < 10 else 5 + 100 * (t - 10)
+    metrics = {"cpu": {"total": t / 2}, "disk": {"read_bytes": read_bytes}}
+    if t >= 15 and t != 20:
+        metrics["memory"] = {"percent": 50.5}
+    return metrics
+
+
+def flat(metrics):
+    return {
+        f"{group}.{name}": value
+        for group, values in metrics.items()
+        for name, value in values.items()
+    }
+
+
+def write_log(path, times, **options):
+    writer = MetricsLogWriter(str(path), **options)
+    for t in times:
+        writer.write(float(t), sample(t))
+    writer.close()
+
+
+def count_segments(path):
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return len(list(metrics_log.segments(data)))
+
+
+def test_round_trip_across_segments_and_rotated_files(tmp_path):
+    path = tmp_path / "metrics.bin"
+    write_log(path, range(30), max_bytes=400, backup_count=10)
+
+    assert len(log_files(str(path))) > 1
+    expected = [(float(t), flat(sample(t))) for t in range(30)]
+    assert list(read_log(str(path))) == expected
+    assert list(read_log(str(path), since=7, until=23)) == expected[7:23]
+    assert list(read_log(str(path), since=30)) == []
+    assert metrics_log.log_metrics(str(path)) == [
+        "cpu.total",
+        "disk.read_bytes",
+        "memory.percent",
+    ]
+
+
+def test_counter_reset_and_new_gauge_start_segments(tmp_path):
+    path = tmp_path / "metrics.bin"
+    write_log(path, range(20))
+
+    # The reset at 10 and memory.percent at 15; the gap at 20 is not written
+    assert count_segments(path) == 3
+    records = read_log(str(path), since=8, until=13)
+    assert [v["disk.read_bytes"] for _, v in records] == [8000, 9000, 5, 105, 205]
+
+
+def test_segments_are_cut_every_segment_records(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics_log, "SEGMENT_RECORDS", 4)
+    path = tmp_path / "metrics.bin"
+    write_log(path, range(10))
+
+    assert count_segments(path) == 3
+    expected = [(float(t), flat(sample(t))) for t in range(10)]
+    assert list(read_log(str(path), since=6)) == expected[6:]
@@ -0,0 +1,189 @@
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+import pytest
+
+import mysql_backup
+from checksum import SUMS_NAME, read_manifest
+
+# Stand-ins for the mysql and mysqldump clients. They log what they do to
+# $STUB_STATE/log; the lock file exists while the global read lock is held.
+STUB_MYSQL = r"""
+import os, re, sys
+state = os.environ["STUB_STATE"]
+lock_file = os.path.join(state, "locked")
+def log(msg):
+    with open(os.path.join(state, "log"), "a") as f:
+        f.write(msg + "\n")
+args = sys.argv[1:]
+if "-e" in args:
+    sql = args[args.index("-e") + 1]
+    if sql == "SHOW FULL TABLES":
+        print("customers\tBASE TABLE\nitems\tBASE TABLE\norders\tBASE TABLE\n"
+              "views\tBASE TABLE\n../Odd Name\tBASE TABLE\nsummary\tVIEW")
+    elif "information_schema.TABLES" in sql:
+        print("customers\t200\nitems\t100\norders\t300\nviews\t50\n"
+              "../Odd Name\t10\nsummary\t0")
+    elif sql == "SHOW BINARY LOG STATUS":
+        sys.exit(1)
+    elif sql == "SHOW MASTER STATUS":
+        print("binlog.000042\t1234\t\t\tuuid:1-5")
+    elif "CONNECTION_ID()" in sql:
+        print(os.environ.get("STUB_CONNECT_ATTRS", "1") + "\n0")
+    elif "INNODB_TRX" in sql:
+        print(len(re.findall(r"'\d+'", sql)))
+elif "--unbuffered" in args:
+    for line in sys.stdin:
+        if line.startswith("FLUSH TABLES WITH READ LOCK"):
+            open(lock_file, "w").close()
+            log("lock")
+        elif line.startswith("SELECT 'locked'"):
+            print("locked", flush=True)
+    os.remove(lock_file)
+    log("unlock")
+else:
+    sql = sys.stdin.read()
+    pattern = r"^-- (?:Table|Final view) structure for \w+ `([^`]+)`"
+    names = re.findall(pattern, sql, re.M)
+    log("restore " + ",".join(names))
+"""
+
+STUB_MYSQLDUMP = r"""
+import os, sys
+state = os.environ["STUB_STATE"]
+args = sys.argv[1:]
+tables = args[args.index("mydb") + 1:]
+locked = os.path.exists(os.path.join(state, "locked"))
+with open(os.path.join(state, "log"), "a") as f:
+    f.write(f"dump {','.join(tables)} locked={locked}\n")
+out = sys.stdout
+out.write("-- MySQL dump\n/*!40014 SET FOREIGN_KEY_CHECKS=0 */;\n\n")
+out.write("SET @@GLOBAL.GTID_PURGED=/*!80000 '+'*/ 'uuid1:1-5,\nuuid2:1-3';\n\n")
+for table in tables:
+    if "--no-data" in args:
+        out.write(f"--\n-- Final view structure for view `{table}`\n--\n\n")
+        out.write(f"CREATE VIEW `{table}` AS SELECT 1;\n")
+        continue
+    out.write(f"--\n-- Table structure for table `{table}`\n--\n\n")
+    out.write(f"CREATE TABLE `{table}` (id int);\n\n")
+    out.write(f"--\n-- Dumping data for table `{table}`\n--\n\n")
+    out.write(f"INSERT INTO `{table}` VALUES (1),(2);\n\n")
+out.write("-- Dump completed\n")
+"""
+
+
+def write_stub(path, source):
+    path.write_text(f"#!{sys.executable}\n{source}")
+    path.chmod(0o755)
+    return str(path)
+
+
+@pytest.fixture
+def stubs(tmp_path, monkeypatch):
+    state = tmp_path / "state"
+    state.mkdir()
+    monkeypatch.setenv("STUB_STATE", str(state))
+    monkeypatch.setattr(
+        mysql_backup, "MYSQL", write_stub(tmp_path / "mysql", STUB_MYSQL)
+    )
+    monkeypatch.setattr(
+        mysql_backup, "MYSQLDUMP", write_stub(tmp_path / "mysqldump", STUB_MYSQLDUMP)
+    )
+    monkeypatch.setattr(mysql_backup, "DB_NAME", "mydb")
+    monkeypatch.setattr(mysql_backup, "BACKUP_DIR", str(tmp_path / "backups"))
+    os.makedirs(mysql_backup.BACKUP_DIR)
+    return state
+
+
+def read_log(state):
+    return (state / "log").read_text().splitlines()
+
+
+def test_parallel_backup_is_one_snapshot(stubs):
+    set_dir = mysql_backup.backup_mysql_parallel(2)
+    assert set_dir is not None
+
+    log = read_log(stubs)
+    dumps = [line for line in log if line.startswith("dump") and "summary" not in line]
+    assert len(dumps) == 2
+    assert all(line.endswith("locked=True") for line in dumps)
+    assert sum(line.count(",") + 1 for line in dumps) == 5
+    assert log.index("unlock") > max(log.index(line) for line in dumps)
+
+    with open(os.path.join(set_dir, mysql_backup.MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    assert manifest["binlog"] == {
+        "file": "binlog.000042",
+        "position": 1234,
+        "gtid_executed": "uuid:1-5",
+    }
+
+    files = {t["name"]: t["file"] for t in manifest["tables"]}
+    for table in ("customers", "items", "orders", "views", "../Odd Name"):
+        with gzip.open(os.path.join(set_dir, files[table]), "rt") as f:
+            sql = f.read()
+        assert sql.startswith("-- MySQL dump\n/*!40014 SET FOREIGN_KEY_CHECKS=0 */;")
+        assert sql.count("Table structure for table") == 1
+        assert f"INSERT INTO `{table}`" in sql
+
+    sums = read_manifest(os.path.join(set_dir, SUMS_NAME))
+    assert set(sums) == {
+        "tables/customers.sql.gz",
+        "tables/items.sql.gz",
+        "tables/orders.sql.gz",
+        "tables/views.sql.gz",
+        "tables/%2E%2E%2F%4Fdd%20%4Eame.sql.gz",
+        mysql_backup.VIEWS_FILE,
+        mysql_backup.MANIFEST_NAME,
+    }
+    for name, digest in sums.items():
+        with open(os.path.join(set_dir, name), "rb") as f:
+            assert hashlib.sha256(f.read()).hexdigest() == digest
+        if name.endswith(".gz"):
+            # Replaying GTID_PURGED once per file fails after the first
+            with gzip.open(os.path.join(set_dir, name), "rt") as f:
+                sql = f.read()
+            assert "GTID_PURGED" not in sql and "uuid2" not in sql
+
+
+def test_restore_loads_views_last(stubs):
+    set_dir = mysql_backup.backup_mysql_parallel(2)
+    (stubs / "log").unlink()
+    assert mysql_backup.restore_mysql(set_dir, 3)
+    log = read_log(stubs)
+    assert sorted(log[:5]) == [
+        "restore ../Odd Name",
+        "restore customers",
+        "restore items",
+        "restore orders",
+        "restore views",
+    ]
+    assert log[5:] == ["restore summary"]
+
+
+def test_failed_dump_removes_the_set(stubs, monkeypatch):
+    monkeypatch.setattr(mysql_backup, "MYSQLDUMP", "false")
+    assert mysql_backup.backup_mysql_parallel(2) is None
+    assert os.listdir(mysql_backup.BACKUP_DIR) == []
+    assert "unlock" in read_log(stubs)
+
+
+def test_without_performance_schema_fails_before_locking(
+    stubs, monkeypatch, capsys
+):
+    monkeypatch.setenv("STUB_CONNECT_ATTRS", "0")
+    assert mysql_backup.backup_mysql_parallel(2) is None
+    assert "performance_schema" in capsys.readouterr().out
+    # Neither the lock nor any dump was started
+    assert not (stubs / "log").exists()
+
+
+def test_failed_backup_exits_nonzero(stubs, monkeypatch):
+    monkeypatch.setattr(mysql_backup, "MYSQLDUMP", "false")
+    monkeypatch.setattr(sys, "argv", ["mysql_backup.py", "--parallel", "2"])
+    with pytest.raises(SystemExit) as exc:
+        mysql_backup.main()
+    assert exc.value.code == 1
@@ -0,0 +1,159 @@
+import asyncio
+import errno
+import socket
+import sys
+
+import pytest
+
+import port_scanner
+from port_scanner import HostRanges, ProbeResult, ResultStore, prioritized
+
+
+def hosts(*targets):
+    ranges = HostRanges()
+    for target in targets:
+        ranges.add(target)
+    return ranges
+
+
+def probe(host, port, state):
+    return ProbeResult(host, port, state, 0.001)
+
+
+@pytest.fixture
+def store():
+    store = ResultStore(":memory:")
+    yield store
+    store.close()
+
+
+def seed(store, rows):
+    """Insert (host, port, open, changed) rows as earlier scans would have"""
+    with store.db:
+        store.db.executemany(
+            "INSERT INTO ports VALUES (?, ?, ?, 0, ?)",
+            (
+                (int(port_scanner.ipaddress.IPv4Address(h)), p, o, c)
+                for h, p, o, c in rows
+            ),
+        )
+
+
+def test_socket_creation_failure_is_reported_as_error(monkeypatch):
+    real_socket = socket.socket
+    calls = []
+
+    def flaky_socket(*args, **kwargs):
+        calls.append(args)
+        if len(calls) % 2:
+            raise OSError(errno.EMFILE, "Too many open files")
+        return real_socket(*args, **kwargs)
+
+    async def run():
+        # Patched only once the loop is running, which uses sockets itself
+        monkeypatch.setattr(port_scanner.socket, "socket", flaky_socket)
+        try:
+            return await port_scanner.scan_async(
+                ["127.0.0.1"], list(range(1, 11)), 1.0, 4
+            )
+        finally:
+            monkeypatch.undo()
+
+    results = asyncio.run(run())
+    assert [r.port for r in results] == list(range(1, 11))
+    assert [r.state for r in results if r.port % 2] == ["error"] * 5
+    assert "error" not in [r.state for r in results if not r.port % 2]
+
+
+def test_load_reads_only_rows_of_the_scanned_targets(store):
+    seed(
+        store,
+        [
+            ("10.0.0.1", 22, 1, 100),
+            ("10.0.0.2", 80, 0, 200),
+            ("10.0.0.2", 8080, 1, 300),  # port not scanned
+            ("10.0.1.1", 22, 1, 400),  # host not scanned
+            ("10.0.0.9", 443, 1, 500),
+        ],
+    )
+    store.load(hosts("10.0.0.0/30", "10.0.0.9"), [22, 80, 443])
+
+    assert store.known == {
+        ("10.0.0.1", 22): (True, 100),
+        ("10.0.0.2", 80): (False, 200),
+        ("10.0.0.9", 443): (True, 500),
+    }
+
+
+def test_observe_and_commit_report_changes(store, monkeypatch):
+    seed(store, [("10.0.0.1", 22, 1, 100), ("10.0.0.1", 80, 0, 100)])
+    store.load(hosts("10.0.0.1"), [22, 80, 443])
+
+    assert store.observe(probe("10.0.0.1", 22, "filtered")) == "closed"
+    assert store.observe(probe("10.0.0.1", 80, "open")) == "opened"
+    assert store.observe(probe("10.0.0.1", 443, "closed")) is None
+    # An error says nothing about the port, so it is not a change
+    assert store.observe(probe("10.0.0.1", 25, "error")) is None
+    monkeypatch.setattr(port_scanner.time, "time", lambda: 1000)
+    opened, closed = store.commit(990, 10.0)
+
+    assert (opened, closed) == ([("10.0.0.1", 80)], [("10.0.0.1", 22)])
+    assert store.db.execute("SELECT * FROM ports ORDER BY port").fetchall() == [
+        (167772161, 22, 0, 0, 1000),
+        (167772161, 80, 1, 1000, 1000),
+    ]
+    assert store.db.execute("SELECT * FROM scans").fetchall() == [
+        (1, 990, 10.0, 4, 1, 1, 1)
+    ]
+    assert store.last_scan() == 990
+
+
+def test_budgeted_rescan_probes_known_ports_then_resumes_the_sweep(store):
+    seed(
+        store,
+        [
+            ("10.0.0.2", 80, 0, 300),
+            ("10.0.0.1", 22, 1, 100),
+            ("10.0.0.2", 22, 1, 200),
+        ],
+    )
+    targets = list(hosts("10.0.0.1", "10.0.0.2"))
+    store.load(hosts("10.0.0.1", "10.0.0.2"), [22, 80, 443])
+    order, position = prioritized(store, targets, [22, 80, 443], start=3)
+
+    # Open ports first, most recently changed first, then the closed ones
+    first = [next(order) for _ in range(3)]
+    assert first == [("10.0.0.2", 22), ("10.0.0.1", 22), ("10.0.0.2", 80)]
+    assert position() == 3
+    # The sweep carries on at position 3, (10.0.0.2, 80), skipping what
+    # was just probed, and wraps around to where it began
+    assert next(order) == ("10.0.0.1", 443)
+    assert position() == 5
+    assert list(order) == [("10.0.0.2", 443), ("10.0.0.1", 80)]
+    assert position() == 3
+
+
+def test_diff_reports_opened_and_closed_ports(tmp_path, monkeypatch, capsys):
+    db = tmp_path / "scans.db"
+    listener = socket.create_server(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    argv = ["port_scanner.py", "127.0.0.1", "-p", str(port), "--db", str(db)]
+
+    def run():
+        monkeypatch.setattr(sys, "argv", argv + ["--diff"])
+        port_scanner.main()
+        return capsys.readouterr().out
+
+    try:
+        assert "No earlier scan to compare with" in run()
+        out = run()
+        assert "[i] No changes" in out
+    finally:
+        listener.close()
+    out = run()
+    assert f"[-] 127.0.0.1:{port}/tcp closed" in out
+    listener = socket.create_server(("127.0.0.1", port))
+    try:
+        assert f"[+] 127.0.0.1:{port}/tcp opened" in run()
+    finally:
+        listener.close()
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import reset_password
+
+
+def test_results_follow_input_order(tmp_path, monkeypatch):
+    # "sudo chpasswd" that accepts every line
+    for name, body in (
+        ("sudo", "import os, sys\nos.execvp(sys.argv[1], sys.argv[1:])\n"),
+        ("chpasswd", "import sys\nsys.stdin.read()\n"),
+    ):
+        stub = tmp_path / name
+        stub.write_text(f"#!{sys.executable}\n{body}")
+        stub.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(reset_password.platform, "system", lambda: "Linux")
+
+    lines = ["alice:pw1", "broken", "bob:pw2", ":nouser", "carol:pw3"]
+    results = reset_password.reset_passwords(lines)
+    assert [(name, ok) for name, ok, _ in results] == [
+        ("alice", True),
+        ("broken", False),
+        ("bob", True),
+        (":nouser", False),
+        ("carol", True),
+    ]
@@ -0,0 +1,54 @@
+import sys
+from datetime import datetime
+
+import pytest
+
+import rsync_backup
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2024, 1, 1, 2, 0, 0)
+
+
+def test_snapshots_in_the_same_second_get_distinct_names(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    dest = tmp_path / "dest"
+    src.mkdir()
+    dest.mkdir()
+    (src / "a.txt").write_text("a\n")
+    monkeypatch.setattr(rsync_backup, "datetime", FrozenDatetime)
+
+    names = [
+        rsync_backup.snapshot(str(src), str(dest))["snapshot"] for _ in range(11)
+    ]
+    assert names[0] == "2024-01-01_02-00-00"
+    assert names[1:] == [f"2024-01-01_02-00-00-{i}" for i in range(1, 11)]
+    assert rsync_backup.list_snapshots(str(dest)) == names
+    assert (dest / "latest").resolve().name == names[-1]
+    assert (dest / names[-1] / "a.txt").read_text() == "a\n"
+
+
+def test_verify_counts_each_byte_once(tmp_path):
+    src = tmp_path / "src"
+    dst = tmp_path / "dst"
+    src.mkdir()
+    dst.mkdir()
+    (src / "same.txt").write_text("x" * 100)
+    (src / "changed.txt").write_text("y" * 200)
+    rsync_backup.sync(str(src), str(dst))
+    (src / "changed.txt").write_text("z" * 300)
+
+    stats = rsync_backup.sync(str(src), str(dst), verify=True)
+    assert stats["copied"] == 1
+    # Each source file and each existing copy is counted once
+    assert stats["bytes_read"] == 100 + 100 + 300 + 200
+
+
+def test_keep_below_one_is_rejected(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["rsync_backup.py", "--snapshot", "--keep", "0"])
+    with pytest.raises(SystemExit) as exc:
+        rsync_backup.parse_args()
+    assert exc.value.code == 2
+    assert "--keep must be at least 1" in capsys.readouterr().err
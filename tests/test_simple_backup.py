@@ -0,0 +1,53 @@
+import os
+import socket
+
+import indexed_archive
+import simple_backup
+
+
+def make_socket(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    return sock
+
+
+def test_indexed_backup_skips_sockets(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    dest = tmp_path / "dest"
+    src.mkdir()
+    dest.mkdir()
+    (src / "b.txt").write_text("bee\n")
+    (src / "c.txt").write_text("sea\n")
+    sock = make_socket(str(src / "a.sock"))
+    monkeypatch.setattr(simple_backup, "SRC_DIR", str(src))
+    monkeypatch.setattr(simple_backup, "DEST_DIR", str(dest))
+    try:
+        archive = simple_backup.backup(index=True)
+    finally:
+        sock.close()
+
+    index = indexed_archive.load_index(archive)
+    members = {name: m[0] for name, m in index["members"].items()}
+    assert sorted(members) == ["b.txt", "c.txt"]
+    assert len(set(members.values())) == 2
+
+    target = tmp_path / "restore"
+    for name in ("b.txt", "c.txt"):
+        assert indexed_archive.restore(archive, name, str(target)) == [name]
+    assert (target / "b.txt").read_text() == "bee\n"
+    assert (target / "c.txt").read_text() == "sea\n"
+
+
+def test_backup_of_socket_only_tree(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    dest = tmp_path / "dest"
+    src.mkdir()
+    dest.mkdir()
+    sock = make_socket(str(src / "a.sock"))
+    monkeypatch.setattr(simple_backup, "SRC_DIR", str(src))
+    monkeypatch.setattr(simple_backup, "DEST_DIR", str(dest))
+    try:
+        archive = simple_backup.backup(index=True)
+    finally:
+        sock.close()
+    assert indexed_archive.list_members(archive) == []
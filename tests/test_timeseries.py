@@ -0,0 +1,109 @@
+import math
+
+import pytest
+
+from timeseries import HOUR, MINUTE, Tier, TimeSeriesStore
+
+
+def test_tier_wraps_around_in_logical_order():
+    tier = Tier("raw", 4, None)
+    for t in range(6):
+        tier.times[tier.next_slot()] = t
+
+    assert (tier.size, tier.first) == (4, 2)
+    assert [tier.time_at(i) for i in range(4)] == [2, 3, 4, 5]
+    # The copy crosses the physical end of the array
+    assert list(tier.slice(tier.times, 0, 4)) == [2, 3, 4, 5]
+    assert tier.bounds(3, 5) == (1, 3)
+    assert tier.bounds(None, 3) == (0, 1)
+    assert tier.bounds(9, None) == (4, 4)
+
+
+def test_raw_series_keeps_only_the_newest_samples():
+    store = TimeSeriesStore(interval=MINUTE, raw_days=1, minute_days=1, hour_days=1)
+    for k in range(1500):
+        store.append(k * MINUTE, {"v": k})
+
+    times, values = store.series("v")
+    assert len(values) == 1440
+    assert list(values[:2]) == [60, 61]
+    assert times[-1] == 1499 * MINUTE
+    times, values = store.series("v", start=1498 * MINUTE)
+    assert list(values) == [1498, 1499]
+
+
+def test_metric_first_seen_mid_bucket_counts_only_its_samples():
+    store = TimeSeriesStore(interval=1, raw_days=1 / 24)
+    for t in range(2 * HOUR):
+        sample = {"a": 1}
+        if t >= 30:
+            sample["b"] = 4 if t < MINUTE else 2
+        store.append(t, sample)
+
+    # Raw only holds the second hour, so this is answered from the 1m tier
+    assert store.pick_tier(0).name == "1m"
+    # The bucket still open at the end is left out
+    assert store.aggregate("a", start=0)["count"] == 2 * HOUR - MINUTE
+    b = store.aggregate("b", start=0)
+    assert b["count"] == 2 * HOUR - MINUTE - 30
+    assert (b["min"], b["max"]) == (2, 4)
+    rest = 2 * HOUR - 2 * MINUTE
+    assert b["avg"] == pytest.approx((30 * 4 + rest * 2) / b["count"])
+    times, avgs = store.series("b", tier="1m")
+    assert (times[0], avgs[0], avgs[1]) == (0, 4, 2)
+
+
+def test_aggregate_moves_to_coarser_tiers_for_older_ranges():
+    store = TimeSeriesStore(interval=MINUTE, raw_days=1, minute_days=2, hour_days=30)
+    day = 1440
+    for k in range(4 * day):
+        store.append(k * MINUTE, {"v": k // day})
+
+    assert store.aggregate("v", start=3 * day * MINUTE) == {
+        "min": 3,
+        "max": 3,
+        "avg": 3,
+        "count": day,
+    }
+    # Older than raw holds: one closed bucket per minute
+    assert store.pick_tier(2.5 * day * MINUTE).name == "1m"
+    recent = store.aggregate("v", start=2.5 * day * MINUTE)
+    assert recent["count"] == 1.5 * day - 1
+    assert (recent["min"], recent["max"]) == (2, 3)
+    # Older than the minutes too: whole hours, the open one left out
+    assert store.pick_tier(0).name == "1h"
+    everything = store.aggregate("v", start=0)
+    assert everything["count"] == 4 * day - 60
+    assert (everything["min"], everything["max"]) == (0, 3)
+    assert everything["avg"] == pytest.approx(
+        (day * 1 + day * 2 + (day - 60) * 3) / (4 * day - 60)
+    )
+
+
+def test_hour_buckets_count_past_65535_samples():
+    store = TimeSeriesStore(
+        interval=0.01, raw_days=1 / 1440, minute_days=1, hour_days=1
+    )
+    n = 70000
+    for k in range(n):
+        store.append(k * 0.05, {"v": 1})
+    store.append(HOUR, {"v": 1})
+
+    assert list(store.tier("1h").counts) == [n] + [0] * 23
+
+
+def test_register_refuses_metrics_past_max_bytes():
+    store = TimeSeriesStore(interval=MINUTE, raw_days=1, minute_days=1, hour_days=1)
+    store.max_bytes = store.memory_bytes() + 2 * store.metric_bytes()
+    store.append(0, {"a": 1})
+    store.append(MINUTE, {"a": 1, "b": 2})
+    store.append(2 * MINUTE, {"a": 1, "b": 2, "c": 3})
+    store.append(3 * MINUTE, {"a": 1, "b": 2, "c": 3})
+
+    assert sorted(store.metrics()) == ["a", "b"]
+    assert store.dropped == {"c"}
+    assert store.memory_bytes() <= store.max_bytes
+    with pytest.raises(KeyError):
+        store.series("c")
+    assert list(store.series("b")[1]) == [2, 2, 2]
+    assert math.isnan(store.tier("raw").columns["b"]["value"][0])
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from top_processes import parse_io, parse_stat
+
+TAIL = (
+    b"0 -1 4194304 83 0 0 0 {utime} {stime} 7 3 20 0 1 0 {start} 2703360 {rss} "
+    b"18446744073709551615 94302039973888 94302039993769 140731483201696 0 0 0 0 "
+    b"0 0 0 0 0 17 0 0 0 0 0 0 94302040009776 94302040011392 94302363234304 "
+    b"140731483206876 140731483206896 140731483206896 140731483209707 0\n"
+)
+
+
+def stat_line(name, state=b"S", utime=150, stime=25, start=215392, rss=285):
+    tail = TAIL.replace(b"{utime}", b"%d" % utime).replace(b"{stime}", b"%d" % stime)
+    tail = tail.replace(b"{start}", b"%d" % start).replace(b"{rss}", b"%d" % rss)
+    return b"19977 (" + name + b") " + state + b" 19973 19977 19973 " + tail
+
+
+@pytest.mark.parametrize(
+    "name",
+    [
+        b"cat",
+        b"Web Content",
+        b"a) R 1 2 (b",
+        b"((sd-pam))",
+        b")",
+        b"",
+        "näme".encode(),
+    ],
+)
+def test_parse_stat(name):
+    assert parse_stat(stat_line(name)) == (name, 215392, 175, 285)
+
+
+def test_parse_stat_fields_are_not_confused():
+    data = stat_line(b"x", state=b"Z", utime=1, stime=2, start=3, rss=4)
+    assert parse_stat(data) == (b"x", 3, 3, 4)
+
+
+def test_parse_io():
+    data = (
+        b"rchar: 3980\n"
+        b"wchar: 12\n"
+        b"syscr: 9\n"
+        b"syscw: 1\n"
+        b"read_bytes: 4096\n"
+        b"write_bytes: 8192\n"
+        b"cancelled_write_bytes: 0\n"
+    )
+    assert parse_io(data) == 12288
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self"), reason="needs /proc")
+def test_parse_live_proc():
+    with open("/proc/self/stat", "rb") as f:
+        name, start, ticks, rss = parse_stat(f.read())
+    with open("/proc/self/comm", "rb") as f:
+        assert name == f.read().rstrip(b"\n")
+    assert start > 0 and ticks >= 0 and rss > 0
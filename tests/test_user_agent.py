@@ -0,0 +1,79 @@
+import queue
+
+import pytest
+
+import user_agent
+from user_agent import Agent
+
+PASSWD = """root:x:0:0:root:/root:/bin/bash
+daemon:x:1:1:daemon:/usr/sbin:/usr/sbin/nologin
+admin:x:1000:1000::/home/admin:/bin/bash
+alice:x:1001:1001::/home/alice:/bin/bash
+"""
+GROUP = """root:x:0:
+daemon:x:1:
+disk:x:6:
+sudo:x:27:admin
+admin:x:1000:
+alice:x:1001:
+staff:x:2000:alice
+"""
+SHADOW = """root:*:19000:0:99999:7:::
+daemon:*:19000:0:99999:7:::
+admin:*:19000:0:99999:7:::
+alice:*:19000:0:99999:7:::
+"""
+
+
+@pytest.fixture
+def agent(tmp_path):
+    etc = tmp_path / "etc"
+    etc.mkdir()
+    (etc / "passwd").write_text(PASSWD)
+    (etc / "group").write_text(GROUP)
+    (etc / "shadow").write_text(SHADOW)
+    (etc / "gshadow").write_text("")
+    (etc / "login.defs").write_text("UID_MIN 1000\nUID_MAX 60000\nGID_MIN 1000\n")
+    return Agent(str(tmp_path))
+
+
+def call(agent, op, args, peer_uid):
+    replies = queue.Queue()
+    agent.dispatch({"id": 1, "op": op, "args": args}, replies.put, peer_uid)
+    return replies.get(timeout=10)
+
+
+@pytest.mark.parametrize(
+    "op,args",
+    [
+        ("reset_password", {"username": "root", "password": "x"}),
+        ("delete_user", {"username": "daemon"}),
+        ("lock_user", {"username": "admin"}),
+        ("create_user_linux", {"username": "eve", "groups": ["sudo"]}),
+        ("create_user_linux", {"username": "eve", "groups": ["disk"]}),
+    ],
+)
+def test_unprivileged_client_refused(agent, op, args):
+    reply = call(agent, op, args, peer_uid=1001)
+    assert not reply["ok"]
+    assert "only root" in reply["error"]
+
+
+def test_unprivileged_client_may_change_regular_account(agent):
+    reply = call(agent, "lock_user", {"username": "alice"}, peer_uid=1001)
+    assert reply["ok"], reply
+
+
+def test_root_client_may_change_system_account(agent):
+    reply = call(agent, "lock_user", {"username": "daemon"}, peer_uid=0)
+    assert reply["ok"], reply
+
+
+def test_home_job_exception_is_answered(agent, monkeypatch):
+    def broken_setup_home(*args):
+        raise ValueError("skel is broken")
+
+    monkeypatch.setattr(user_agent, "setup_home", broken_setup_home)
+    reply = call(agent, "create_user_linux", {"username": "bob"}, peer_uid=0)
+    assert not reply["ok"]
+    assert "skel is broken" in reply["error"]
@@ -0,0 +1,44 @@
+import socket
+import threading
+
+import pytest
+
+from user_client import AgentClient, AgentError
+
+
+def serve_once(path, reply):
+    """Answer the first request line on path with reply, then close"""
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+
+    def run():
+        conn, _ = server.accept()
+        with conn, conn.makefile("rb") as rfile:
+            rfile.readline()
+            conn.sendall(reply)
+        server.close()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def test_pipeline_reports_null_id_as_protocol_error(tmp_path):
+    path = str(tmp_path / "agent.sock")
+    serve_once(path, b'{"id": null, "ok": false, "error": "invalid JSON"}\n')
+    client = AgentClient(path)
+    try:
+        with pytest.raises(AgentError, match="protocol error.*invalid JSON"):
+            list(client.pipeline([("lock_user", {"username": "alice"})]))
+    finally:
+        client.close()
+
+
+def test_invalid_reply_is_protocol_error(tmp_path):
+    path = str(tmp_path / "agent.sock")
+    serve_once(path, b"not json\n")
+    client = AgentClient(path)
+    try:
+        with pytest.raises(AgentError, match="protocol error"):
+            client.call("list_users")
+    finally:
+        client.close()
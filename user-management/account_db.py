@@ -0,0 +1,212 @@
+"""
+Cached, indexed view of the local account files.
+
+/etc/passwd, /etc/group and /etc/shadow are parsed once into tuples with
+dictionaries indexing them by name, UID/GID and group membership. Every
+query first checks the files' stat (mtime, size, inode) and re-parses only
+a file that changed, so long-running scripts always see current data
+without paying for a parse per lookup. Shadow entries keep the aging
+fields and lock state but never the password hash.
+
+Example of usage:
+    from account_db import get_db
+
+    db = get_db()
+    db.user("alice").home
+    [u.name for u in db.users(min_uid=1000, group="sudo")]
+"""
+
+import os
+import threading
+from collections import namedtuple
+
+User = namedtuple("User", "name uid gid gecos home shell")
+Group = namedtuple("Group", "name gid members")
+Shadow = namedtuple("Shadow", "name locked lastchg min max warn inactive expire")
+
+
+def parse_passwd(f):
+    users = []
+    for line in f:
+        parts = line.rstrip("\n").split(":")
+        if len(parts) < 7 or not parts[2].isdigit() or not parts[3].isdigit():
+            continue  # comments, NIS "+" lines and malformed entries
+        users.append(
+            User(parts[0], int(parts[2]), int(parts[3]), parts[4], parts[5], parts[6])
+        )
+    return users
+
+
+def parse_group(f):
+    groups = []
+    for line in f:
+        parts = line.rstrip("\n").split(":")
+        if len(parts) < 4 or not parts[2].isdigit():
+            continue
+        members = tuple(m for m in parts[3].split(",") if m)
+        groups.append(Group(parts[0], int(parts[2]), members))
+    return groups
+
+
+def parse_shadow(f):
+    def number(value):
+        return int(value) if value.isdigit() else None
+
+    entries = []
+    for line in f:
+        parts = line.rstrip("\n").split(":")
+        if len(parts) < 8:
+            continue
+        entries.append(
+            Shadow(
+                parts[0],
+                parts[1].startswith(("!", "*")),
+                *(number(v) for v in parts[2:8]),
+            )
+        )
+    return entries
+
+
+class AccountDB:
+    def __init__(self, root="/"):
+        etc = os.path.join(root, "etc")
+        self.paths = {
+            name: os.path.join(etc, name) for name in ("passwd", "group", "shadow")
+        }
+        self.stamps = {}
+        self.lock = threading.Lock()
+        self._passwd = []
+        self._group = []
+        self._shadow = []
+
+    def _fresh(self, name, parser):
+        """Re-parse one file if its stat changed; returns True if it did"""
+        path = self.paths[name]
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if self.stamps.get(name) == stamp:
+            return False
+        with open(path) as f:
+            entries = parser(f)
+        setattr(self, "_" + name, entries)
+        self.stamps[name] = stamp
+        return True
+
+    def refresh(self, shadow=False):
+        """Bring the indexes up to date with the files on disk"""
+        with self.lock:
+            if self._fresh("passwd", parse_passwd):
+                self.by_name = {u.name: u for u in self._passwd}
+                # The first entry for a shared UID wins, as with getpwuid
+                self.by_uid = {}
+                for u in self._passwd:
+                    self.by_uid.setdefault(u.uid, u)
+                self.by_gid_primary = {}
+                for u in self._passwd:
+                    self.by_gid_primary.setdefault(u.gid, []).append(u.name)
+            if self._fresh("group", parse_group):
+                self.group_by_name = {g.name: g for g in self._group}
+                self.group_by_gid = {}
+                for g in self._group:
+                    self.group_by_gid.setdefault(g.gid, g)
+                self.supplementary = {}
+                for g in self._group:
+                    for member in g.members:
+                        self.supplementary.setdefault(member, []).append(g.name)
+            if shadow and self._fresh("shadow", parse_shadow):
+                self.shadow_by_name = {s.name: s for s in self._shadow}
+
+    def user(self, name):
+        self.refresh()
+        return self.by_name.get(name)
+
+    def user_by_uid(self, uid):
+        self.refresh()
+        return self.by_uid.get(uid)
+
+    def group(self, name):
+        self.refresh()
+        return self.group_by_name.get(name)
+
+    def group_by_id(self, gid):
+        self.refresh()
+        return self.group_by_gid.get(gid)
+
+    def shadow(self, name):
+        """Shadow entry for name; raises PermissionError unless run as root"""
+        self.refresh(shadow=True)
+        return self.shadow_by_name.get(name)
+
+    def groups_of(self, name):
+        """Names of the primary and supplementary groups of a user"""
+        self.refresh()
+        user = self.by_name.get(name)
+        names = []
+        if user is not None:
+            primary = self.group_by_gid.get(user.gid)
+            if primary is not None:
+                names.append(primary.name)
+        for group in self.supplementary.get(name, ()):
+            if group not in names:
+                names.append(group)
+        return names
+
+    def members(self, group):
+        """Users in a group, both by primary GID and by membership list"""
+        self.refresh()
+        g = self.group_by_name.get(group)
+        if g is None:
+            return []
+        names = list(self.by_gid_primary.get(g.gid, ()))
+        names.extend(m for m in g.members if m not in names)
+        return names
+
+    def users(self, min_uid=None, max_uid=None, shell=None, group=None, locked=None):
+        """Iterate over users matching every given filter, in file order.
+
+        locked filters on the shadow password state and needs root.
+        """
+        self.refresh(shadow=locked is not None)
+        allowed = set(self.members(group)) if group is not None else None
+        for u in self._passwd:
+            if min_uid is not None and u.uid < min_uid:
+                continue
+            if max_uid is not None and u.uid > max_uid:
+                continue
+            if shell is not None and u.shell != shell:
+                continue
+            if allowed is not None and u.name not in allowed:
+                continue
+            if locked is not None:
+                entry = self.shadow_by_name.get(u.name)
+                if entry is None or entry.locked != locked:
+                    continue
+            yield u
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_db(root="/"):
+    """Shared AccountDB for a root, so every caller reuses the same cache"""
+    with _databases_lock:
+        db = _databases.get(root)
+        if db is None:
+            db = _databases[root] = AccountDB(root)
+        return db
+
+
+def lookup(username):
+    """Return (uid, gid, home) for a user.
+
+    Falls back to the system resolver for accounts that are not in
+    /etc/passwd (macOS Directory Services, LDAP, ...).
+    """
+    user = get_db().user(username) if os.path.exists("/etc/passwd") else None
+    if user is not None:
+        return user.uid, user.gid, user.home
+    import pwd
+
+    entry = pwd.getpwnam(username)
+    return entry.pw_uid, entry.pw_gid, entry.pw_dir
@@ -0,0 +1,80 @@
+"""
+Shared helpers for running user-management commands over many accounts.
+
+Input is one username (or user:password pair) per line, from a file or
+from stdin when the path is "-". Blank lines and # comments are skipped.
+"""
+
+import sys
+import time
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 4
+
+
+def read_lines(path, passwords=False):
+    """Yield the stripped, non-empty lines of a file, or of stdin for "-".
+
+    With passwords, for user:password lines, only the newline is removed:
+    spaces around a password are part of it.
+    """
+    f = sys.stdin if path == "-" else open(path)
+    try:
+        for line in f:
+            line = line.rstrip("\n") if passwords else line.strip()
+            if line and not line.startswith("#"):
+                yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def run_command(argv):
+    """Run argv; returns (ok, detail) with the last line of its error output"""
+    try:
+        result = subprocess.run(argv, capture_output=True, text=True)
+    except OSError as e:
+        return False, str(e)
+    if result.returncode == 0:
+        return True, ""
+    lines = (result.stderr or result.stdout).strip().splitlines()
+    return False, lines[-1] if lines else f"exit status {result.returncode}"
+
+
+def run_batch(names, build_command, workers=MAX_WORKERS):
+    """Run build_command(name) for every name with at most workers at once.
+
+    Yields (name, ok, detail) in input order as results complete. Names are
+    consumed lazily, so only a bounded window of them is held in memory.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for name in names:
+            pending.append((name, executor.submit(run_command, build_command(name))))
+            if len(pending) >= workers * 4:
+                name, future = pending.popleft()
+                yield (name, *future.result())
+        for name, future in pending:
+            yield (name, *future.result())
+
+
+def report(results, action, start=None):
+    """Print one line per result and a timing summary; returns failures"""
+    start = start or time.monotonic()
+    ok = failed = 0
+    for name, success, detail in results:
+        if success:
+            ok += 1
+            print(f"[Success] {name}: {action}")
+        else:
+            failed += 1
+            print(f"[Error] {name}: {detail}")
+    elapsed = time.monotonic() - start
+    total = ok + failed
+    print(
+        f"[i] {ok} succeeded, {failed} failed in {elapsed:.2f}s "
+        f"({total / max(elapsed, 1e-9):.1f} users/s)"
+    )
+    return failed
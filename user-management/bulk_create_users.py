@@ -1,20 +1,646 @@
+"""
+Batch user provisioning.
+
+On Linux the account files are updated in one transaction instead of one
+`useradd` per CSV row: the password database lock is taken once, UIDs and
+GIDs are allocated in memory, and /etc/passwd, /etc/shadow, /etc/group
+(and /etc/gshadow when present) are each rewritten atomically with the new
+entries. Home directories, /etc/skel contents and, with --authorized-keys,
+.ssh/authorized_keys are then created by a pool of worker threads. Other
+platforms fall back to creating the users one by one.
+
+CSV columns: username[,groups[,shell]], where groups is a space separated
+list of existing supplementary groups. Blank lines and # comments are
+skipped.
+
+--root prefixes every path, so a run can be tried on a scratch copy:
+    mkdir -p /tmp/sysroot/etc
+    cp -a /etc/passwd /etc/shadow /etc/group /etc/skel /tmp/sysroot/etc/
+    python3 bulk_create_users.py bulk_users.csv --root /tmp/sysroot
+
+Example of usage:
+    sudo python3 bulk_create_users.py bulk_users.csv -w 16
+"""
+
+import os
+import re
 import csv
-from create_user import create_user_linux  # or import from the refactored module
+import sys
+import time
+import fcntl
+import shutil
+import argparse
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
+from account_db import get_db
+from create_user import (
+    detect_os,
+    create_user_linux,
+    create_user_macos,
+    create_user_windows,
+)
 
-def bulk_create(path):
+DEFAULT_SHELL = "/bin/bash"
+LOCK_TIMEOUT = 15.0
+MAX_WORKERS = 8
+NAME_RE = re.compile(r"[a-z_][a-z0-9_-]*\$?\Z")
+# Characters that would end a field or a line of /etc/passwd
+FIELD_BREAKS = re.compile(r"[:\n\r]")
+NAME_MAX = 32
+
+
+class LockError(Exception):
+    pass
+
+
+class PasswdLock:
+    """Hold the password database lock for the account files.
+
+    Takes the lckpwdf(3) lock on /etc/.pwd.lock and the per-file
+    <file>.lock files created by shadow-utils, so neither useradd nor
+    other tools can edit the files while the batch is written.
+    """
+
+    def __init__(self, etc, files, timeout=LOCK_TIMEOUT):
+        self.etc = etc
+        self.files = files
+        self.timeout = timeout
+        self.fd = None
+        self.locked = []
+
+    def __enter__(self):
+        self.fd = os.open(
+            os.path.join(self.etc, ".pwd.lock"),
+            os.O_WRONLY | os.O_CREAT | os.O_CLOEXEC,
+            0o600,
+        )
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.__exit__()
+                    raise LockError("password database is locked by another process")
+                time.sleep(0.1)
+        try:
+            for path in self.files:
+                self.lock_file(path)
+        except BaseException:
+            self.__exit__()
+            raise
+        return self
+
+    def lock_file(self, path):
+        lock_path = path + ".lock"
+        tmp_path = f"{path}.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            f.write(str(os.getpid()))
+        try:
+            for _ in range(2):
+                try:
+                    os.link(tmp_path, lock_path)
+                    self.locked.append(lock_path)
+                    return
+                except FileExistsError:
+                    if not self.remove_stale(lock_path):
+                        break
+            raise LockError(f"{lock_path} is held by another process")
+        finally:
+            os.remove(tmp_path)
+
+    @staticmethod
+    def remove_stale(lock_path):
+        """Remove a lock file whose owner is gone; True if it was removed"""
+        try:
+            with open(lock_path) as f:
+                pid = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return False
+        if pid <= 0:
+            return False
+        try:
+            os.kill(pid, 0)
+            return False
+        except ProcessLookupError:
+            os.remove(lock_path)
+            return True
+        except PermissionError:
+            return False
+
+    def __exit__(self, *exc):
+        for lock_path in reversed(self.locked):
+            os.remove(lock_path)
+        self.locked = []
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def read_login_defs(etc):
+    defs = {"UID_MIN": 1000, "UID_MAX": 60000, "GID_MIN": 1000, "GID_MAX": 60000}
+    # Password aging for new accounts; -1 (unset) leaves the field empty
+    defs.update(PASS_MIN_DAYS=-1, PASS_MAX_DAYS=-1, PASS_WARN_AGE=-1)
+    home_mode = umask = None
+    try:
+        with open(os.path.join(etc, "login.defs")) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 2 or parts[0].startswith("#"):
+                    continue
+                key, value = parts[0], parts[1]
+                if key in defs:
+                    defs[key] = int(value)
+                elif key == "HOME_MODE":
+                    home_mode = int(value, 8)
+                elif key == "UMASK":
+                    umask = int(value, 8)
+    except FileNotFoundError:
+        pass
+    # Same rule as useradd: HOME_MODE, else derived from UMASK
+    defs["HOME_MODE"] = (
+        home_mode
+        if home_mode is not None
+        else 0o777 & ~(umask if umask is not None else 0o022)
+    )
+    return defs
+
+
+def read_lines(path):
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+def check_field(label, value, path=False):
+    """Raise ValueError unless value is safe as one passwd field"""
+    if not isinstance(value, str) or FIELD_BREAKS.search(value):
+        raise ValueError(f"invalid {label} {value!r}")
+    if path and not value.startswith("/"):
+        raise ValueError(f"{label} '{value}' is not an absolute path")
+
+
+def free_ids(used, low, high):
+    """Yield ids not in used: above the highest one in range, then any gaps.
+
+    used is checked lazily, so ids the caller adds to it meanwhile are
+    skipped.
+    """
+    top = max((i for i in used if low <= i <= high), default=low - 1)
+    for i in itertools.chain(range(top + 1, high + 1), range(low, top)):
+        if i not in used:
+            yield i
+
+
+def read_rows(path):
+    """Stream (line number, username, groups, shell) from the CSV"""
     with open(path, newline="") as f:
         reader = csv.reader(f)
         for row in reader:
-            username = row[0]
-            print(f"Creating user: {username}")
-            create_user_linux(username)
+            if not row or not row[0].strip() or row[0].startswith("#"):
+                continue
+            username = row[0].strip()
+            groups = row[1].split() if len(row) > 1 else []
+            shell = row[2].strip() if len(row) > 2 and row[2].strip() else None
+            yield reader.line_num, username, groups, shell
+
+
+def write_atomic(path, lines):
+    """Write lines next to path as path+ with path's mode and owner.
+
+    Returns the temporary path; the caller renames it over path to commit.
+    """
+    st = os.stat(path)
+    tmp_path = path + "+"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, st.st_mode & 0o7777)
+    try:
+        if os.geteuid() == 0:
+            os.fchown(fd, st.st_uid, st.st_gid)
+        os.fchmod(fd, st.st_mode & 0o7777)
+        copy_selinux_context(path, fd)
+        with os.fdopen(fd, "w") as f:
+            fd = None
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        if fd is not None:
+            os.close(fd)
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def copy_selinux_context(path, fd):
+    """Give fd the SELinux label of path, which a rename would otherwise drop"""
+    try:
+        context = os.getxattr(path, "security.selinux")
+    except (AttributeError, OSError):
+        return  # no getxattr (not Linux), no SELinux or no label
+    os.setxattr(fd, "security.selinux", context)
+
+
+def invalidate_nscd():
+    """Drop the users and groups cached by nscd, as shadow-utils does"""
+    for table in ("passwd", "group"):
+        try:
+            subprocess.run(["nscd", "-i", table], capture_output=True)
+        except OSError:
+            return  # nscd is not installed
+
+
+class AccountBatch:
+    """Account changes queued in memory and committed to the files in one pass.
+
+    add() creates, remove() deletes and lock() locks an account; the
+    changes only reach the files on commit().
+    """
+
+    def __init__(self, root="/"):
+        self.root = root
+        self.etc = os.path.join(root, "etc")
+        self.defs = read_login_defs(self.etc)
+        self.files = {
+            name: os.path.join(self.etc, name)
+            for name in ("passwd", "shadow", "group", "gshadow")
+            if os.path.exists(os.path.join(self.etc, name))
+        }
+        self.users = []
+
+    def load(self):
+        """Read the current files; call with the lock held"""
+        self.lines = {name: read_lines(path) for name, path in self.files.items()}
+        self.user_names = set()
+        self.uids = set()
+        self.passwd_index = {}
+        for i, line in enumerate(self.lines["passwd"]):
+            parts = line.split(":")
+            if len(parts) >= 3 and parts[2].isdigit():
+                self.user_names.add(parts[0])
+                self.uids.add(int(parts[2]))
+                self.passwd_index[parts[0]] = i
+        self.group_index = {}
+        self.gids = set()
+        for i, line in enumerate(self.lines["group"]):
+            parts = line.split(":")
+            if len(parts) >= 3 and parts[2].isdigit():
+                self.group_index[parts[0]] = i
+                self.gids.add(int(parts[2]))
+        self.gshadow_index = {
+            line.split(":", 1)[0]: i
+            for i, line in enumerate(self.lines.get("gshadow", []))
+        }
+        self.free_uids = free_ids(self.uids, self.defs["UID_MIN"], self.defs["UID_MAX"])
+        self.free_gids = free_ids(self.gids, self.defs["GID_MIN"], self.defs["GID_MAX"])
+        self.new_groups = set()
+        self.members = {}
+        self.removed = {}
+        self.locked = set()
+
+    def add(self, username, groups=(), shell=None):
+        """Queue one account; raises ValueError if it cannot be created"""
+        if len(username) > NAME_MAX or not NAME_RE.match(username):
+            raise ValueError(f"invalid username '{username}'")
+        if username in self.user_names:
+            raise ValueError(f"user '{username}' already exists")
+        if username in self.group_index or username in self.new_groups:
+            raise ValueError(f"group '{username}' already exists")
+        missing = [g for g in groups if g not in self.group_index]
+        if missing:
+            raise ValueError(f"unknown group(s): {', '.join(missing)}")
+        shell = shell or DEFAULT_SHELL
+        home = f"/home/{username}"
+        gecos = ""
+        check_field("shell", shell, path=True)
+        check_field("home", home, path=True)
+        check_field("gecos", gecos)
+        uid = next(self.free_uids, None)
+        if uid is None:
+            raise ValueError("no free UID left")
+        # A user private group, sharing the UID's number when it is free
+        gid = uid if uid not in self.gids else next(self.free_gids, None)
+        if gid is None:
+            raise ValueError("no free GID left")
+
+        self.uids.add(uid)
+        self.gids.add(gid)
+        self.user_names.add(username)
+        self.new_groups.add(username)
+        for group in groups:
+            self.members.setdefault(group, []).append(username)
+        user = {
+            "name": username,
+            "uid": uid,
+            "gid": gid,
+            "gecos": gecos,
+            "home": home,
+            "shell": shell,
+        }
+        self.users.append(user)
+        return user
+
+    def existing(self, username):
+        """passwd fields of an account already in the files"""
+        index = self.passwd_index.get(username)
+        if index is None or username in self.removed:
+            raise ValueError(f"user '{username}' does not exist")
+        parts = self.lines["passwd"][index].split(":")
+        return {
+            "name": username,
+            "uid": int(parts[2]),
+            "gid": int(parts[3]),
+            "home": parts[5] if len(parts) > 5 else "",
+        }
+
+    def remove(self, username):
+        """Queue deleting an account, its private group and memberships"""
+        user = self.existing(username)
+        self.user_names.discard(username)
+        self.removed[username] = user
+        return user
+
+    def lock(self, username):
+        """Queue locking an account's password, as passwd -l does"""
+        if "shadow" not in self.files:
+            raise ValueError("no shadow file to lock accounts in")
+        self.existing(username)
+        self.locked.add(username)
+
+    def changed(self):
+        return bool(self.users or self.removed or self.locked)
+
+    def drop_removed(self, lines):
+        """Remove deleted users, their memberships and private groups"""
+        for name in ("passwd", "shadow"):
+            if name in lines:
+                lines[name] = [
+                    line
+                    for line in lines[name]
+                    if line.split(":", 1)[0] not in self.removed
+                ]
+        # Like userdel, a user's group goes only if nobody else has it as
+        # their primary group
+        primary = set()
+        for line in lines["passwd"]:
+            parts = line.split(":")
+            if len(parts) > 3 and parts[3].isdigit():
+                primary.add(int(parts[3]))
+        dropped = set()
+        for line in lines["group"]:
+            parts = line.split(":")
+            user = self.removed.get(parts[0])
+            if (
+                user
+                and len(parts) > 2
+                and parts[2] == str(user["gid"])
+                and user["gid"] not in primary
+            ):
+                dropped.add(parts[0])
+        for name in ("group", "gshadow"):
+            if name not in lines:
+                continue
+            kept = []
+            for line in lines[name]:
+                parts = line.split(":")
+                if parts[0] in dropped:
+                    continue
+                if len(parts) > 3:
+                    members = [m for m in parts[3].split(",") if m]
+                    parts[3] = ",".join(m for m in members if m not in self.removed)
+                kept.append(":".join(parts))
+            lines[name] = kept
+
+    def render(self):
+        """Return {file name: new lines} for every account file"""
+        days = int(time.time() // 86400)
+        aging = ":".join(
+            str(self.defs[key]) if self.defs[key] >= 0 else ""
+            for key in ("PASS_MIN_DAYS", "PASS_MAX_DAYS", "PASS_WARN_AGE")
+        )
+        lines = {name: list(old) for name, old in self.lines.items()}
+        for group, names in self.members.items():
+            # The member list is the fourth field in both group and gshadow
+            for name, index in (
+                ("group", self.group_index.get(group)),
+                ("gshadow", self.gshadow_index.get(group)),
+            ):
+                if index is None or name not in lines:
+                    continue
+                parts = lines[name][index].split(":")
+                current = [m for m in parts[3].split(",") if m]
+                parts[3] = ",".join(current + [n for n in names if n not in current])
+                lines[name][index] = ":".join(parts)
+        if self.locked:
+            for i, line in enumerate(lines["shadow"]):
+                parts = line.split(":")
+                if parts[0] in self.locked and not parts[1].startswith("!"):
+                    parts[1] = "!" + parts[1]
+                    lines["shadow"][i] = ":".join(parts)
+        if self.removed:
+            self.drop_removed(lines)
+        for u in self.users:
+            lines["passwd"].append(
+                f"{u['name']}:x:{u['uid']}:{u['gid']}:"
+                f"{u['gecos']}:{u['home']}:{u['shell']}"
+            )
+            lines["group"].append(f"{u['name']}:x:{u['gid']}:")
+            if "shadow" in lines:
+                lines["shadow"].append(f"{u['name']}:!:{days}:{aging}:::")
+            if "gshadow" in lines:
+                lines["gshadow"].append(f"{u['name']}:!::")
+        return lines
+
+    def commit(self):
+        """Write every file as <file>+, then rename them all into place.
+
+        Nothing is touched until all temporary files are written, so a
+        failure leaves the old files intact. The previous versions are kept
+        as <file>-, as shadow-utils does. The new files keep the SELinux
+        label of the old ones, and nscd's cache is flushed after changing
+        the live /etc.
+        """
+        staged = []
+        try:
+            for name, lines in self.render().items():
+                staged.append((write_atomic(self.files[name], lines), name))
+        except BaseException:
+            for tmp_path, _ in staged:
+                os.remove(tmp_path)
+            raise
+        for tmp_path, name in staged:
+            path = self.files[name]
+            backup_path = path + "-"
+            if os.path.exists(backup_path):
+                os.remove(backup_path)
+            os.link(path, backup_path)
+            os.replace(tmp_path, path)
+        dir_fd = os.open(self.etc, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        if os.path.abspath(self.root) == "/":
+            invalidate_nscd()
+
+
+def chown_tree(path, uid, gid):
+    os.lchown(path, uid, gid)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            os.lchown(os.path.join(root, name), uid, gid)
+
+
+def remove_home(root, user):
+    """Delete a removed user's home and mail spool; returns an error or None"""
+    home = user["home"].strip("/")
+    home_path = os.path.join(root, home)
+    mail = os.path.join(root, "var", "mail", user["name"])
+    try:
+        # userdel -r refuses to delete / or a home another account still uses
+        if (
+            home
+            and os.path.isdir(home_path)
+            and not any(u.home.strip("/") == home for u in get_db(root).users())
+        ):
+            shutil.rmtree(home_path)
+        if os.path.exists(mail):
+            os.remove(mail)
+    except OSError as e:
+        return f"home removal failed: {e}"
+    return None
+
+
+def setup_home(root, user, mode, skel, authorized_keys):
+    """Create a home from skel with .ssh/authorized_keys; returns an error or None"""
+    home = os.path.join(root, user["home"].lstrip("/"))
+    try:
+        if os.path.exists(home):
+            return f"home directory {home} already exists, left untouched"
+        if os.path.isdir(skel):
+            shutil.copytree(skel, home, symlinks=True)
+        else:
+            os.makedirs(home)
+        os.chmod(home, mode)
+        if authorized_keys is not None:
+            ssh_dir = os.path.join(home, ".ssh")
+            os.makedirs(ssh_dir, mode=0o700, exist_ok=True)
+            auth_keys = os.path.join(ssh_dir, "authorized_keys")
+            with open(auth_keys, "wb") as f:
+                f.write(authorized_keys)
+            os.chmod(auth_keys, 0o600)
+        if os.geteuid() == 0:
+            chown_tree(home, user["uid"], user["gid"])
+    except OSError as e:
+        return f"home setup failed: {e}"
+    return None
+
+
+def bulk_create_linux(path, root="/", workers=MAX_WORKERS, authorized_keys=None):
+    """Create every account in the CSV in one transaction.
+
+    Returns {"created", "failed", "files_time", "homes_time"} where failed
+    lists (username, reason) for rows that were skipped or whose home setup
+    failed.
+    """
+    keys = None
+    if authorized_keys:
+        # Read up front: a missing key file must fail before any account
+        # is created
+        with open(authorized_keys, "rb") as f:
+            keys = f.read()
+    batch = AccountBatch(root)
+    failed = []
+    start = time.monotonic()
+    lock_files = list(batch.files.values())
+    with PasswdLock(batch.etc, lock_files):
+        batch.load()
+        for line_num, username, groups, shell in read_rows(path):
+            try:
+                batch.add(username, groups, shell)
+            except ValueError as e:
+                failed.append((username, f"line {line_num}: {e}"))
+        if batch.users:
+            batch.commit()
+    files_time = time.monotonic() - start
+
+    skel = os.path.join(batch.etc, "skel")
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        errors = executor.map(
+            lambda u: setup_home(root, u, batch.defs["HOME_MODE"], skel, keys),
+            batch.users,
+        )
+        for user, error in zip(batch.users, errors):
+            if error:
+                failed.append((user["name"], error))
+    return {
+        "created": batch.users,
+        "failed": failed,
+        "files_time": files_time,
+        "homes_time": time.monotonic() - start,
+    }
+
+
+def bulk_create(path):
+    """Create the users one by one, for platforms without /etc/passwd"""
+    create = {
+        "linux": create_user_linux,
+        "macos": create_user_macos,
+        "windows": create_user_windows,
+    }.get(detect_os())
+    if create is None:
+        print("[Error] Unsupported operating system.")
+        return
+    for line_num, username, groups, shell in read_rows(path):
+        print(f"Creating user: {username}")
+        create(username)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create users from a CSV file")
+    parser.add_argument("csv", help="CSV file: username[,groups[,shell]]")
+    parser.add_argument(
+        "--root", default="/", help="Use account files and homes under this prefix"
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="Threads creating home directories",
+    )
+    parser.add_argument(
+        "--authorized-keys",
+        help="Key file installed as every new user's ~/.ssh/authorized_keys "
+        "(default: none)",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    import sys
+    args = parse_args()
+    if detect_os() != "linux":
+        bulk_create(args.csv)
+        sys.exit(0)
 
-    if len(sys.argv) != 2:
-        print("Usage: python3 bulk_create_users.py bulk_users.csv")
+    try:
+        result = bulk_create_linux(
+            args.csv, args.root, args.workers, args.authorized_keys
+        )
+    except (LockError, OSError) as e:
+        print(f"[Error] Bulk creation failed: {e}")
         sys.exit(1)
-    bulk_create(sys.argv[1])
+    for username, reason in result["failed"]:
+        print(f"[Error] {username}: {reason}")
+    if args.authorized_keys and result["created"]:
+        print(f"[i] Installed {args.authorized_keys} as authorized_keys")
+    print(
+        f"[Success] {len(result['created'])} user(s) created, "
+        f"{len(result['failed'])} problem(s)."
+    )
+    print(
+        f"[i] Account files: {result['files_time']:.2f}s | "
+        f"Homes: {result['homes_time']:.2f}s"
+    )
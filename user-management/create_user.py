@@ -15,6 +15,8 @@ import os
 import shutil
 import sys
 
+from account_db import lookup
+
 
 def detect_os():
     os_name = platform.system()
@@ -112,22 +114,13 @@ def create_user_windows(username):
 
 def setup_ssh_unix(username):
     try:
-        user_home = (
-            f"/home/{username}"
-            if os.path.exists(f"/home/{username}")
-            else f"/Users/{username}"
-        )
+        uid, gid, user_home = lookup(username)
         ssh_dir = os.path.join(user_home, ".ssh")
         auth_keys = os.path.join(ssh_dir, "authorized_keys")
 
         os.makedirs(ssh_dir, mode=0o700, exist_ok=True)
         shutil.copy(os.path.expanduser("~/.ssh/authorized_keys"), auth_keys)
         os.chmod(auth_keys, 0o600)
-
-        import pwd
-
-        uid = pwd.getpwnam(username).pw_uid
-        gid = pwd.getpwnam(username).pw_gid
         os.chown(ssh_dir, uid, gid)
         os.chown(auth_keys, uid, gid)
 
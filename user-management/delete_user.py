@@ -1,29 +1,71 @@
 import os
+import sys
+import argparse
 import platform
 import subprocess
-import sys
+
+from batch import MAX_WORKERS, read_lines, run_batch, report
+
+
+def delete_command(username, os_type=None):
+    """argv that deletes username, or None on an unsupported OS"""
+    os_type = os_type or platform.system()
+    if os_type == "Linux" or os_type == "Darwin":
+        return ["sudo", "userdel", "-r", username]
+    elif os_type == "Windows":
+        return ["powershell", "-Command", f'Remove-LocalUser -Name "{username}"']
+    return None
 
 
 def delete_user(username):
-    os_type = platform.system()
+    command = delete_command(username)
+    if command is None:
+        print("Unsupported OS")
+        return
     try:
-        if os_type == "Linux" or os_type == "Darwin":
-            subprocess.run(["sudo", "userdel", "-r", username], check=True)
-        elif os_type == "Windows":
-            subprocess.run(
-                ["powershell", "-Command", f'Remove-LocalUser -Name "{username}"'],
-                check=True,
-            )
-        else:
-            print("Unsupported OS")
-            return
+        subprocess.run(command, check=True)
         print(f"[Success] User '{username}' deleted successfully.")
     except subprocess.CalledProcessError:
         print(f"[Error] Failed to delete user '{username}'.")
 
 
+def delete_users(names, workers=MAX_WORKERS):
+    """Delete many users concurrently; yields (username, ok, detail).
+
+    userdel serializes on the password database lock, so the workers
+    overlap process startup, sudo and home directory removal rather than
+    the account file updates themselves.
+    """
+    os_type = platform.system()
+    return run_batch(names, lambda name: delete_command(name, os_type), workers)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Delete users")
+    parser.add_argument("username", nargs="?", help="User to delete")
+    parser.add_argument(
+        "-f", "--file", help="File with one username per line ('-' for stdin)"
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="Deletions run at once in batch mode",
+    )
+    args = parser.parse_args()
+    if bool(args.username) == bool(args.file):
+        parser.error("give either a username or --file")
+    return args
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 delete_user.py <username>")
+    args = parse_args()
+    if args.username:
+        delete_user(args.username)
+        sys.exit(0)
+    if delete_command("", platform.system()) is None:
+        print("Unsupported OS")
         sys.exit(1)
-    delete_user(sys.argv[1])
+    failed = report(delete_users(read_lines(args.file), args.workers), "deleted")
+    sys.exit(1 if failed else 0)
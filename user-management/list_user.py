@@ -1,20 +1,71 @@
+import sys
+import csv
+import json
+import argparse
 import platform
 import subprocess
 
+from account_db import get_db
 
-def list_users():
+FIELDS = ["name", "uid", "gid", "gecos", "home", "shell"]
+
+
+def list_users(fmt="text", min_uid=1000, **filters):
+    """Print local users; fmt is "text" (names), "json" or "csv".
+
+    Rows are written as they are produced, so large account files are
+    never held twice in memory.
+    """
     os_type = platform.system()
     if os_type == "Linux" or os_type == "Darwin":
-        with open("/etc/passwd") as f:
-            for line in f:
-                parts = line.split(":")
-                if int(parts[2]) >= 1000 and parts[0] != "nobody":
-                    print(parts[0])
+        users = (
+            u for u in get_db().users(min_uid=min_uid, **filters) if u.name != "nobody"
+        )
+        out = sys.stdout
+        if fmt == "csv":
+            writer = csv.writer(out)
+            writer.writerow(FIELDS)
+            writer.writerows(users)
+        elif fmt == "json":
+            out.write("[")
+            for i, u in enumerate(users):
+                out.write(",\n" if i else "\n")
+                out.write(json.dumps(u._asdict()))
+            out.write("\n]\n")
+        else:
+            for u in users:
+                print(u.name)
     elif os_type == "Windows":
         subprocess.run(["powershell", "-Command", "Get-LocalUser | Select Name"])
     else:
         print("Unsupported OS")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="List local users")
+    parser.add_argument(
+        "-f", "--format", choices=["text", "json", "csv"], default="text"
+    )
+    parser.add_argument(
+        "--all", action="store_true", help="Include system accounts (UID < 1000)"
+    )
+    parser.add_argument("--group", help="Only members of this group")
+    parser.add_argument("--shell", help="Only users with this login shell")
+    parser.add_argument(
+        "--locked",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Only locked (or with --no-locked, unlocked) accounts; needs root",
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    list_users()
+    args = parse_args()
+    list_users(
+        args.format,
+        min_uid=None if args.all else 1000,
+        group=args.group,
+        shell=args.shell,
+        locked=args.locked,
+    )
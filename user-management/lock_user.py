@@ -1,33 +1,67 @@
+import sys
+import argparse
 import platform
 import subprocess
-import sys
+
+from batch import MAX_WORKERS, read_lines, run_batch, report
+
+
+def lock_command(username, os_type=None):
+    """argv that locks username, or None on an unsupported OS"""
+    os_type = os_type or platform.system()
+    if os_type == "Linux":
+        return ["sudo", "passwd", "-l", username]
+    elif os_type == "Darwin":
+        return ["sudo", "pwpolicy", "-u", username, "-setpolicy", "isDisabled=1"]
+    elif os_type == "Windows":
+        return ["powershell", "-Command", f'Disable-LocalUser -Name "{username}"']
+    return None
 
 
 def lock_user(username):
-    os_type = platform.system()
+    command = lock_command(username)
+    if command is None:
+        print("Unsupported OS")
+        return
     try:
-        if os_type == "Linux":
-            subprocess.run(["sudo", "passwd", "-l", username], check=True)
-        elif os_type == "Darwin":
-            subprocess.run(
-                ["sudo", "pwpolicy", "-u", username, "-setpolicy", "isDisabled=1"],
-                check=True,
-            )
-        elif os_type == "Windows":
-            subprocess.run(
-                ["powershell", "-Command", f'Disable-LocalUser -Name "{username}"'],
-                check=True,
-            )
-        else:
-            print("Unsupported OS")
-            return
+        subprocess.run(command, check=True)
         print(f"[Success] User '{username}' locked.")
     except subprocess.CalledProcessError:
         print(f"[Error] Failed to lock user '{username}'.")
 
 
+def lock_users(names, workers=MAX_WORKERS):
+    """Lock many users concurrently; yields (username, ok, detail)"""
+    os_type = platform.system()
+    return run_batch(names, lambda name: lock_command(name, os_type), workers)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Lock user accounts")
+    parser.add_argument("username", nargs="?", help="User to lock")
+    parser.add_argument(
+        "-f", "--file", help="File with one username per line ('-' for stdin)"
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="Locks run at once in batch mode",
+    )
+    args = parser.parse_args()
+    if bool(args.username) == bool(args.file):
+        parser.error("give either a username or --file")
+    return args
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 lock_user.py <username>")
+    args = parse_args()
+    if args.username:
+        lock_user(args.username)
+        sys.exit(0)
+    if lock_command("", platform.system()) is None:
+        print("Unsupported OS")
         sys.exit(1)
-    lock_user(sys.argv[1])
+    failed = report(lock_users(read_lines(args.file), args.workers), "locked")
+    sys.exit(1 if failed else 0)
@@ -1,7 +1,18 @@
+import re
+import sys
+import time
 import getpass
+import argparse
 import platform
+import threading
 import subprocess
 
+from batch import MAX_WORKERS, read_lines, run_batch, report
+
+CHPASSWD = ["sudo", "chpasswd"]
+BATCH_REJECTED = "not changed: another line of the batch failed"
+CHPASSWD_LINE = re.compile(r"\(line (\d+)[^)]*\)\s*(.*)|line (\d+):\s*(.*)")
+
 
 def reset_password(username):
     password = getpass.getpass(prompt="Enter new password: ")
@@ -15,19 +26,141 @@ def reset_password(username):
                 check=True,
             )
         elif os_type == "Windows":
-            subprocess.run(
-                [
-                    "powershell",
-                    "-Command",
-                    f'Set-LocalUser -Name "{username}" -Password (ConvertTo-SecureString "{password}" -AsPlainText -Force)',
-                ],
-                check=True,
-            )
+            subprocess.run(windows_command(username, password), check=True)
         print(f"[Success] Password for '{username}' reset.")
     except subprocess.CalledProcessError as e:
         print(f"[Error] Failed to reset password: {e}")
 
 
+def windows_command(username, password):
+    return [
+        "powershell",
+        "-Command",
+        f'Set-LocalUser -Name "{username}" -Password (ConvertTo-SecureString "{password}" -AsPlainText -Force)',
+    ]
+
+
+def parse_pairs(lines, invalid, line_numbers):
+    """Yield (username, password) from user:password lines.
+
+    Malformed lines are stored in invalid as results, keyed by their
+    position in the input; the position of every pair yielded is appended
+    to line_numbers.
+    """
+    for i, line in enumerate(lines, start=1):
+        username, sep, password = line.partition(":")
+        if not sep or not username or not password:
+            invalid[i] = (username or line, False, "expected user:password")
+            continue
+        line_numbers.append(i)
+        yield username, password
+
+
+def chpasswd_batch(pairs, command=CHPASSWD):
+    """Set every password with one chpasswd run; returns the results.
+
+    Pairs are streamed to chpasswd's stdin, so only usernames are kept.
+    chpasswd reports failures by input line, which map back to users.
+    Without PAM (e.g. with -R) one bad line makes chpasswd drop the whole
+    batch; the other users are then reported with BATCH_REJECTED.
+    """
+    proc = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    errors = []
+    reader = threading.Thread(target=lambda: errors.extend(proc.stderr))
+    reader.start()
+    names = []
+    exited_early = False
+    try:
+        try:
+            for username, password in pairs:
+                names.append(username)
+                proc.stdin.write(f"{username}:{password}\n")
+        finally:
+            proc.stdin.close()
+    except BrokenPipeError:
+        # chpasswd exited before reading everything; the users not written
+        # are still reported
+        exited_early = True
+        names.extend(username for username, _ in pairs)
+    finally:
+        proc.wait()
+        reader.join()
+
+    failed = {}
+    for line in errors:
+        m = CHPASSWD_LINE.search(line)
+        if m:
+            line_num = int(m.group(1) or m.group(3))
+            failed.setdefault(line_num, (m.group(2) or m.group(4)).strip())
+    if exited_early or proc.returncode != 0 and not failed:
+        # Failed as a whole (sudo, missing chpasswd), or stopped reading
+        # part way: no user can be reported as changed
+        detail = errors[-1].strip() if errors else f"exit status {proc.returncode}"
+        return [
+            (name, False, failed.get(i, detail))
+            for i, name in enumerate(names, start=1)
+        ]
+    rejected = any("changes ignored" in line for line in errors)
+    return [
+        (
+            name,
+            i not in failed and not rejected,
+            failed.get(i, BATCH_REJECTED if rejected else ""),
+        )
+        for i, name in enumerate(names, start=1)
+    ]
+
+
+def reset_passwords(lines, workers=MAX_WORKERS):
+    """Reset passwords from user:password lines.
+
+    Returns (username, ok, detail) for every line, in input order.
+    """
+    results = {}
+    line_numbers = []
+    pairs = parse_pairs(lines, results, line_numbers)
+    if platform.system() == "Windows":
+        changed = [
+            (pair[0], ok, detail)
+            for pair, ok, detail in run_batch(
+                pairs, lambda pair: windows_command(*pair), workers
+            )
+        ]
+    else:
+        changed = chpasswd_batch(pairs)
+    results.update(zip(line_numbers, changed))
+    return [results[i] for i in sorted(results)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Reset user passwords")
+    parser.add_argument(
+        "-f",
+        "--file",
+        help="File with one user:password pair per line ('-' for stdin)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=MAX_WORKERS,
+        help="Resets run at once on Windows in batch mode",
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    user = input("Enter the username: ")
-    reset_password(user)
+    args = parse_args()
+    if not args.file:
+        user = input("Enter the username: ")
+        reset_password(user)
+        sys.exit(0)
+    start = time.monotonic()
+    results = reset_passwords(read_lines(args.file, passwords=True), args.workers)
+    failed = report(results, "password reset", start)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,442 @@
+"""
+User-management agent: a long-lived daemon serving account operations over
+a Unix-domain socket, so automation does not pay interpreter start-up,
+imports and a sudo exec for every small request.
+
+Protocol: one JSON object per line in each direction.
+    -> {"id": 1, "op": "create_user_linux", "args": {"username": "alice"}}
+    <- {"id": 1, "ok": true, "result": {"name": "alice", "uid": 1001, ...}}
+    <- {"id": 2, "ok": false, "error": "user 'bob' does not exist"}
+
+Ops and their args:
+    create_user_linux   username, groups (list), shell
+    delete_user         username
+    lock_user           username
+    reset_password      username, password
+    list_users          min_uid, max_uid, shell, group, locked (all optional)
+
+Requests may be pipelined: a client can send many before reading any
+reply. Replies carry the request id and can arrive out of order, because
+list_users is answered at once from the account_db cache while changes
+wait for the writer.
+
+All changes go through a single writer thread. It takes every request
+queued so far and applies them as one AccountBatch transaction (one lock,
+one rewrite of each account file), then sets the queued passwords with one
+chpasswd run. Home directories are created or removed after the commit.
+Two requests for the same user are never put in the same transaction, so
+they apply in the order they were sent.
+
+The socket is created mode 0600 and only root (plus --allow-uid) may
+connect. Clients other than root may only change regular accounts: targets
+outside UID_MIN..UID_MAX or in a privileged group, and new members for a
+privileged group, are refused, since any of them would hand out root.
+Linux only; run as root.
+
+Example of usage:
+    sudo python3 user_agent.py --socket /run/user_agent.sock &
+    python3 user_client.py create_user_linux alice
+"""
+
+import os
+import sys
+import json
+import queue
+import socket
+import signal
+import struct
+import argparse
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+
+from account_db import get_db
+from bulk_create_users import (
+    NAME_MAX,
+    NAME_RE,
+    AccountBatch,
+    LockError,
+    PasswdLock,
+    check_field,
+    read_login_defs,
+    remove_home,
+    setup_home,
+)
+from reset_password import BATCH_REJECTED, chpasswd_batch
+
+SOCKET_PATH = "/run/user_agent.sock"
+MAX_BATCH = 1024
+HOME_WORKERS = 8
+ACCOUNT_OPS = {"create_user_linux", "delete_user", "lock_user"}
+WRITE_OPS = ACCOUNT_OPS | {"reset_password"}
+LIST_FILTERS = {"min_uid", "max_uid", "shell", "group", "locked"}
+# Membership in these, or in any group below GID_MIN, is as good as root
+PRIVILEGED_GROUPS = {
+    "root",
+    "sudo",
+    "wheel",
+    "admin",
+    "adm",
+    "shadow",
+    "disk",
+    "docker",
+    "lxd",
+}
+
+
+def valid_name(name):
+    return isinstance(name, str) and len(name) <= NAME_MAX and NAME_RE.match(name)
+
+
+def check_write_args(op, args):
+    """Error message for malformed change arguments, or None.
+
+    Clients may be unprivileged (--allow-uid), and these values end up in
+    the account files, so they are checked before anything is queued.
+    """
+    if not isinstance(args.get("username"), str):
+        return "username is required"
+    if not valid_name(args["username"]):
+        return f"invalid username {args['username']!r}"
+    if op != "create_user_linux":
+        return None
+    groups = args.get("groups")
+    if groups is not None and (
+        not isinstance(groups, list) or not all(valid_name(g) for g in groups)
+    ):
+        return "groups must be a list of group names"
+    shell = args.get("shell")
+    if shell is not None:
+        try:
+            check_field("shell", shell, path=True)
+        except ValueError as e:
+            return str(e)
+    return None
+
+
+class Agent:
+    def __init__(self, root="/"):
+        self.root = root
+        self.db = get_db(root)
+        self.queue = queue.Queue()
+        self.homes = ThreadPoolExecutor(max_workers=HOME_WORKERS)
+        if root == "/":
+            self.chpasswd = ["chpasswd"]
+        else:
+            # PAM is not configured inside a scratch root, and chpasswd only
+            # skips it when given an explicit hash method
+            self.chpasswd = ["chpasswd", "-R", os.path.abspath(root), "-c", "SHA512"]
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def privileged_group(self, name, defs):
+        group = self.db.group(name)
+        return name in PRIVILEGED_GROUPS or (
+            group is not None and group.gid < defs["GID_MIN"]
+        )
+
+    def check_target(self, op, args):
+        """Error message if a client other than root may not make this change.
+
+        Resetting root's password, or creating a user in sudo, would give an
+        --allow-uid client root, so only regular accounts may be touched.
+        """
+        defs = read_login_defs(os.path.join(self.root, "etc"))
+        user = self.db.user(args["username"])
+        if user is not None:
+            if not defs["UID_MIN"] <= user.uid <= defs["UID_MAX"]:
+                return f"'{user.name}' is a system account; only root may change it"
+            for name in self.db.groups_of(user.name):
+                if self.privileged_group(name, defs):
+                    return (
+                        f"'{user.name}' is in privileged group '{name}';"
+                        " only root may change it"
+                    )
+        if op == "create_user_linux":
+            for name in args.get("groups") or ():
+                if self.privileged_group(name, defs):
+                    return f"only root may add users to privileged group '{name}'"
+        return None
+
+    def dispatch(self, request, reply, peer_uid):
+        """Handle one request from a client running as peer_uid;
+        reply(message) is called exactly once"""
+        request_id = request.get("id") if isinstance(request, dict) else None
+        answered = []
+        answer_lock = threading.Lock()
+
+        def respond(result=None, error=None):
+            # Home jobs and the writer may both answer: only the first counts
+            with answer_lock:
+                if answered:
+                    return
+                answered.append(True)
+            if error is None:
+                reply({"id": request_id, "ok": True, "result": result})
+            else:
+                reply({"id": request_id, "ok": False, "error": error})
+
+        if not isinstance(request, dict):
+            return respond(error="request must be a JSON object")
+        op = request.get("op")
+        args = request.get("args") or {}
+        if not isinstance(args, dict):
+            return respond(error="args must be an object")
+        if op == "list_users":
+            unknown = set(args) - LIST_FILTERS
+            if unknown:
+                return respond(error=f"unknown filter(s): {', '.join(sorted(unknown))}")
+            try:
+                users = [u._asdict() for u in self.db.users(**args)]
+            except (OSError, TypeError) as e:
+                return respond(error=str(e))
+            return respond(users)
+        if op not in WRITE_OPS:
+            return respond(error=f"unknown op '{op}'")
+        error = check_write_args(op, args)
+        if error is None and peer_uid != 0:
+            error = self.check_target(op, args)
+        if error:
+            return respond(error=error)
+        if op == "reset_password":
+            password = args.get("password")
+            if not isinstance(password, str) or not password:
+                return respond(error="password is required")
+            # chpasswd reads user:password lines; the username has no ":"
+            if "\n" in password or "\r" in password:
+                return respond(error="password contains a newline")
+        self.queue.put((op, args, respond))
+
+    def write_loop(self):
+        while True:
+            pending = [self.queue.get()]
+            while len(pending) < MAX_BATCH:
+                try:
+                    pending.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Split wherever a user comes up again, so per-user order holds
+            group, touched = [], set()
+            for item in pending:
+                username = item[1]["username"]
+                if username in touched:
+                    self.apply_safely(group)
+                    group, touched = [], set()
+                group.append(item)
+                touched.add(username)
+            self.apply_safely(group)
+
+    def apply_safely(self, items):
+        """Apply account changes, then password resets, answering every
+        request even if a step fails unexpectedly.
+
+        The steps fail separately: a chpasswd failure only reaches the
+        reset requests, not changes already committed.
+        """
+        account_ops = [item for item in items if item[0] in ACCOUNT_OPS]
+        resets = [item for item in items if item[0] == "reset_password"]
+        for apply, group in (
+            (self.apply_accounts, account_ops),
+            (self.apply_resets, resets),
+        ):
+            if not group:
+                continue
+            try:
+                apply(group)
+            except Exception as e:
+                print(f"[Error] Writer failed: {e}")
+                for _, _, respond in group:
+                    respond(error=f"internal error: {e}")
+
+    def apply_resets(self, resets):
+        while resets:
+            results = chpasswd_batch(
+                ((args["username"], args["password"]) for _, args, _ in resets),
+                self.chpasswd,
+            )
+            retry = []
+            for item, (username, ok, detail) in zip(resets, results):
+                if detail == BATCH_REJECTED:
+                    retry.append(item)
+                elif ok:
+                    item[2]({"name": username})
+                else:
+                    item[2](error=detail)
+            if len(retry) == len(resets):
+                # No line was singled out, so a rerun would fail the same way
+                for _, _, respond in retry:
+                    respond(error=BATCH_REJECTED)
+                break
+            # Rerun the lines chpasswd dropped because of another bad line
+            resets = retry
+
+    def apply_accounts(self, items):
+        batch = AccountBatch(self.root)
+        accepted = []
+        try:
+            with PasswdLock(batch.etc, list(batch.files.values())):
+                batch.load()
+                for op, args, respond in items:
+                    try:
+                        if op == "create_user_linux":
+                            user = batch.add(
+                                args["username"],
+                                args.get("groups") or (),
+                                args.get("shell"),
+                            )
+                        elif op == "delete_user":
+                            user = batch.remove(args["username"])
+                        else:
+                            batch.lock(args["username"])
+                            user = {"name": args["username"]}
+                    except (ValueError, TypeError) as e:
+                        respond(error=str(e))
+                        continue
+                    accepted.append((op, user, respond))
+                if accepted:
+                    batch.commit()
+        except (LockError, OSError) as e:
+            for _, _, respond in items:
+                respond(error=f"account files not updated: {e}")
+            return
+
+        for op, user, respond in accepted:
+            if op == "create_user_linux":
+                job = self.homes.submit(
+                    setup_home,
+                    self.root,
+                    user,
+                    batch.defs["HOME_MODE"],
+                    os.path.join(batch.etc, "skel"),
+                    None,
+                )
+            elif op == "delete_user":
+                job = self.homes.submit(remove_home, self.root, user)
+            else:
+                respond(user)
+                continue
+            job.add_done_callback(
+                lambda f, user=user, respond=respond: home_done(f, user, respond)
+            )
+
+
+def home_done(future, user, respond):
+    """Answer a create or delete once its home job ends, however it ends.
+
+    setup_home and remove_home return an error string for OSError, but
+    anything else would be raised here; the request must still be
+    answered, or the client waits forever.
+    """
+    try:
+        error = future.result()
+    except Exception as e:
+        error = f"home directory not updated: {e}"
+    if error is None:
+        respond(user)
+    else:
+        respond(error=error)
+
+
+class AgentHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        peer_uid = self.server.peer_uid(self.request)
+        if peer_uid not in self.server.allowed_uids:
+            self.wfile.write(b'{"id": null, "ok": false, "error": "not allowed"}\n')
+            return
+        send_lock = threading.Lock()
+        done = threading.Condition()
+        outstanding = 0
+
+        def reply(message):
+            nonlocal outstanding
+            data = (json.dumps(message) + "\n").encode()
+            with send_lock:
+                try:
+                    self.wfile.write(data)
+                except OSError:
+                    pass  # the client went away
+            with done:
+                outstanding -= 1
+                done.notify_all()
+
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            with done:
+                outstanding += 1
+            try:
+                request = json.loads(line)
+            except ValueError:
+                reply({"id": None, "ok": False, "error": "invalid JSON"})
+                continue
+            self.server.agent.dispatch(request, reply, peer_uid)
+        # The client may half-close after pipelining: answer everything first
+        with done:
+            done.wait_for(lambda: outstanding == 0)
+
+
+class AgentServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, agent, allowed_uids=()):
+        self.agent = agent
+        self.allowed_uids = {0, *allowed_uids}
+        if os.path.exists(path):
+            os.remove(path)
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(path, AgentHandler)
+        finally:
+            os.umask(old_umask)
+        if allowed_uids:
+            # Other users need write access to connect; SO_PEERCRED still
+            # decides who is served
+            os.chmod(path, 0o666)
+
+    def peer_uid(self, sock):
+        creds = sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        pid, uid, gid = struct.unpack("3i", creds)
+        return uid
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="User-management agent")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Socket path")
+    parser.add_argument(
+        "--root", default="/", help="Use account files and homes under this prefix"
+    )
+    parser.add_argument(
+        "--allow-uid",
+        type=int,
+        action="append",
+        default=[],
+        help="Also accept clients running as this UID (repeatable). They may "
+        "create, change and delete regular accounts, but not system accounts "
+        "or members of privileged groups. Accounts given root through their "
+        "own sudoers rules are not detected: do not allow a UID you would "
+        "not trust with those",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if sys.platform != "linux":
+        print("[Error] The agent is only supported on Linux.")
+        sys.exit(1)
+    server = AgentServer(args.socket, Agent(args.root), args.allow_uid)
+    print(f"[i] Agent listening on {args.socket} (root {args.root})")
+    # shutdown() waits for serve_forever(), so it must run on another thread
+    signal.signal(
+        signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start()
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+        print("[i] Agent stopped")
@@ -0,0 +1,335 @@
+"""
+Thin client for user_agent.py.
+
+Only needs the standard library and batch.py, so it starts quickly. With
+-f the requests are pipelined: all of them are sent on one connection
+while the replies are read back.
+
+Example of usage:
+    python3 user_client.py create_user_linux alice --groups sudo
+    python3 user_client.py lock_user -f offboarding.txt
+    python3 user_client.py reset_password -f passwords.txt
+    python3 user_client.py list_users --format csv
+    python3 user_client.py bench -n 2000 --mutate
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import socket
+import getpass
+import argparse
+import threading
+import subprocess
+
+from batch import read_lines, report
+
+SOCKET_PATH = "/run/user_agent.sock"
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class AgentError(Exception):
+    pass
+
+
+class AgentClient:
+    def __init__(self, path=SOCKET_PATH):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile("rb")
+        self.next_id = 0
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def read_reply(self):
+        line = self.rfile.readline()
+        if not line:
+            raise AgentError("agent closed the connection")
+        try:
+            reply = json.loads(line)
+        except ValueError:
+            raise AgentError(f"protocol error: invalid reply {line[:80]!r}")
+        if not isinstance(reply, dict) or "ok" not in reply:
+            raise AgentError(f"protocol error: invalid reply {line[:80]!r}")
+        return reply
+
+    def call(self, op, **args):
+        """Send one request and wait for its result; raises AgentError"""
+        self.next_id += 1
+        request = {"id": self.next_id, "op": op, "args": args}
+        self.sock.sendall((json.dumps(request) + "\n").encode())
+        reply = self.read_reply()
+        if not reply["ok"]:
+            raise AgentError(reply["error"])
+        return reply["result"]
+
+    def pipeline(self, requests):
+        """Send (op, args) requests without waiting; yields (index, reply).
+
+        Replies come back in completion order. Requests are written from a
+        separate thread, so neither side can block on a full socket buffer.
+        """
+        first_id = self.next_id + 1
+        state = {"sent": 0, "finished": False}
+        cond = threading.Condition()
+
+        def send():
+            try:
+                for op, args in requests:
+                    self.next_id += 1
+                    request = {"id": self.next_id, "op": op, "args": args}
+                    self.sock.sendall((json.dumps(request) + "\n").encode())
+                    with cond:
+                        state["sent"] += 1
+                        cond.notify()
+            except OSError:
+                pass  # the reader stopped early and shut the socket down
+            finally:
+                with cond:
+                    state["finished"] = True
+                    cond.notify()
+
+        sender = threading.Thread(target=send)
+        sender.start()
+        received = 0
+        try:
+            while True:
+                with cond:
+                    cond.wait_for(
+                        lambda: received < state["sent"] or state["finished"]
+                    )
+                    if received >= state["sent"]:
+                        break
+                reply = self.read_reply()
+                received += 1
+                index = reply.get("id")
+                if not isinstance(index, int) or not (
+                    first_id <= index < first_id + state["sent"]
+                ):
+                    # The agent answers unparseable lines and refused
+                    # connections with "id": null
+                    raise AgentError(
+                        f"protocol error: reply without a request id: "
+                        f"{reply.get('error', reply)}"
+                    )
+                yield index - first_id, reply
+        except BaseException:
+            # Stop the sender, which may be blocked on a full socket buffer
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            raise
+        finally:
+            sender.join()
+
+
+def request_lines(op, lines):
+    """Turn input lines into (op, args) requests for a pipelined batch"""
+    for line in lines:
+        if op == "reset_password":
+            username, _, password = line.partition(":")
+            yield op, {"username": username, "password": password}
+        else:
+            yield op, {"username": line}
+
+
+def run_batch(client, op, lines):
+    """Pipeline one request per input line; yields (username, ok, detail)"""
+    names = []
+
+    def requests():
+        for request in request_lines(op, lines):
+            names.append(request[1]["username"])
+            yield request
+
+    for index, reply in client.pipeline(requests()):
+        if reply["ok"]:
+            yield names[index], True, ""
+        else:
+            yield names[index], False, reply["error"]
+
+
+def time_calls(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count
+
+
+def time_pipeline(client, op, names, succeeded):
+    """Pipeline op for every name, appending each success to succeeded"""
+    start = time.perf_counter()
+    failed = 0
+    for index, reply in client.pipeline((op, {"username": name}) for name in names):
+        if reply["ok"]:
+            succeeded.append(names[index])
+        else:
+            failed += 1
+    per_op = (time.perf_counter() - start) / max(len(names), 1)
+    print(
+        f"[i] Agent, pipelined {op}: {per_op * 1e3:.3f} ms/op"
+        + (f" ({failed} failed)" if failed else "")
+    )
+
+
+def benchmark(path, count, script_runs, mutate):
+    client = AgentClient(path)
+    sequential = time_calls(lambda: client.call("list_users", min_uid=1000), count)
+    print(f"[i] Agent, sequential list_users: {sequential * 1e3:.3f} ms/op")
+
+    start = time.perf_counter()
+    for _ in client.pipeline(("list_users", {"min_uid": 1000}) for _ in range(count)):
+        pass
+    pipelined = (time.perf_counter() - start) / count
+    print(f"[i] Agent, pipelined list_users: {pipelined * 1e3:.3f} ms/op")
+
+    if mutate:
+        names = [f"bench{os.getpid()}_{i}" for i in range(count)]
+        created = []
+        try:
+            time_pipeline(client, "create_user_linux", names, created)
+            time_pipeline(client, "lock_user", created, [])
+        finally:
+            # These are real accounts: remove every one this run created,
+            # even after an error or ^C, and never one that existed before
+            cleanup = AgentClient(path)
+            try:
+                time_pipeline(cleanup, "delete_user", created, [])
+            finally:
+                cleanup.close()
+    client.close()
+
+    script = os.path.join(HERE, "list_user.py")
+    per_run = time_calls(
+        lambda: subprocess.run(
+            [sys.executable, script], stdout=subprocess.DEVNULL, check=True
+        ),
+        script_runs,
+    )
+    print(f"[i] Script, python3 list_user.py: {per_run * 1e3:.3f} ms/op")
+    startup = time_calls(
+        lambda: subprocess.run(
+            [sys.executable, "-c", "import create_user; create_user.detect_os()"],
+            cwd=HERE,
+            check=True,
+        ),
+        script_runs,
+    )
+    print(
+        f"[i] Script start-up alone (interpreter, imports, OS detection): "
+        f"{startup * 1e3:.3f} ms/op, before any sudo or useradd exec"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Client for user_agent.py")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Agent socket path")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for op, help_text in (
+        ("create_user_linux", "Create a user"),
+        ("delete_user", "Delete a user and their home"),
+        ("lock_user", "Lock a user's password"),
+        ("reset_password", "Set a user's password (prompts unless -f)"),
+    ):
+        p = sub.add_parser(op, help=help_text)
+        p.add_argument("username", nargs="?", help="User to act on")
+        p.add_argument(
+            "-f",
+            "--file",
+            help="One username (user:password for reset_password) per line, "
+            "'-' for stdin; requests are pipelined",
+        )
+        if op == "create_user_linux":
+            p.add_argument("--groups", nargs="*", default=[], help="Extra groups")
+            p.add_argument("--shell", help="Login shell")
+
+    p = sub.add_parser("list_users", help="List users")
+    p.add_argument("-f", "--format", choices=["text", "json", "csv"], default="text")
+    p.add_argument("--all", action="store_true", help="Include system accounts")
+    p.add_argument("--group", help="Only members of this group")
+
+    p = sub.add_parser("bench", help="Compare agent latency with the scripts")
+    p.add_argument("-n", "--count", type=int, default=1000, help="Agent requests")
+    p.add_argument(
+        "--script-runs", type=int, default=20, help="Script launches to time"
+    )
+    p.add_argument(
+        "--mutate",
+        action="store_true",
+        help="Also create, lock and delete -n throwaway users through the agent "
+        "(real accounts; each one created is deleted again, even on error)",
+    )
+    args = parser.parse_args()
+    if getattr(args, "username", None) and getattr(args, "file", None):
+        parser.error("give either a username or --file")
+    if args.command not in ("list_users", "bench") and not (args.username or args.file):
+        parser.error("a username or --file is required")
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.command == "bench":
+        benchmark(args.socket, args.count, args.script_runs, args.mutate)
+        return
+    try:
+        client = AgentClient(args.socket)
+    except OSError as e:
+        print(f"[Error] Cannot connect to the agent at {args.socket}: {e}")
+        sys.exit(1)
+
+    if args.command == "list_users":
+        filters = {"group": args.group} if args.group else {}
+        if not args.all:
+            filters["min_uid"] = 1000
+        users = [
+            u for u in client.call("list_users", **filters) if u["name"] != "nobody"
+        ]
+        if args.format == "json":
+            json.dump(users, sys.stdout, indent=1)
+            print()
+        elif args.format == "csv":
+            writer = csv.DictWriter(
+                sys.stdout, fieldnames=["name", "uid", "gid", "gecos", "home", "shell"]
+            )
+            writer.writeheader()
+            writer.writerows(users)
+        else:
+            for u in users:
+                print(u["name"])
+        return
+
+    if args.file:
+        start = time.monotonic()
+        failed = report(
+            run_batch(
+                client,
+                args.command,
+                read_lines(args.file, passwords=args.command == "reset_password"),
+            ),
+            args.command,
+            start,
+        )
+        sys.exit(1 if failed else 0)
+
+    request = {"username": args.username}
+    if args.command == "create_user_linux":
+        request.update(groups=args.groups, shell=args.shell)
+    elif args.command == "reset_password":
+        request["password"] = getpass.getpass(prompt="Enter new password: ")
+    try:
+        result = client.call(args.command, **request)
+    except AgentError as e:
+        print(f"[Error] {args.username}: {e}")
+        sys.exit(1)
+    print(f"[Success] {args.command} {args.username}: {json.dumps(result)}")
+
+
+if __name__ == "__main__":
+    main()